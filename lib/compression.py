@@ -0,0 +1,137 @@
+# Copyright (c) 2014 University of California, Los Angeles
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation;
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+#
+# Author: Zhe Wen <wenzhe@cs.ucla.edu>
+
+# at-rest compression of stored content objects
+
+import zlib
+import hashlib
+
+try:
+    import zstandard
+except ImportError:
+    # zstd (and with it dictionary compression) is optional
+    zstandard = None
+
+from repo_exceptions import CompressionException
+
+CODEC_NONE = "none"
+CODEC_ZLIB = "zlib"
+CODEC_ZSTD = "zstd"
+
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 3
+
+# bms cos are a few hundred bytes, so a small dictionary covers them
+DEFAULT_DICTIONARY_SIZE = 8 * 1024
+
+
+def available_codecs():
+    """
+    @return the codecs usable in this installation
+    """
+    codecs = [CODEC_NONE, CODEC_ZLIB]
+    if zstandard:
+        codecs.append(CODEC_ZSTD)
+    return codecs
+
+
+class Dictionary(object):
+    """
+    a compression dictionary trained on the cos under one name prefix
+    """
+    def __init__(self, prefix, data):
+        self.prefix = prefix
+        self.data = data
+        self.dict_id = hashlib.sha256(data).hexdigest()[:16]
+        self._zstd_dict = None
+
+    def zstd_dict(self):
+        if not self._zstd_dict:
+            self._zstd_dict = zstandard.ZstdCompressionDict(self.data)
+        return self._zstd_dict
+
+
+def train_dictionary(prefix, samples, size=DEFAULT_DICTIONARY_SIZE):
+    """
+    @param prefix - name prefix the dictionary is meant for
+    @param samples - list of wired cos to train on
+    @param size - max size of the dictionary in bytes
+    @return the trained Dictionary
+    """
+    if not zstandard:
+        raise CompressionException("dictionary training requires zstandard")
+    if not samples:
+        raise CompressionException("no samples under %s" % prefix)
+
+    try:
+        zstd_dict = zstandard.train_dictionary(size, samples)
+    except zstandard.ZstdError as ex:
+        raise CompressionException(str(ex))
+
+    return Dictionary(prefix, zstd_dict.as_bytes())
+
+
+def compress(data, codec, dictionary=None):
+    """
+    @param data - wired co
+    @param codec - codec to compress with
+    @param dictionary - Dictionary to compress with, zstd only
+    @return (codec, compressed data). data that does not get smaller is
+    returned as is, with CODEC_NONE
+    """
+    if codec == CODEC_ZLIB:
+        compressed = zlib.compress(data, ZLIB_LEVEL)
+    elif codec == CODEC_ZSTD:
+        if not zstandard:
+            raise CompressionException("zstandard is not installed")
+        if dictionary:
+            compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL,
+                    dict_data=dictionary.zstd_dict())
+        else:
+            compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+        compressed = compressor.compress(data)
+    elif codec in [None, CODEC_NONE]:
+        return CODEC_NONE, data
+    else:
+        raise CompressionException("unsupported codec %s" % codec)
+
+    if len(compressed) >= len(data):
+        return CODEC_NONE, data
+    return codec, compressed
+
+
+def decompress(data, codec, dictionary=None):
+    """
+    @param data - data as stored
+    @param codec - codec the data was compressed with
+    @param dictionary - Dictionary the data was compressed with, if any
+    @return the wired co
+    """
+    if codec in [None, CODEC_NONE]:
+        return data
+    elif codec == CODEC_ZLIB:
+        return zlib.decompress(data)
+    elif codec == CODEC_ZSTD:
+        if not zstandard:
+            raise CompressionException("zstandard is not installed")
+        if dictionary:
+            decompressor = zstandard.ZstdDecompressor(
+                    dict_data=dictionary.zstd_dict())
+        else:
+            decompressor = zstandard.ZstdDecompressor()
+        return decompressor.decompress(data)
+    raise CompressionException("unsupported codec %s" % codec)
@@ -0,0 +1,151 @@
+# Copyright (c) 2014 University of California, Los Angeles
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation;
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+#
+# Author: Zhe Wen <wenzhe@cs.ucla.edu>
+
+# prefix level readers-writer locks, so that requests under different
+# prefixes (e.g. buildings) never wait for each other
+
+from pyndn import Name
+
+from contextlib import contextmanager
+import threading
+
+# number of leading name components a lock covers, e.g.
+# /ndn/ucla.edu/bms/building:melnitz
+LOCK_DEPTH = 4
+# number of locks the prefixes are spread over
+LOCK_STRIPES = 64
+
+
+class RWLock(object):
+    """
+    readers-writer lock. waiting writers go first, so a steady stream of
+    readers cannot starve them
+    """
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    def acquire_read(self):
+        with self._cond:
+            while self._writer or self._waiting_writers:
+                self._cond.wait()
+            self._readers += 1
+
+    def release_read(self):
+        with self._cond:
+            self._readers -= 1
+            if not self._readers:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        with self._cond:
+            self._waiting_writers += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._waiting_writers -= 1
+            self._writer = True
+
+    def release_write(self):
+        with self._cond:
+            self._writer = False
+            self._cond.notify_all()
+
+
+class _NullLock(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+_NULL_LOCK = _NullLock()
+
+
+class PrefixLocks(object):
+    """
+    readers-writer locks per name prefix of LOCK_DEPTH components, spread
+    over a fixed number of stripes. a name shorter than that (e.g. the whole
+    bms namespace) locks every stripe. stripes are always taken in the same
+    order, so requests locking several never deadlock
+    """
+    def __init__(self, depth=LOCK_DEPTH, stripes=LOCK_STRIPES,
+            lock_reads=True):
+        """
+        @param lock_reads - whether reads take the locks. a backend whose
+                            writes are atomic to readers (e.g. single
+                            statement transactions) only needs writers to
+                            exclude each other
+        """
+        self.depth = depth
+        self.lock_reads = lock_reads
+        self._locks = [RWLock() for i in range(stripes)]
+
+    def stripes(self, name):
+        """
+        @param name - Name instance or uri
+        @return indexes of the stripes covering the name, in order
+        """
+        name = Name(name)
+        if name.size() < self.depth:
+            return range(len(self._locks))
+        prefix = name.getPrefix(self.depth).toUri()
+        return [hash(prefix) % len(self._locks)]
+
+    @contextmanager
+    def _hold(self, stripes, write):
+        locks = [self._locks[i] for i in stripes]
+        held = []
+        try:
+            for lock in locks:
+                if write:
+                    lock.acquire_write()
+                else:
+                    lock.acquire_read()
+                held.append(lock)
+            yield
+        finally:
+            for lock in reversed(held):
+                if write:
+                    lock.release_write()
+                else:
+                    lock.release_read()
+
+    def read(self, name):
+        """
+        @return context manager holding the name's prefix for reading
+        """
+        if not self.lock_reads:
+            return _NULL_LOCK
+        return self._hold(self.stripes(name), False)
+
+    def write(self, name):
+        """
+        @return context manager holding the name's prefix for writing
+        """
+        return self._hold(self.stripes(name), True)
+
+    def write_many(self, names):
+        """
+        @return context manager holding the prefixes of all names for
+        writing
+        """
+        stripes = set()
+        for name in names:
+            stripes.update(self.stripes(name))
+        return self._hold(sorted(stripes), True)
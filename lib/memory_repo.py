@@ -0,0 +1,532 @@
+# Copyright (c) 2014 University of California, Los Angeles
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation;
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+#
+# Author: Zhe Wen <wenzhe@cs.ucla.edu>
+
+# REPO prototype on an in-process name tree, for tests and benchmarks
+
+from pyndn import Name
+from pyndn import Data
+from pyndn.util import Blob
+
+from repo import Repo
+from repo import PROPERTY_KEY_LOCATOR, PROPERTY_FRESHNESS, \
+        PROPERTY_CONTENT_TYPE, PROPERTY_FINAL_BLOCK_ID, PROPERTY_SIZE, \
+        PROPERTY_ARRIVAL, PROPERTY_EXPIRY, PROPERTY_DIGEST, \
+        MIN_SUFFIX_COMPS, MAX_SUFFIX_COMPS, DELETE_BATCH_SIZE
+from repo_exceptions import UnsupportedQueryException
+import compression
+from metrics import NULL_METRICS
+from locking import PrefixLocks
+from signing import SigningPolicy, SIGN_RSA
+from name_tree import MemoryNode, NO_SEGMENT
+
+import threading
+import time
+import hashlib
+import sys
+
+# segment records are tuples of the payload offset followed by these
+# properties, so that the property names are not stored once per segment
+SEGMENT_FIELDS = [PROPERTY_KEY_LOCATOR, PROPERTY_FRESHNESS,
+        PROPERTY_CONTENT_TYPE, PROPERTY_FINAL_BLOCK_ID, PROPERTY_SIZE,
+        PROPERTY_ARRIVAL, PROPERTY_EXPIRY]
+_KEY_LOCATOR = SEGMENT_FIELDS.index(PROPERTY_KEY_LOCATOR) + 1
+_EXPIRY = SEGMENT_FIELDS.index(PROPERTY_EXPIRY) + 1
+
+
+class MemoryRepo(Repo):
+    """
+    Repo keeping the name tree and payloads in process memory. it follows
+    the same selector pipeline as Repo, with each stage answered from the
+    in-process tree instead of the graph database. segments and payloads
+    live in flat tables, and nodes refer to them by offset
+    """
+    def __init__(self, clear=False, metrics=None, signing_rules=None,
+            signing_default=SIGN_RSA, hmac_key=None):
+        self.metrics = metrics or NULL_METRICS
+        self.root = MemoryNode("ndn")
+        # the tree is changed in place, so readers lock the prefixes they
+        # read, but never more than those
+        self.locks = PrefixLocks()
+        # the prefix locks only keep apart the writers of the same prefix.
+        # what writers of different prefixes share, i.e. the tables below
+        # and the children of the components above the locked prefixes, is
+        # only changed under this lock
+        self._structure = threading.RLock()
+        # segment records, and offsets of the free slots
+        self._segments = []
+        self._free_segments = []
+        # [wired co, number of segments referring to it, digest], and
+        # offsets of the free slots
+        self._payloads = []
+        self._free_payloads = []
+        # digest -> payload offset
+        self._digests = {}
+
+        self._codec = compression.CODEC_NONE
+        self._dictionaries = {}
+        self._prefix_dictionaries = {}
+        self._signing = threading.local()
+        self.signing_policy = SigningPolicy(signing_rules, signing_default,
+                self.key_chain, hmac_key)
+
+    def verify_state(self):
+        # nothing outlives the process
+        pass
+
+    def segment_properties(self, node):
+        """
+        @return the properties of the segment stored under node, as Repo
+        keeps them on segment nodes. None if there is no segment
+        """
+        if node.segment == NO_SEGMENT:
+            return None
+        record = self._segments[node.segment]
+        properties = dict([(key, value) for key, value
+                in zip(SEGMENT_FIELDS, record[1:]) if value is not None])
+        properties[PROPERTY_DIGEST] = self._payloads[record[0]][2]
+        return properties
+
+    def print_tree(self, root=None, level=0):
+        """
+        prints the repo content in tree style
+        """
+        if not root:
+            root = self.root
+
+        for lv in range(level):
+            print '  ',
+        print root.uri(), self.segment_properties(root) or ''
+
+        for node in root.children or []:
+            self.print_tree(node, level + 1)
+
+    def name_to_components(self, name):
+        """
+        @param name - Name instance
+        @return list of the raw components of the name, with the first
+        component (the root) omitted, like name_to_path
+        """
+        return [name.get(i).getValue().toRawStr()
+                for i in range(1, name.size())]
+
+    def is_shared(self, node):
+        """
+        @return whether the children of node are shared by several of the
+        prefixes locked separately
+        """
+        depth = 0
+        while node is not None and depth < self.locks.depth:
+            node = node.parent
+            depth += 1
+        return depth < self.locks.depth
+
+    def allocate(self, table, free, record):
+        if free:
+            offset = free.pop()
+            table[offset] = record
+        else:
+            offset = len(table)
+            table.append(record)
+        return offset
+
+    def add_to_graphdb(self, name, data, wrapped, meta=None):
+        """
+        @param name - name of a given content object
+        @param data - data to store under name
+        @param meta - packet metadata to be kept with the segment
+        adds the name and its co to the in-process name tree
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        components = self.name_to_components(Name(name))
+        # the components above the locked prefix are shared with other
+        # writers, and with prune_empty_components of other prefixes
+        shared = self.locks.depth - 1
+        with self._structure:
+            node = self.add_components(self.root, components[:shared], True)
+        node = self.add_components(node, components[shared:], False)
+
+        meta = meta or {}
+        if meta.get(PROPERTY_KEY_LOCATOR):
+            meta[PROPERTY_KEY_LOCATOR] = intern(
+                    str(meta[PROPERTY_KEY_LOCATOR]))
+        fields = tuple([meta.get(key) for key in SEGMENT_FIELDS])
+
+        with self._structure:
+            if node.segment != NO_SEGMENT:
+                record = self._segments[node.segment]
+                if self._payloads[record[0]][2] == digest:
+                    self._segments[node.segment] = (record[0],) + fields
+                    return
+                self.release_payloads([node])
+
+            payload = self._digests.get(digest)
+            if payload is None:
+                payload = self.allocate(self._payloads, self._free_payloads,
+                        [data, 0, digest])
+                self._digests[digest] = payload
+            self._payloads[payload][1] += 1
+            node.segment = self.allocate(self._segments,
+                    self._free_segments, (payload,) + fields)
+
+    def add_components(self, node, components, copy):
+        """
+        @param node - node to start from
+        @param components - raw components to walk down, created if missing
+        @param copy - see MemoryNode.insert_child
+        @return the node of the last component
+        """
+        for comp in components:
+            index, child = node.find_child(comp)
+            if not child:
+                child = MemoryNode(comp, node)
+                node.insert_child(index, child, copy)
+            node = child
+        return node
+
+    def release_payloads(self, nodes):
+        """
+        @param nodes - nodes whose segments are going away
+        drops the segments of the given nodes together with the payload
+        references they hold, removing payloads no longer referenced
+        """
+        with self._structure:
+            for node in nodes:
+                if node.segment == NO_SEGMENT:
+                    continue
+                offset = self._segments[node.segment][0]
+                self._segments[node.segment] = None
+                self._free_segments.append(node.segment)
+                node.segment = NO_SEGMENT
+
+                payload = self._payloads[offset]
+                payload[1] -= 1
+                if payload[1] <= 0:
+                    del self._digests[payload[2]]
+                    self._payloads[offset] = None
+                    self._free_payloads.append(offset)
+
+    def detach(self, node):
+        """
+        @param node - node to remove from its parent
+        """
+        parent = node.parent
+        if self.is_shared(parent):
+            with self._structure:
+                parent.remove_child(node, True)
+        else:
+            parent.remove_child(node)
+        node.parent = None
+
+    def add_content_objects_to_repo(self, items, wired=True):
+        """
+        @param items - list of (name, co)
+        @param wired - whether the cos given are in wired format
+        inserts the given cos one by one, there are no transactions to
+        batch them in
+        """
+        for name, co in items:
+            self.add_content_object_to_repo(name, co, wired)
+
+    def locate_last_node(self, name):
+        """
+        @param name - the name prefix
+        @return the node found according to the prefix
+        """
+        node = self.root
+        for comp in self.name_to_components(name):
+            _, node = node.find_child(comp)
+            if not node:
+                return None
+        return node
+
+    def apply_exclude(self, last_node, exclude):
+        """
+        @param last_node - the node to start search from
+        @param exclude - exclude filter the interest contains
+        @returns all children that fullfil the selector
+        """
+        nodes = list(last_node.children or [])
+        if not exclude:
+            return nodes
+
+        return [node for node in nodes
+                if not exclude.matches(Name.Component(node.component))]
+
+    def apply_child_selector(self, nodes, child_selector):
+        """
+        @param nodes - nodes to be selected from
+        @param child_selector - child selector from the interest
+        @return the leftmost or rightmost node in canonical order
+        """
+        if not nodes:
+            return []
+
+        if child_selector == 0:
+            return [min(nodes, key=MemoryNode.sort_key)]
+        return [max(nodes, key=MemoryNode.sort_key)]
+
+    def apply_min_max_suffix_components(self, nodes,
+            min_suffix_components, max_suffix_components):
+        """
+        @param nodes - nodes from which to apply suffix components
+        @param min_suffix_components - min suffix components
+        @param max_suffix_components - max suffix components
+        @return a list of nodes holding a segment that fulfill the selector
+        """
+        if not min_suffix_components:
+            min_suffix_components = MIN_SUFFIX_COMPS
+        if not max_suffix_components:
+            max_suffix_components = MAX_SUFFIX_COMPS
+
+        found = []
+        stack = [(node, 0) for node in nodes]
+        while stack:
+            node, depth = stack.pop()
+            if node.segment != NO_SEGMENT and depth >= min_suffix_components:
+                found.append(node)
+            if depth < max_suffix_components and node.children:
+                stack.extend([(child, depth + 1)
+                        for child in node.children])
+
+        return found
+
+    def apply_segment_selectors(self, nodes, key_locator=None,
+            must_be_fresh=False):
+        """
+        @param nodes - leaf nodes to be checked
+        @param key_locator - key locator given by the interest
+        @param must_be_fresh - whether the interest asks for fresh data only
+        @return the nodes whose co satisfies the given selectors
+        """
+        key_locator = self.key_locator_to_string(key_locator) \
+                if key_locator else None
+        if key_locator:
+            nodes = [node for node in nodes
+                    if self._segments[node.segment][_KEY_LOCATOR] ==
+                    key_locator]
+        if must_be_fresh:
+            now = int(time.time() * 1000)
+            nodes = [node for node in nodes
+                    if (self._segments[node.segment][_EXPIRY] or 0) > now]
+
+        return nodes
+
+    def extract_co_from_db(self, leaf_node, wired=True):
+        if leaf_node.segment == NO_SEGMENT:
+            return None
+
+        data = self._payloads[self._segments[leaf_node.segment][0]][0]
+        with self.metrics.timer("wire_decode"):
+            co = Data()
+            co.wireDecode(Blob.fromRawStr(data))
+        return co
+
+    def extract_segments(self, name, components):
+        """
+        @param name - Name instance of the object
+        @param components - Name.Component instances of the children to read
+        @return list of (co, expiry in ms) of the children stored under the
+        name
+        """
+        with self.metrics.request("read_segments"), self.locks.read(name):
+            node = self.locate_last_node(name)
+            if not node:
+                return []
+
+            segments = []
+            for component in components:
+                _, child = node.find_child(component.getValue().toRawStr())
+                if child and child.segment != NO_SEGMENT:
+                    segments.append((self.extract_co_from_db(child),
+                            self._segments[child.segment][_EXPIRY]))
+            return segments
+
+    def extract_by_digest(self, name, digest, wired=True):
+        """
+        @param name - name ending with an implicit sha256 digest component
+        @param digest - the hex digest carried by the name
+        @param wired - whether to return the wired format co
+        @return the co with the given digest, if it is stored under the rest
+        of the name. otherwise None
+        """
+        # payloads are shared by all prefixes, a writer of another prefix
+        # may be releasing this one
+        with self._structure:
+            offset = self._digests.get(digest)
+            payload = self._payloads[offset] if offset is not None else None
+        if payload is None:
+            return None
+
+        co = Data()
+        co.wireDecode(Blob.fromRawStr(payload[0]))
+        if not co.getName().equals(name.getPrefix(-1)):
+            return None
+
+        return co
+
+    def delete_subtree(self, node, batch_size=DELETE_BATCH_SIZE):
+        """
+        @param node - top node of the subtree to be removed
+        @param batch_size - unused, kept for compatibility with Repo
+        @return number of nodes removed
+        """
+        # detach the subtree first, then take it apart
+        if node.parent:
+            self.detach(node)
+
+        removed = 0
+        stack = [node]
+        while stack:
+            _node = stack.pop()
+            stack.extend(_node.children or [])
+            if _node.segment != NO_SEGMENT:
+                self.release_payloads([_node])
+                removed += 1
+            removed += 1
+
+        return removed
+
+    def prune_empty_components(self, nodes, prefix=None):
+        """
+        @param nodes - nodes to start pruning from
+        @param prefix - unused, kept for compatibility with Repo
+        @return number of nodes removed
+        removes components left with neither children nor a segment, up to
+        (but never including) the root. the shared ones are removed under
+        the structural lock
+        """
+        removed = 0
+        for node in nodes:
+            while node is not self.root and node.parent:
+                if self.is_shared(node.parent):
+                    # another prefix may be adding under node meanwhile
+                    with self._structure:
+                        node = self.prune(node)
+                else:
+                    node = self.prune(node)
+                if not node:
+                    break
+                removed += 1
+
+        return removed
+
+    def prune(self, node):
+        """
+        @return the parent of node if node was left empty and has been
+        removed, None otherwise
+        """
+        parent = node.parent
+        if node.children or node.segment != NO_SEGMENT or not parent:
+            return None
+        self.detach(node)
+        return parent
+
+    def delete_prefix(self, name, batch_size=DELETE_BATCH_SIZE):
+        """
+        @param name - name prefix to be removed
+        @param batch_size - unused, kept for compatibility with Repo
+        @return number of nodes removed
+        """
+        name = Name(name)
+        if name.size() < 2:
+            raise UnsupportedQueryException("cannot delete %s" % name.toUri())
+
+        with self.locks.write(name):
+            last_node = self.locate_last_node(name)
+            if not last_node:
+                return 0
+
+            parent = last_node.parent
+            removed = self.delete_subtree(last_node)
+            removed += self.prune_empty_components([parent])
+        return removed
+
+    def delete_from_repo(self, interest):
+        """
+        @param interest - command interest that requests deletion
+        @return number of nodes removed
+        """
+        with self.locks.write(interest.getName()):
+            last_node = self.locate_last_node(interest.getName())
+            if not last_node:
+                return 0
+
+            # stale data included
+            nodes = self.apply_selectors(last_node, interest,
+                    must_be_fresh=False)
+            if not nodes:
+                return 0
+
+            self.release_payloads(nodes)
+            return len(nodes) + self.prune_empty_components(nodes)
+
+    def memory_usage(self):
+        """
+        @return dict with the number of stored names and nodes, and the
+        bytes taken by the name tree (including segment records) and by the
+        payloads, in total and per stored name
+        """
+        names = nodes = tree_bytes = 0
+        components = set()
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            nodes += 1
+            tree_bytes += sys.getsizeof(node)
+            if id(node.component) not in components:
+                components.add(id(node.component))
+                tree_bytes += sys.getsizeof(node.component)
+            if node.children:
+                tree_bytes += sys.getsizeof(node.children)
+                stack.extend(node.children)
+            if node.segment != NO_SEGMENT:
+                names += 1
+
+        tree_bytes += sys.getsizeof(self._segments)
+        key_locators = set()
+        for record in self._segments:
+            if record is None:
+                continue
+            tree_bytes += sys.getsizeof(record)
+            if record[_KEY_LOCATOR] not in key_locators:
+                key_locators.add(record[_KEY_LOCATOR])
+                tree_bytes += sys.getsizeof(record[_KEY_LOCATOR])
+
+        payload_bytes = sys.getsizeof(self._payloads) + \
+                sys.getsizeof(self._digests)
+        for payload in self._payloads:
+            if payload is None:
+                continue
+            payload_bytes += sys.getsizeof(payload) + \
+                    sys.getsizeof(payload[0]) + sys.getsizeof(payload[2])
+
+        total = tree_bytes + payload_bytes
+        return {
+                "names": names,
+                "nodes": nodes,
+                "components": len(components),
+                "tree_bytes": tree_bytes,
+                "payload_bytes": payload_bytes,
+                "bytes": total,
+                "tree_bytes_per_name": float(tree_bytes) / names
+                        if names else 0.0,
+                "bytes_per_name": float(total) / names if names else 0.0,
+                }
+
+    def train_dictionary(self, prefix, *args, **kwargs):
+        raise UnsupportedQueryException(
+                "compression is not supported by MemoryRepo")
@@ -0,0 +1,310 @@
+# Copyright (c) 2014 University of California, Los Angeles
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation;
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+#
+# Author: Zhe Wen <wenzhe@cs.ucla.edu>
+
+# hot path instrumentation: per stage timings, counters and cache hit ratios
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from timeit import default_timer
+import threading
+import json
+import time
+import os
+
+# counter of backend queries, also kept per request
+BACKEND_QUERIES = "backend_queries"
+BYTES_IN = "bytes_in"
+BYTES_OUT = "bytes_out"
+
+
+class Histogram(object):
+    """
+    histogram with power of two buckets. values are non-negative numbers,
+    e.g. microseconds or query counts
+    """
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.max = 0
+        # bucket i counts values v with 2^(i-1) <= v < 2^i (bucket 0: v < 1)
+        self.buckets = [0] * 64
+
+    def observe(self, value):
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+        self.buckets[min(int(value).bit_length(), 63)] += 1
+
+    def percentile(self, p):
+        """
+        @return upper bound of the bucket holding the p-th percentile
+        """
+        if not self.count:
+            return 0
+        rank = p / 100.0 * self.count
+        seen = 0
+        for i, bucket in enumerate(self.buckets):
+            seen += bucket
+            if seen >= rank and bucket:
+                return min(1 << i, self.max)
+        return self.max
+
+    def snapshot(self):
+        return {
+                "count": self.count,
+                "mean": float(self.total) / self.count if self.count else 0,
+                "p50": self.percentile(50),
+                "p99": self.percentile(99),
+                "p999": self.percentile(99.9),
+                "max": self.max,
+                }
+
+
+class _Timer(object):
+    def __init__(self, metrics, stage):
+        self._metrics = metrics
+        self._stage = stage
+
+    def __enter__(self):
+        self._start = default_timer()
+        return self
+
+    def __exit__(self, *args):
+        self._metrics.observe(self._stage,
+                (default_timer() - self._start) * 1e6)
+
+
+class _Request(_Timer):
+    def __enter__(self):
+        local = self._metrics._local
+        # requests may nest, e.g. a server interest around a repo read
+        self._outer = getattr(local, "queries", None)
+        local.queries = 0
+        return _Timer.__enter__(self)
+
+    def __exit__(self, *args):
+        _Timer.__exit__(self, *args)
+        local = self._metrics._local
+        queries = local.queries
+        self._metrics.observe(self._stage + "." + BACKEND_QUERIES, queries)
+        local.queries = None if self._outer is None \
+                else self._outer + queries
+
+
+class _NullTimer(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+_NULL_TIMER = _NullTimer()
+
+
+class Metrics(object):
+    """
+    collects timing histograms (in us) per stage, counters, and hit ratios
+    per cache. safe to use from several threads
+    """
+    enabled = True
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.started = time.time()
+        self.histograms = {}
+        self.counters = {}
+        # cache -> [hits, misses]
+        self.caches = {}
+
+    def timer(self, stage):
+        """
+        @return context manager timing the enclosed block as stage
+        """
+        return _Timer(self, stage)
+
+    def request(self, kind):
+        """
+        @return context manager timing the enclosed block as kind and
+        recording the number of backend queries it issued
+        """
+        return _Request(self, kind)
+
+    def observe(self, stage, value):
+        with self._lock:
+            histogram = self.histograms.get(stage)
+            if not histogram:
+                histogram = self.histograms[stage] = Histogram()
+            histogram.observe(value)
+
+    def count(self, counter, n=1):
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + n
+
+    def backend_query(self):
+        self.count(BACKEND_QUERIES)
+        if getattr(self._local, "queries", None) is not None:
+            self._local.queries += 1
+
+    def cache_hit(self, cache):
+        with self._lock:
+            self.caches.setdefault(cache, [0, 0])[0] += 1
+
+    def cache_miss(self, cache):
+        with self._lock:
+            self.caches.setdefault(cache, [0, 0])[1] += 1
+
+    def snapshot(self):
+        """
+        @return all metrics as a json serializable dict
+        """
+        with self._lock:
+            caches = {}
+            for cache, (hits, misses) in self.caches.items():
+                caches[cache] = {
+                        "hits": hits,
+                        "misses": misses,
+                        "hit_ratio": float(hits) / (hits + misses)
+                                if hits + misses else 0.0,
+                        }
+            return {
+                    "uptime": time.time() - self.started,
+                    "stages": dict([(stage, histogram.snapshot())
+                            for stage, histogram in self.histograms.items()]),
+                    "counters": dict(self.counters),
+                    "caches": caches,
+                    }
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=2, sort_keys=True)
+
+    def to_text(self):
+        """
+        @return the metrics as "name value" lines
+        """
+        snapshot = self.snapshot()
+        lines = ["uptime %.1f" % snapshot["uptime"]]
+        for stage, stats in sorted(snapshot["stages"].items()):
+            for key in ["count", "mean", "p50", "p99", "p999", "max"]:
+                lines.append("stage.%s.%s %s" % (stage, key, stats[key]))
+        for counter, value in sorted(snapshot["counters"].items()):
+            lines.append("counter.%s %s" % (counter, value))
+        for cache, stats in sorted(snapshot["caches"].items()):
+            for key in ["hits", "misses", "hit_ratio"]:
+                lines.append("cache.%s.%s %s" % (cache, key, stats[key]))
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self.histograms = {}
+            self.counters = {}
+            self.caches = {}
+
+
+class NullMetrics(Metrics):
+    """
+    drop-in for Metrics that records nothing, used when instrumentation is
+    disabled
+    """
+    enabled = False
+
+    def timer(self, stage):
+        return _NULL_TIMER
+
+    def request(self, kind):
+        return _NULL_TIMER
+
+    def observe(self, stage, value):
+        pass
+
+    def count(self, counter, n=1):
+        pass
+
+    def backend_query(self):
+        pass
+
+    def cache_hit(self, cache):
+        pass
+
+    def cache_miss(self, cache):
+        pass
+
+NULL_METRICS = NullMetrics()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        metrics = self.server.metrics
+        if self.path == "/metrics":
+            body, content_type = metrics.to_text(), "text/plain"
+        elif self.path == "/metrics.json":
+            body, content_type = metrics.to_json(), "application/json"
+        elif self.path == "/queries.json" and self.server.profiler:
+            body = json.dumps(self.server.profiler.snapshot(), indent=2,
+                    sort_keys=True)
+            content_type = "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve_metrics(metrics, port, host="localhost", profiler=None):
+    """
+    @param metrics - Metrics to expose
+    @param port - local port to listen on
+    @param profiler - QueryExecutor whose profile and slow query log are
+                      served as /queries.json
+    @return the HTTPServer, serving /metrics (text) and /metrics.json from
+    a daemon thread
+    """
+    server = HTTPServer((host, port), _MetricsHandler)
+    server.metrics = metrics
+    server.profiler = profiler
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def dump_metrics(metrics, path, interval):
+    """
+    @param metrics - Metrics to dump
+    @param path - file the json snapshot is rewritten to
+    @param interval - seconds between dumps
+    @return the daemon thread doing the dumps
+    """
+    def dump():
+        while True:
+            time.sleep(interval)
+            with open(path + ".tmp", "w") as f:
+                f.write(metrics.to_json())
+            # readers never see a partially written file
+            os.rename(path + ".tmp", path)
+
+    thread = threading.Thread(target=dump)
+    thread.daemon = True
+    thread.start()
+    return thread
@@ -0,0 +1,236 @@
+# Copyright (c) 2014 University of California, Los Angeles
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation;
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+#
+# Author: Zhe Wen <wenzhe@cs.ucla.edu>
+
+# compact in-process name tree: the name tree of MemoryRepo, and the
+# resident cache of the name tree of Repo
+
+from pyndn import Name
+
+import threading
+import time
+
+# offset of a node without segment
+NO_SEGMENT = -1
+
+
+class MemoryNode(object):
+    """
+    a component of the in-process name tree
+    """
+    __slots__ = ['component', 'parent', 'children', 'segment']
+
+    def __init__(self, component, parent=None):
+        # raw bytes of the component, interned, so that components repeated
+        # all over the tree (e.g. timestamps) are stored once
+        self.component = intern(component)
+        self.parent = parent
+        # None for leaves, otherwise a list of children in canonical order
+        self.children = None
+        # offset of the segment stored under this name, if any
+        self.segment = NO_SEGMENT
+
+    def sort_key(self):
+        # canonical order: shorter components first, then byte-wise
+        return (len(self.component), self.component)
+
+    def uri(self):
+        return Name.Component(self.component).toEscapedString()
+
+    def find_child(self, component):
+        """
+        @param component - raw bytes of a component
+        @return (index, child) where child is None if there is none with
+        the component, and index is where it would be inserted
+        """
+        children = self.children
+        if not children:
+            return 0, None
+        key = (len(component), component)
+        low, high = 0, len(children)
+        while low < high:
+            middle = (low + high) / 2
+            _key = children[middle].sort_key()
+            if _key < key:
+                low = middle + 1
+            elif _key > key:
+                high = middle
+            else:
+                return middle, children[middle]
+        return low, None
+
+    def insert_child(self, index, child, copy=False):
+        """
+        @param copy - whether to replace the list of children instead of
+                      changing it in place, so that readers walking it
+                      without a lock see either the old or the new list
+        """
+        children = list(self.children or []) if copy else \
+                self.children or []
+        children.insert(index, child)
+        self.children = children
+
+    def remove_child(self, child, copy=False):
+        index, _ = self.find_child(child.component)
+        children = list(self.children) if copy else self.children
+        del children[index]
+        self.children = children or None
+
+
+# number of names the name cache of Repo holds
+NAME_CACHE_SIZE = 1000000
+# seconds a cached name is used before it is located in the database again
+NAME_CACHE_MAX_AGE = 60.0
+
+
+class CachedNode(MemoryNode):
+    """
+    a component of the cached name tree, with the id of its graph node
+    """
+    __slots__ = ['node_id', 'epoch']
+
+    def __init__(self, component, parent=None):
+        MemoryNode.__init__(self, component, parent)
+        # None if the component was not located itself
+        self.node_id = None
+        self.epoch = None
+
+
+class NameCache(object):
+    """
+    resident name tree of Repo: the graph node ids of the names located
+    recently, so that locating a hot name takes no path query. a name is
+    used for at most max_age seconds, so that deletes by other processes
+    show up. once size names are held, the tree is started over. safe to
+    use from several threads
+    """
+    def __init__(self, size=NAME_CACHE_SIZE, max_age=NAME_CACHE_MAX_AGE):
+        """
+        @param size - max number of names held
+        @param max_age - seconds a name is used
+        """
+        self.size = size
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._epoch = None
+        # counts invalidations, so that a name located while something was
+        # deleted is not put in the cache afterwards
+        self.generation = 0
+        self._clear()
+
+    def _clear(self):
+        self.root = CachedNode("ndn")
+        self.names = 0
+
+    def clear(self):
+        with self._lock:
+            self._clear()
+
+    def epoch(self):
+        # the names of the current epoch are used, and the epoch stored on
+        # every node is the same int object
+        epoch = int(time.time() / self.max_age)
+        if epoch != self._epoch:
+            self._epoch = epoch
+        return self._epoch
+
+    def components(self, name):
+        """
+        @param name - Name instance
+        @return the raw components of the name under the root, or None if
+        the name is not under the root
+        """
+        if name.size() == 0 or \
+                name.get(0).getValue().toRawStr() != self.root.component:
+            return None
+        return [name.get(i).getValue().toRawStr()
+                for i in range(1, name.size())]
+
+    def get(self, name):
+        """
+        @param name - Name instance
+        @return the id of the graph node of the name, or None if not cached
+        """
+        components = self.components(name)
+        if components is None:
+            return None
+        with self._lock:
+            node = self.root
+            for comp in components:
+                index, node = node.find_child(comp)
+                if not node:
+                    return None
+            if node.epoch != self.epoch():
+                return None
+            return node.node_id
+
+    def put(self, name, node_id, generation):
+        """
+        @param name - Name instance
+        @param node_id - id of the graph node the name was located at
+        @param generation - the generation read before locating the name
+        """
+        components = self.components(name)
+        if components is None:
+            return
+        with self._lock:
+            if generation != self.generation:
+                return
+            if self.names >= self.size:
+                self._clear()
+            node = self.root
+            for comp in components:
+                index, child = node.find_child(comp)
+                if not child:
+                    child = CachedNode(comp, node)
+                    node.insert_child(index, child)
+                node = child
+            if node.node_id is None:
+                self.names += 1
+            node.node_id = node_id
+            node.epoch = self.epoch()
+
+    def invalidate(self, name):
+        """
+        @param name - Name instance of a prefix something was deleted under
+        drops the names under the prefix, and the prefix and its ancestors
+        themselves, since the ones left empty are removed from the database
+        """
+        components = self.components(name)
+        if components is None:
+            return
+        with self._lock:
+            self.generation += 1
+            node = self.root
+            for comp in components:
+                if node.node_id is not None:
+                    node.node_id = None
+                    self.names -= 1
+                index, node = node.find_child(comp)
+                if not node:
+                    return
+            if node is self.root:
+                self._clear()
+                return
+
+            stack = [node]
+            while stack:
+                _node = stack.pop()
+                stack.extend(_node.children or [])
+                if _node.node_id is not None:
+                    self.names -= 1
+            node.parent.remove_child(node)
+            node.parent = None
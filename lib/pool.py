@@ -0,0 +1,164 @@
+# Copyright (c) 2014 University of California, Los Angeles
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation;
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+#
+# Author: Zhe Wen <wenzhe@cs.ucla.edu>
+
+# bounded pool of keep-alive backend connections, shared by worker threads
+
+from repo_exceptions import PoolExhaustedException
+from metrics import NULL_METRICS
+
+from contextlib import contextmanager
+from timeit import default_timer
+import threading
+import time
+
+DEFAULT_POOL_SIZE = 4
+# seconds a connection may sit idle before it is checked again
+HEALTH_CHECK_INTERVAL = 30.0
+
+
+class ConnectionPool(object):
+    """
+    hands out at most size connections at a time. idle connections are
+    reused most recently used first, so the ones kept busy stay alive, and
+    are health checked before reuse once idle for longer than
+    check_interval. safe to use from several threads
+    """
+    def __init__(self, factory, size=DEFAULT_POOL_SIZE, health_check=None,
+            check_interval=HEALTH_CHECK_INTERVAL, timeout=None, metrics=None):
+        """
+        @param factory - callable opening a new connection
+        @param size - max number of connections open at a time
+        @param health_check - callable raising (or returning False) if the
+                              given connection is not usable any more
+        @param timeout - seconds to wait for a free connection, None waits
+                         forever
+        """
+        self.factory = factory
+        self.size = size
+        self.health_check = health_check
+        self.check_interval = check_interval
+        self.timeout = timeout
+        self.metrics = metrics or NULL_METRICS
+
+        self._cond = threading.Condition(threading.Lock())
+        # stack of (connection, time it was released)
+        self._idle = []
+        self._open = 0
+        self.created = 0
+        self.discarded = 0
+
+    def acquire(self):
+        """
+        @return a connection, to be given back with release()
+        """
+        start_time = default_timer()
+        with self._cond:
+            while not self._idle and self._open >= self.size:
+                waited = default_timer() - start_time
+                if self.timeout is not None and waited >= self.timeout:
+                    raise PoolExhaustedException(
+                            "no free connection after %.1f s" % waited)
+                self._cond.wait(None if self.timeout is None
+                        else self.timeout - waited)
+            if self._idle:
+                connection, released = self._idle.pop()
+            else:
+                connection, released = None, None
+                # reserve the slot, the connection is opened outside the lock
+                self._open += 1
+        self.metrics.observe("backend.pool_wait",
+                (default_timer() - start_time) * 1e6)
+
+        if connection is not None and \
+                time.time() - released > self.check_interval and \
+                not self.check(connection):
+            self.metrics.count("backend.pool_discarded")
+            with self._cond:
+                self.discarded += 1
+            connection = None
+        if connection is None:
+            try:
+                connection = self.factory()
+            except:
+                with self._cond:
+                    self._open -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self.created += 1
+        return connection
+
+    def check(self, connection):
+        """
+        @return whether the connection passes the health check
+        """
+        if not self.health_check:
+            return True
+        try:
+            return self.health_check(connection) is not False
+        except Exception:
+            return False
+
+    def release(self, connection, broken=False):
+        """
+        @param connection - connection returned by acquire()
+        @param broken - whether the connection failed, so it is closed
+                        instead of reused
+        """
+        with self._cond:
+            if broken:
+                self._open -= 1
+                self.discarded += 1
+            else:
+                self._idle.append((connection, time.time()))
+            self._cond.notify()
+        if broken:
+            self.metrics.count("backend.pool_discarded")
+
+    @contextmanager
+    def connection(self):
+        """
+        context manager holding a connection for the enclosed block. the
+        connection is discarded if the block raises
+        """
+        connection = self.acquire()
+        try:
+            yield connection
+        except:
+            self.release(connection, broken=True)
+            raise
+        self.release(connection)
+
+    def snapshot(self):
+        with self._cond:
+            return {
+                    "size": self.size,
+                    "open": self._open,
+                    "idle": len(self._idle),
+                    "in_use": self._open - len(self._idle),
+                    "created": self.created,
+                    "discarded": self.discarded,
+                    }
+
+    def close(self):
+        """
+        drops the idle connections
+        """
+        with self._cond:
+            self._open -= len(self._idle)
+            self._idle = []
+            self._cond.notify_all()
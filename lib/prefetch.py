@@ -0,0 +1,251 @@
+# Copyright (c) 2014 University of California, Los Angeles
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation;
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+#
+# Author: Zhe Wen <wenzhe@cs.ucla.edu>
+
+# response cache of the server, and prefetching of the segments of large
+# objects (e.g. floor plans) into it while they are fetched in order
+
+from pyndn import Name
+
+from metrics import NULL_METRICS
+
+from collections import OrderedDict
+import threading
+import time
+import re
+
+# number of responses kept
+CACHE_SIZE = 10000
+# seconds a response is kept, so that writes by other processes show up
+CACHE_MAX_AGE = 10.0
+# number of segments read ahead of the one asked for
+PREFETCH_DEPTH = 8
+# number of objects whose access pattern is followed
+TRACKED_OBJECTS = 1000
+
+# segment number components, either the naming convention marker
+# (e.g. %00%03) or textual (e.g. seg3)
+SEGMENT_MARKER = "\x00"
+TEXT_SEGMENT = re.compile(r"^seg(\d+)$")
+
+
+def parse_segment(component):
+    """
+    @param component - Name.Component instance
+    @return (segment number, True if textual), or None if the component is
+    not a segment number
+    """
+    value = component.getValue().toRawStr()
+    if len(value) > 1 and value[0] == SEGMENT_MARKER:
+        return component.toSegment(), False
+    match = TEXT_SEGMENT.match(value)
+    if match:
+        return int(match.group(1)), True
+    return None
+
+
+def segment_component(segment, textual=False):
+    """
+    @param segment - segment number
+    @param textual - whether to make a textual component, like seg3
+    @return Name.Component of the segment number
+    """
+    if textual:
+        return Name.Component("seg%d" % segment)
+    return Name().appendSegment(segment)[0]
+
+
+def is_plain(interest):
+    """
+    @return whether the interest has no selectors other than MustBeFresh,
+    i.e. it asks for exactly the data named
+    """
+    return interest.getChildSelector() is None and \
+            interest.getExclude().size() == 0 and \
+            interest.getMinSuffixComponents() is None and \
+            interest.getMaxSuffixComponents() is None and \
+            interest.getKeyLocator().getType() is None
+
+
+class ResponseCache(object):
+    """
+    least recently used wired cos, by name. only answers interests asking
+    for exactly the name of a cached co. safe to use from several threads
+    """
+    def __init__(self, size=CACHE_SIZE, max_age=CACHE_MAX_AGE,
+            metrics=None):
+        """
+        @param size - number of cos kept
+        @param max_age - seconds a co is kept
+        """
+        self.size = size
+        self.max_age = max_age
+        self.metrics = metrics or NULL_METRICS
+        self._lock = threading.Lock()
+        # name uri -> (wired co, expiry in ms or None, time cached)
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, interest):
+        """
+        @param interest - the interest to answer
+        @return the wired co answering the interest, or None
+        """
+        if not is_plain(interest):
+            return None
+        key = interest.getName().toUri()
+        now = time.time()
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry and now - entry[2] > self.max_age:
+                entry = None
+            if entry:
+                self._entries[key] = entry
+            # a co of unknown expiry is never taken to be fresh
+            if entry and interest.getMustBeFresh() and \
+                    (entry[1] or 0) <= now * 1000:
+                entry = None
+            if entry:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if entry:
+            self.metrics.cache_hit("response")
+        else:
+            self.metrics.cache_miss("response")
+        return entry[0] if entry else None
+
+    def contains(self, name):
+        with self._lock:
+            return name.toUri() in self._entries
+
+    def put(self, name, wired, expiry=None):
+        """
+        @param name - Name of the co
+        @param wired - the wired co
+        @param expiry - time the co stops being fresh, in ms, if known
+        """
+        with self._lock:
+            self._entries.pop(name.toUri(), None)
+            self._entries[name.toUri()] = (wired, expiry, time.time())
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, prefix):
+        """
+        @param prefix - Name under which cached cos are dropped
+        """
+        with self._lock:
+            for key in self._entries.keys():
+                if prefix.match(Name(key)):
+                    del self._entries[key]
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                    "size": len(self._entries),
+                    "hits": self.hits,
+                    "misses": self.misses,
+                    }
+
+
+class SegmentPrefetcher(object):
+    """
+    follows the segments asked for per object. once an object is read in
+    order, the segments ahead of the one asked for are read into the cache,
+    depth at a time, in one backend read
+    """
+    def __init__(self, repo, cache, depth=PREFETCH_DEPTH, metrics=None):
+        """
+        @param repo - repo to read from
+        @param cache - ResponseCache the segments are read into
+        @param depth - number of segments read ahead
+        """
+        self.repo = repo
+        self.cache = cache
+        self.depth = depth
+        self.metrics = metrics or NULL_METRICS
+        self._lock = threading.Lock()
+        # object uri -> (last segment asked for, last segment read ahead,
+        # last segment of the object if known)
+        self._objects = OrderedDict()
+
+    def track(self, name, final=None):
+        """
+        @param name - Name of the segment asked for
+        @param final - number of the last segment of the object, if known
+        @return (first, last) segment numbers to read ahead, None if none
+        """
+        segment = parse_segment(name.get(-1)) if name.size() else None
+        if not segment:
+            return None
+        segment = segment[0]
+        key = name.getPrefix(-1).toUri()
+        with self._lock:
+            last, ahead, _final = self._objects.pop(key, (None, -1, None))
+            in_order = last is not None and segment == last + 1
+            if not in_order:
+                # a new (or out of order) read of the object
+                ahead = -1
+            if final is None:
+                final = _final
+            self._objects[key] = (segment, ahead, final)
+            while len(self._objects) > TRACKED_OBJECTS:
+                self._objects.popitem(last=False)
+            if segment != 0 and not in_order:
+                return None
+            # read ahead again once half of what was read is used up
+            if ahead - segment > self.depth / 2:
+                return None
+            # never past the last segment of the object
+            window = (max(ahead + 1, segment + 1), segment + self.depth)
+            if final is not None:
+                window = (window[0], min(window[1], final))
+            if window[0] > window[1]:
+                return None
+            self._objects[key] = (segment, window[1], final)
+        return window
+
+    def on_served(self, name, co=None):
+        """
+        @param name - Name of the segment asked for
+        @param co - the Data served, None if it came from the cache
+        reads the next segments of the object into the cache, if the object
+        is read in order
+        """
+        final = None
+        if co and co.getMetaInfo().getFinalBlockID().getValue().size():
+            final = parse_segment(co.getMetaInfo().getFinalBlockID())
+        window = self.track(name, final[0] if final else None)
+        if not window:
+            return
+
+        textual = parse_segment(name.get(-1))[1]
+        prefix = name.getPrefix(-1)
+        components = [segment_component(segment, textual)
+                for segment in range(window[0], window[1] + 1)]
+        components = [component for component in components
+                if not self.cache.contains(Name(prefix).append(component))]
+        if not components:
+            return
+
+        with self.metrics.timer("prefetch.read"):
+            segments = self.repo.extract_segments(prefix, components)
+        for data, expiry in segments:
+            self.cache.put(data.getName(), data.wireEncode().toBuffer(),
+                    expiry)
+        self.metrics.count("prefetch.segments", len(segments))
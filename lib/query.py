@@ -0,0 +1,278 @@
+# Copyright (c) 2014 University of California, Los Angeles
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation;
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+#
+# Author: Zhe Wen <wenzhe@cs.ucla.edu>
+
+# single execution layer for backend queries, with a query profiler,
+# slow query log and sampled query traces
+
+from py2neo import neo4j
+
+from metrics import NULL_METRICS
+
+from timeit import default_timer
+import threading
+import random
+import heapq
+import json
+import time
+import re
+
+# number of slowest queries kept in the slow query log
+SLOW_QUERY_LOG_SIZE = 100
+
+_NODE_IDS = re.compile(r'node\([\d,\s]+\)')
+_STRINGS = re.compile(r'"(?:[^"\\]|\\.)*"')
+_NUMBERS = re.compile(r'\b\d+\b')
+
+
+def query_template(query):
+    """
+    @param query - cypher query
+    @return the query with node ids and literals replaced by "?", so that
+    queries differing only in the names or nodes they touch share it
+    """
+    template = _NODE_IDS.sub('node(?)', query)
+    template = _STRINGS.sub('"?"', template)
+    template = _NUMBERS.sub('?', template)
+    return template
+
+
+def check_connection(db_handler):
+    """
+    health check of a pooled connection: a trivial round trip to the server
+    """
+    neo4j.CypherQuery(db_handler, 'RETURN 1').execute()
+
+
+def check_session(session):
+    """
+    health check of a pooled transaction session: a trivial transaction
+    """
+    tx = session.create_transaction()
+    tx.append('RETURN 1')
+    tx.commit()
+
+
+def params_shape(params):
+    """
+    @param params - query parameters
+    @return the parameter names and value types, without the values
+    """
+    return dict([(key, type(value).__name__)
+            for key, value in params.items()])
+
+
+class QueryStats(object):
+    """
+    aggregated executions of one query template
+    """
+    def __init__(self, template):
+        self.template = template
+        self.count = 0
+        self.duration = 0.0
+        self.max_duration = 0.0
+        self.rows = 0
+
+    def add(self, duration, rows):
+        self.count += 1
+        self.duration += duration
+        self.rows += rows
+        if duration > self.max_duration:
+            self.max_duration = duration
+
+    def snapshot(self):
+        return {
+                "template": self.template,
+                "count": self.count,
+                "total_ms": self.duration * 1000,
+                "mean_ms": self.duration * 1000 / self.count
+                        if self.count else 0.0,
+                "max_ms": self.max_duration * 1000,
+                "rows": self.rows,
+                }
+
+
+class QueryExecutor(object):
+    """
+    executes every query the repo sends to the graph database, recording
+    per template statistics, the slowest queries and, optionally, a sampled
+    trace that replay_trace() can run again offline. queries run on
+    connections of the given ConnectionPool, so the executor can be shared
+    by worker threads. transactions run in cypher Sessions of a second
+    pool, health checked and discarded on errors the same way
+    """
+    def __init__(self, pool, metrics=None,
+            slow_log_size=SLOW_QUERY_LOG_SIZE, trace_path=None,
+            trace_sample=0.01, sessions=None):
+        self.pool = pool
+        self.sessions = sessions
+        self.metrics = metrics or NULL_METRICS
+        self.slow_log_size = slow_log_size
+        self.trace_sample = trace_sample
+        self._trace = open(trace_path, 'a') if trace_path else None
+        self._random = random.Random()
+        self._lock = threading.Lock()
+        # template -> QueryStats
+        self.stats = {}
+        # min-heap of (duration, seq, entry), holding the slowest queries
+        self._slow = []
+        self._seq = 0
+
+    def execute(self, query, **params):
+        """
+        @param query - cypher query
+        @param params - parameters of the query
+        @return the records returned by the query
+        """
+        with self.pool.connection() as db_handler:
+            start_time = default_timer()
+            records = neo4j.CypherQuery(db_handler, query).execute(**params)
+        duration = default_timer() - start_time
+
+        rows = len(records.data) if records else 0
+        self.record(query_template(query), duration, rows, query, params)
+        return records
+
+    def execute_transaction(self, statements):
+        """
+        @param statements - list of (query, params)
+        @return the records returned by each statement. the statements are
+        sent together and committed in a single transaction, or not at all
+        """
+        with self.sessions.connection() as session:
+            start_time = default_timer()
+            tx = session.create_transaction()
+            try:
+                for query, params in statements:
+                    tx.append(query, params)
+                results = tx.commit()
+            except:
+                try:
+                    tx.rollback()
+                except Exception:
+                    pass
+                raise
+        duration = default_timer() - start_time
+
+        rows = sum([len(records) for records in results if records])
+        self.record('TRANSACTION %d x ' % len(statements) +
+                query_template(statements[0][0]), duration, rows)
+        return results
+
+    def call(self, operation, method, *args, **kwargs):
+        """
+        @param operation - name the call is recorded under
+        @param method - backend method other than a cypher query
+        @return whatever the method returns
+        """
+        start_time = default_timer()
+        result = method(*args, **kwargs)
+        duration = default_timer() - start_time
+
+        self.record(operation, duration, 0)
+        return result
+
+    def record(self, template, duration, rows, query=None, params=None):
+        self.metrics.backend_query()
+        self.metrics.observe("backend", duration * 1e6)
+
+        with self._lock:
+            stats = self.stats.get(template)
+            if not stats:
+                stats = self.stats[template] = QueryStats(template)
+            stats.add(duration, rows)
+
+            if len(self._slow) < self.slow_log_size or \
+                    duration > self._slow[0][0]:
+                self._seq += 1
+                entry = {
+                        "time": time.time(),
+                        "template": template,
+                        "params": params_shape(params or {}),
+                        "rows": rows,
+                        "duration_ms": duration * 1000,
+                        }
+                if len(self._slow) < self.slow_log_size:
+                    heapq.heappush(self._slow, (duration, self._seq, entry))
+                else:
+                    heapq.heapreplace(self._slow, (duration, self._seq, entry))
+
+            if self._trace and query and \
+                    self._random.random() < self.trace_sample:
+                self._trace.write(json.dumps({
+                        "time": time.time(),
+                        "query": query,
+                        "params": params or {},
+                        "rows": rows,
+                        "duration_ms": duration * 1000,
+                        }) + "\n")
+                self._trace.flush()
+
+    def slow_queries(self):
+        """
+        @return the slowest queries seen, slowest first
+        """
+        with self._lock:
+            return [entry for _, _, entry in sorted(self._slow,
+                    reverse=True)]
+
+    def profile(self):
+        """
+        @return per template statistics, most expensive (total time) first
+        """
+        with self._lock:
+            stats = [stats.snapshot() for stats in self.stats.values()]
+        return sorted(stats, key=lambda x: x["total_ms"], reverse=True)
+
+    def snapshot(self):
+        return {
+                "profile": self.profile(),
+                "slow_queries": self.slow_queries(),
+                "pool": self.pool.snapshot(),
+                "sessions": self.sessions.snapshot() if self.sessions
+                        else None,
+                }
+
+    def reset(self):
+        with self._lock:
+            self.stats = {}
+            self._slow = []
+
+    def close(self):
+        if self._trace:
+            self._trace.close()
+            self._trace = None
+        self.pool.close()
+        if self.sessions:
+            self.sessions.close()
+
+
+def replay_trace(path, executor):
+    """
+    @param path - trace file written by a QueryExecutor
+    @param executor - QueryExecutor to replay the queries with
+    @return the profile of the replayed queries
+    runs the traced queries again, in order, e.g. against a copy of the
+    database after changing indexes
+    """
+    executor.reset()
+    with open(path) as f:
+        for line in f:
+            entry = json.loads(line)
+            params = dict([(str(key), value)
+                    for key, value in entry["params"].items()])
+            executor.execute(entry["query"], **params)
+    return executor.profile()
@@ -26,59 +26,234 @@ from pyndn import Data
 from pyndn import ContentType
 from pyndn import KeyLocatorType
 from pyndn import Sha256WithRsaSignature
-from pyndn.security import KeyType
-from pyndn.security import KeyChain
-from pyndn.security.identity import IdentityManager
-from pyndn.security.identity import MemoryIdentityStorage
-from pyndn.security.identity import MemoryPrivateKeyStorage
 from pyndn.util import Blob
 from pyndn.util import SignedBlob
 
-from default_key import DEFAULT_PUBLIC_KEY_DER
-from default_key import DEFAULT_PRIVATE_KEY_DER
+# the pyndn security stack is only imported once something gets signed, see
+# Repo.key_chain()
 from repo_exceptions import AddToRepoException, NoRootException, \
-        UnsupportedQueryException
+        UnsupportedQueryException, CompressionException
+import compression
+from metrics import NULL_METRICS, BYTES_IN
+from query import QueryExecutor, check_connection, check_session
+from pool import ConnectionPool, DEFAULT_POOL_SIZE
+from locking import PrefixLocks
+from signing import SigningPolicy, SIGN_RSA
+from name_tree import NameCache, NAME_CACHE_SIZE
 
 import os
+import json
+import threading
+import time
 import base64
+import hashlib
 
 LABEL_COMPONENT = "Component"
 LABEL_SEGMENT = "Segment"
+LABEL_PAYLOAD = "Payload"
+LABEL_DICTIONARY = "Dictionary"
 
 PROPERTY_COMPONENT = "component"
 PROPERTY_DATA = "data"
 PROPERTY_LEAF = "leaf"
 PROPERTY_WRAPPED = "wrapped"
+# sha256 of the wired co, which is also its implicit digest
+PROPERTY_DIGEST = "digest"
+PROPERTY_REFS = "refs"
+# codec and compression dictionary of a stored payload
+PROPERTY_CODEC = "codec"
+PROPERTY_DICT_ID = "dict_id"
+PROPERTY_PREFIX = "prefix"
+PROPERTY_CREATED = "created"
+
+# packet metadata extracted once at insert time and kept on the segment node
+PROPERTY_KEY_LOCATOR = "key_locator"
+PROPERTY_FRESHNESS = "freshness"
+PROPERTY_CONTENT_TYPE = "content_type"
+PROPERTY_FINAL_BLOCK_ID = "final_block_id"
+PROPERTY_SIZE = "size"
+# insertion time and the time the co stops being fresh, both in ms since epoch
+PROPERTY_ARRIVAL = "arrival"
+PROPERTY_EXPIRY = "expiry"
+
+# indexes earlier schema versions created, and later ones drop. segment
+# properties are only compared on segments already found from their names,
+# never looked up by themselves, so their indexes only slowed down writes
+DROPPED_SEGMENT_INDEXES = [PROPERTY_KEY_LOCATOR, PROPERTY_FRESHNESS,
+        PROPERTY_CONTENT_TYPE, PROPERTY_FINAL_BLOCK_ID, PROPERTY_EXPIRY]
 
 RELATION_C2C = "CONTAINS_COMPONENT"
 RELATION_C2S = "CONTAINS_SEGMENT"
+RELATION_S2P = "REFERS_TO_PAYLOAD"
+
+# uri prefix of an implicit sha256 digest name component
+IMPLICIT_DIGEST_PREFIX = "sha256digest="
 
 MIN_SUFFIX_COMPS = 0
 MAX_SUFFIX_COMPS = 63
 
+# max number of nodes removed by a single delete query
+DELETE_BATCH_SIZE = 1000
+
+# number of stored cos a compression dictionary is trained on
+DICTIONARY_SAMPLES = 1000
+
+# version of the indexes and constraints create_indexes() sets up. a start
+# finding an older version in its state file creates them again
+SCHEMA_VERSION = 3
+# file in the state directory recording, per database, what earlier starts
+# have set up already
+STATE_FILE = "state.json"
+
 
 class Repo(object):
     # default object path
     _PATH = "/var/NDN/REPO"
 
-    def __init__(self, server=None, port=None, db=None, clear=False):
-        if not server:
-            self._server = "localhost"
-        if not port:
-            self._port = 7474
-        if not db:
-            self._db = "/db/data/"
+    def __init__(self, server=None, port=None, db=None, clear=False,
+            codec=None, metrics=None, trace_path=None,
+            pool_size=DEFAULT_POOL_SIZE, state_dir=None, signing_rules=None,
+            signing_default=SIGN_RSA, hmac_key=None,
+            name_cache_size=NAME_CACHE_SIZE):
+        self._server = server or "localhost"
+        self._port = port or 7474
+        self._db = db or "/db/data/"
 
         self._URI = "http://%s:%d%s" % (self._server, self._port, self._db)
         self.db_handler = neo4j.GraphDatabaseService(self._URI)
-
+        self.metrics = metrics or NULL_METRICS
+        # queries run on pooled keep-alive connections, and transactions in
+        # pooled sessions, so worker threads don't queue up behind a single
+        # one
+        self.pool = ConnectionPool(
+                lambda: neo4j.GraphDatabaseService(self._URI), pool_size,
+                health_check=check_connection, metrics=self.metrics)
+        self.sessions = ConnectionPool(
+                lambda: cypher.Session("http://%s:%d" % (self._server,
+                self._port)), pool_size, health_check=check_session,
+                metrics=self.metrics)
+        # every backend call goes through the executor, which profiles them
+        self.executor = QueryExecutor(self.pool, self.metrics,
+                trace_path=trace_path, sessions=self.sessions)
+
+        # codec new payloads are compressed with; stored payloads record
+        # their own codec, so it can be changed at any time
+        self._codec = codec or compression.CODEC_NONE
+        if self._codec not in compression.available_codecs():
+            raise CompressionException("unsupported codec %s" % self._codec)
+        # dict_id -> Dictionary, loaded on first use
+        self._dictionaries = {}
+        # name prefix -> dict_id of the newest dictionary for the prefix
+        self._prefix_dictionaries = {}
+        # the hot part of the name tree, resident in memory, so that reads
+        # locate their names without a path query
+        self.names = NameCache(name_cache_size) if name_cache_size else None
+
+        # every write is a single statement, so readers always see either
+        # the old or the new state and need no locks. writers to the same
+        # prefix exclude each other
+        self.locks = PrefixLocks(lock_reads=False)
+
+        # built on first use by each signing thread, see key_chain()
+        self._signing = threading.local()
+        # picks the signer of new cos by name prefix, see wrap_content()
+        self.signing_policy = SigningPolicy(signing_rules, signing_default,
+                self.key_chain, hmac_key)
+
+        self.state_dir = state_dir
+        state = self.load_state()
         if clear:
-            self.db_handler.clear()
+            self.executor.call("clear", self.db_handler.clear)
+            state = {}
+
+        if state.get("root") is not None and \
+                state.get("schema") == SCHEMA_VERSION:
+            # set up by an earlier start, verify_state() checks it is still
+            # current without holding up the start
+            self.root = self.db_handler.node(state["root"])
+        else:
+            try:
+                self.check_or_create_root()
+            except NoRootException as ex:
+                print "Error: __init__: %s" % str(ex)
 
+            self.create_indexes()
+            if getattr(self, "root", None):
+                self.save_state()
+
+        # only needed to pick dictionaries for new payloads
+        if self._codec == compression.CODEC_ZSTD:
+            self.load_dictionaries()
+
+    def state_path(self):
+        return os.path.join(self.state_dir, STATE_FILE) \
+                if self.state_dir else None
+
+    def load_state(self):
+        """
+        @return what earlier starts recorded about this database, e.g. the
+        id of the root node, or {} if nothing was recorded
+        """
+        path = self.state_path()
+        if not path or not os.path.exists(path):
+            return {}
         try:
-            self.check_or_create_root()
-        except NoRootException as ex:
-            print "Error: __init__: %s" % str(ex)
+            with open(path) as f:
+                return json.load(f).get(self._URI, {})
+        except ValueError as ex:
+            print "Error: load_state: %s" % str(ex)
+            return {}
+
+    def save_state(self):
+        """
+        records the root node and schema version of this database, so that
+        the next start can skip setting them up
+        """
+        path = self.state_path()
+        if not path:
+            return
+        if not os.path.isdir(self.state_dir):
+            os.makedirs(self.state_dir)
+
+        states = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                states = json.load(f)
+        states[self._URI] = {"root": self.root._id, "schema": SCHEMA_VERSION}
+        with open(path + ".tmp", "w") as f:
+            json.dump(states, f)
+        # readers never see a partially written file
+        os.rename(path + ".tmp", path)
+
+    def verify_state(self):
+        """
+        checks the root node taken from the state file still exists, and
+        sets it up again otherwise (e.g. if the database was cleared by
+        someone else in between)
+        """
+        root = self.root
+        self.check_or_create_root()
+        if self.root._id != root._id:
+            print "root node moved from %s to %s" % (root._id, self.root._id)
+            if self.names:
+                self.names.clear()
+            self.create_indexes()
+            self.save_state()
+
+    def execute_query(self, query, **params):
+        """
+        @param query - cypher query
+        @param params - parameters of the query
+        @return the records returned by the query
+        """
+        return self.executor.execute(query, **params)
+
+    def get_properties(self, node):
+        """
+        @param node - node returned by a query
+        @return the properties of the node
+        """
+        return self.executor.call("get_properties", node.get_properties)
 
     def print_tree(self, root=None, level=0):
         """
@@ -90,14 +265,14 @@ class Repo(object):
         for lv in range(level):
             print '  ',
         try:
-            print root.get_properties()
+            print self.get_properties(root)
         except Exception as ex:
-            print 'data: %s' % repr(root.get_properties())
+            print 'data: %s' % repr(self.get_properties(root))
 
         query = 'START s=node(%s)\n' % root._id +\
                 'MATCH (s)-[r]->(c)\n' + \
                 'RETURN c'
-        records = neo4j.CypherQuery(self.db_handler, query).execute()
+        records = self.execute_query(query)
 
         nodes = [record.values[0] for record in records.data]
         for node in nodes:
@@ -108,26 +283,195 @@ class Repo(object):
         checks or creates the root node in graph database, which is
         (:Component {component:"ndn"})
         """
-        self.root = self.db_handler.get_or_create_indexed_node("root", 
+        self.root = self.executor.call("get_or_create_indexed_node",
+                self.db_handler.get_or_create_indexed_node, "root",
                 "root_name", "ndn", {"component":"ndn"})
         if not self.root:
             raise NoRootException("cannot locate root name (ndn)")
 
-        self.root.add_labels(LABEL_COMPONENT)
+        self.executor.call("add_labels", self.root.add_labels,
+                LABEL_COMPONENT)
+
+    def create_indexes(self):
+        """
+        creates the schema constraints, and drops the segment metadata
+        indexes earlier schema versions created. creating a constraint that
+        already exists is a no-op
+        """
+        for key in DROPPED_SEGMENT_INDEXES:
+            query = 'DROP INDEX ON :%s(%s)' % (LABEL_SEGMENT, key)
+            try:
+                self.execute_query(query)
+            except Exception:
+                # dropping an index that does not exist fails
+                pass
+
+        query = 'CREATE CONSTRAINT ON (p:%s) ' % LABEL_PAYLOAD + \
+                'ASSERT p.%s IS UNIQUE' % PROPERTY_DIGEST
+        self.execute_query(query)
+
+        query = 'CREATE CONSTRAINT ON (d:%s) ' % LABEL_DICTIONARY + \
+                'ASSERT d.%s IS UNIQUE' % PROPERTY_DICT_ID
+        self.execute_query(query)
+
+    def load_dictionaries(self):
+        """
+        loads which compression dictionary each name prefix uses. the
+        dictionaries themselves are only fetched when first needed
+        """
+        query = 'MATCH (d:%s)\n' % LABEL_DICTIONARY + \
+                'RETURN d.%s, d.%s\n' % (PROPERTY_PREFIX, PROPERTY_DICT_ID) + \
+                'ORDER BY d.%s' % PROPERTY_CREATED
+        records = self.execute_query(query)
+        for record in records.data:
+            prefix, dict_id = record.values
+            self._prefix_dictionaries[prefix] = dict_id
+
+    def get_dictionary(self, dict_id):
+        """
+        @param dict_id - id of a stored compression dictionary
+        @return the Dictionary with the given id
+        """
+        if dict_id in self._dictionaries:
+            self.metrics.cache_hit("dictionary")
+            return self._dictionaries[dict_id]
+        self.metrics.cache_miss("dictionary")
+
+        query = 'MATCH (d:%s {%s:{dict_id}})\n' % (LABEL_DICTIONARY,
+                PROPERTY_DICT_ID) + \
+                'RETURN d.%s, d.%s' % (PROPERTY_PREFIX, PROPERTY_DATA)
+        records = self.execute_query(query,
+                dict_id=dict_id)
+        if not records:
+            raise CompressionException("unknown dictionary %s" % dict_id)
+
+        prefix, data = records.data[0].values
+        dictionary = compression.Dictionary(prefix, base64.b64decode(data))
+        self._dictionaries[dict_id] = dictionary
+        return dictionary
+
+    def find_dictionary(self, name):
+        """
+        @param name - name of a co
+        @return the Dictionary of the longest prefix of name that has one,
+        or None
+        """
+        if not self._prefix_dictionaries:
+            return None
+
+        name = Name(name)
+        for i in range(name.size(), 0, -1):
+            dict_id = self._prefix_dictionaries.get(
+                    name.getPrefix(i).toUri())
+            if dict_id:
+                return self.get_dictionary(dict_id)
+        return None
+
+    def train_dictionary(self, prefix, samples=DICTIONARY_SAMPLES,
+            size=compression.DEFAULT_DICTIONARY_SIZE):
+        """
+        @param prefix - name prefix to train the dictionary for
+        @param samples - max number of stored cos to train on
+        @param size - max size of the dictionary in bytes
+        @return the trained Dictionary
+        trains a compression dictionary on cos stored under prefix. cos
+        inserted under prefix afterwards are compressed with it
+        """
+        prefix = Name(prefix)
+        last_node = self.locate_last_node(prefix)
+        if not last_node:
+            raise CompressionException("nothing stored under %s" %
+                    prefix.toUri())
+
+        query = 'START s=node(%s)\n' % last_node._id + \
+                'MATCH (s)-[:%s*0..]->()-[:%s]->()-[:%s]->(p)\n' % (
+                RELATION_C2C, RELATION_C2S, RELATION_S2P) + \
+                'RETURN p.%s, p.%s, p.%s\n' % (PROPERTY_DATA, PROPERTY_CODEC,
+                PROPERTY_DICT_ID) + \
+                'LIMIT %d' % samples
+        records = self.execute_query(query)
+        data = [self.decode_payload(*record.values)
+                for record in records.data]
+        dictionary = compression.train_dictionary(prefix.toUri(), data, size)
+
+        query = 'MERGE (d:%s {%s:{dict_id}})\n' % (LABEL_DICTIONARY,
+                PROPERTY_DICT_ID) + \
+                'SET d.%s = {prefix}, d.%s = {data}, d.%s = {created}' % (
+                PROPERTY_PREFIX, PROPERTY_DATA, PROPERTY_CREATED)
+        self.execute_query(query,
+                dict_id=dictionary.dict_id, prefix=dictionary.prefix,
+                data=base64.b64encode(dictionary.data),
+                created=int(time.time() * 1000))
+
+        self._dictionaries[dictionary.dict_id] = dictionary
+        self._prefix_dictionaries[dictionary.prefix] = dictionary.dict_id
+        return dictionary
+
+    def encode_payload(self, name, data):
+        """
+        @param name - name of the co
+        @param data - wired co
+        @return (stored data, codec, dict_id) for the payload of the co
+        """
+        dictionary = None
+        if self._codec == compression.CODEC_ZSTD:
+            dictionary = self.find_dictionary(name)
+        codec, data = compression.compress(data, self._codec, dictionary)
+        dict_id = dictionary.dict_id if dictionary and \
+                codec == compression.CODEC_ZSTD else None
+        return base64.b64encode(data), codec, dict_id
+
+    def decode_payload(self, data, codec=None, dict_id=None):
+        """
+        @param data - payload data as stored
+        @param codec - codec recorded for the payload
+        @param dict_id - compression dictionary recorded for the payload
+        @return the wired co
+        """
+        with self.metrics.timer("payload_decode"):
+            data = base64.b64decode(data)
+            dictionary = self.get_dictionary(dict_id) if dict_id else None
+            return compression.decompress(data, codec, dictionary)
 
-    def wrap_content(self, name, content, key=None, key_locator=None):
+    def wrap_content(self, name, content, key=None, key_locator=None,
+            freshness_period=5000):
         """
         @param name - name of the data
         @param content - data to be wrapped
         @param key - key used to sign the data
+        @param freshness_period - freshness period of the data in ms
         @return the content object created
-        wraps the given name and content into a content object
+        wraps the given name and content into a content object, signed as
+        the signing policy says for the name
         """
         co = Data(Name(name))
         co.setContent(content)
-        co.getMetaInfo().setFreshnessPeriod(5000)
+        co.getMetaInfo().setFreshnessPeriod(freshness_period)
         co.getMetaInfo().setFinalBlockID(Name("/%00%09")[0])
 
+        self.signing_policy.sign(co)
+
+        _data = co.wireEncode()
+
+        return _data.toRawStr()
+
+    def key_chain(self):
+        """
+        @return (keyChain, certificateName) signing with the default key,
+        built (and the security stack imported) on first use only. each
+        thread gets its own, so that several threads can sign at once
+        """
+        if getattr(self._signing, "key_chain", None):
+            return self._signing.key_chain, self._signing.certificate_name
+
+        from pyndn.security import KeyType
+        from pyndn.security import KeyChain
+        from pyndn.security.identity import IdentityManager
+        from pyndn.security.identity import MemoryIdentityStorage
+        from pyndn.security.identity import MemoryPrivateKeyStorage
+        from default_key import DEFAULT_PUBLIC_KEY_DER
+        from default_key import DEFAULT_PRIVATE_KEY_DER
+
         identityStorage = MemoryIdentityStorage()
         privateKeyStorage = MemoryPrivateKeyStorage()
         identityManager = IdentityManager(identityStorage, privateKeyStorage)
@@ -141,11 +485,9 @@ class Repo(object):
         privateKeyStorage.setKeyPairForKeyName(keyName, DEFAULT_PUBLIC_KEY_DER, 
                 DEFAULT_PRIVATE_KEY_DER)
 
-        keyChain.sign(co, certificateName)
-
-        _data = co.wireEncode()
-
-        return _data.toRawStr()
+        self._signing.key_chain = keyChain
+        self._signing.certificate_name = certificateName
+        return keyChain, certificateName
 
     def name_to_path(self, name, wrapped=True):
         """
@@ -179,12 +521,14 @@ class Repo(object):
         return path
 
     @staticmethod
-    def create_path_query(path, action, start=None):
+    def create_path_query(path, action, start=None, returns=None):
         """
         @param path - list of path nodes and relations
         @param action - action of the query, could be "MATCH" or 
                         "CREATE UNIQUE"
         @param start - internal _id of start node
+        @param returns - clauses to follow the path instead of returning
+                         the last node
         @return the query
         creates a path query starting from root ("ndn")
         """
@@ -204,48 +548,237 @@ class Repo(object):
         items = ['-[%s]->(%s)'] * path_len
         query += ''.join(items)
         query = query % tuple(path)
-        query += ' \nRETURN (%s)' % path[-1].split(':')[0]
+        if returns:
+            query += ' \n' + returns
+        else:
+            query += ' \nRETURN (%s)' % path[-1].split(':')[0]
 
         return query
 
-    def add_to_graphdb(self, name, data, wrapped):
+    @staticmethod
+    def key_locator_to_string(key_locator):
+        """
+        @param key_locator - KeyLocator instance
+        @return string form of the key locator as stored in the segment
+        node, or None if the key locator is not set
+        """
+        kl_type = key_locator.getType()
+        if kl_type == KeyLocatorType.KEYNAME:
+            return key_locator.getKeyName().toUri()
+        elif kl_type == KeyLocatorType.KEY_LOCATOR_DIGEST:
+            return 'digest:%s' % key_locator.getKeyData().toHex()
+        return None
+
+    @staticmethod
+    def extract_meta_info(co):
+        """
+        @param co - decoded content object
+        @return dict of segment properties describing the co
+        collects the facts selectors need from a co, so that they never have
+        to decode stored data again
+        """
+        meta_info = co.getMetaInfo()
+        meta = {}
+
+        signature = co.getSignature()
+        if hasattr(signature, 'getKeyLocator'):
+            key_locator = Repo.key_locator_to_string(
+                    signature.getKeyLocator())
+            if key_locator:
+                meta[PROPERTY_KEY_LOCATOR] = key_locator
+
+        freshness = meta_info.getFreshnessPeriod()
+        if freshness is not None and freshness >= 0:
+            meta[PROPERTY_FRESHNESS] = int(freshness)
+
+        meta[PROPERTY_CONTENT_TYPE] = int(meta_info.getType())
+
+        final_block_id = meta_info.getFinalBlockID()
+        if final_block_id.getValue().size() > 0:
+            meta[PROPERTY_FINAL_BLOCK_ID] = final_block_id.toEscapedString()
+
+        meta[PROPERTY_SIZE] = co.getContent().size()
+
+        return meta
+
+    def release_payloads(self, segment_ids):
+        """
+        @param segment_ids - internal _ids of segment nodes
+        drops the payload references held by the given segments. payloads
+        no longer referenced by any segment are removed
+        """
+        if not segment_ids:
+            return
+
+        query = 'START c=node(%s)\n' % ','.join(map(str, segment_ids)) + \
+                'MATCH (c)-[r:%s]->(p)\n' % RELATION_S2P + \
+                'DELETE r\n' + \
+                'SET p.%s = p.%s - 1\n' % (PROPERTY_REFS, PROPERTY_REFS) + \
+                'WITH DISTINCT p\n' + \
+                'WHERE p.%s <= 0\n' % PROPERTY_REFS + \
+                'DELETE p'
+        self.execute_query(query)
+
+    def add_to_graphdb(self, name, data, wrapped, meta=None):
         """
         @param name - name of a given content object
         @param data - data to store under name
-        adds a record describing the name and its co (on disk) to graphdb
+        @param meta - packet metadata to be kept on the segment node
+        adds a record describing the name and its co (on disk) to graphdb.
+        the data itself is stored once per sha256 digest in a payload node
+        shared by all segments referring to it
         """
-        data = base64.b64encode(data)
+        digest = hashlib.sha256(data).hexdigest()
+        properties = dict(meta or {})
+        properties[PROPERTY_WRAPPED] = str(wrapped)
+        properties[PROPERTY_DIGEST] = digest
         path = self.name_to_path(name, wrapped=wrapped)
-
+        leaf = path[-1].split(':')[0]
+
+        # creates the path and looks up the existing segment at once. an
+        # identical co being written again only refreshes its timestamps
+        params = {'digest': digest}
+        refresh = []
+        for key in [PROPERTY_ARRIVAL, PROPERTY_EXPIRY]:
+            if key in properties:
+                refresh.append('x.%s = {%s}' % (key, key))
+                params[key] = properties[key]
+        returns = 'WITH %s\n' % leaf + \
+                'OPTIONAL MATCH (%s)-[:%s]->(c)\n' % (leaf, RELATION_C2S)
+        if refresh:
+            returns += 'FOREACH (x IN CASE WHEN c.%s = {digest} ' % (
+                    PROPERTY_DIGEST) + \
+                    'THEN [c] ELSE [] END | SET %s)\n' % ', '.join(refresh)
+        returns += 'RETURN id(%s), id(c), c.%s' % (leaf, PROPERTY_DIGEST)
         try:
-            query = self.create_path_query(path, 'CREATE UNIQUE')
+            query = self.create_path_query(path, 'CREATE UNIQUE',
+                    returns=returns)
         except UnsupportedQueryException as ex:
             raise AddToRepoException(str(ex))
-        records = neo4j.CypherQuery(self.db_handler, query).execute()
-
-        leaf_node = records.data[0][0]
-        query = 'START s=node(%s)\n' % leaf_node._id + \
-                'MATCH (s)-[r:%s]->(c)\n' % RELATION_C2S + \
-                'RETURN c'
-        records = neo4j.CypherQuery(self.db_handler, query).execute()
-        if not records:
+        records = self.execute_query(query, **params)
+
+        leaf_id, seg_id, seg_digest = records.data[0].values
+        if seg_digest == digest:
+            return
+
+        data, codec, dict_id = self.encode_payload(name, data)
+        params = {
+                'digest': digest,
+                'data': data,
+                'codec': codec,
+                'dict_id': dict_id,
+                'properties': properties,
+                }
+        payload = 'MERGE (p:%s {%s:{digest}})\n' % (LABEL_PAYLOAD,
+                PROPERTY_DIGEST) + \
+                'ON CREATE SET p.%s = {data}, p.%s = {codec}, ' % (
+                PROPERTY_DATA, PROPERTY_CODEC) + \
+                'p.%s = {dict_id}, p.%s = 0\n' % (PROPERTY_DICT_ID,
+                PROPERTY_REFS)
+        if seg_id is None:
             # create segment node for data
             rel = 'r:%s' % RELATION_C2S
-            node = 'c:%s {%s:"%s", %s:"%s"}' % (LABEL_SEGMENT, 
-                    PROPERTY_DATA, data,
-                    PROPERTY_WRAPPED, wrapped)
-            query = 'START s=node(%s)\n' % leaf_node._id + \
-                    'CREATE (s)-[%s]->(%s)\n' % (rel, node) + \
-                    'SET s.%s = "%s"\n' % (PROPERTY_LEAF, "True") + \
-                    'RETURN c'
-            records = neo4j.CypherQuery(self.db_handler, query).execute()
+            node = 'c:%s {properties}' % LABEL_SEGMENT
+            query = 'START s=node(%s)\n' % leaf_id + \
+                    payload + \
+                    'CREATE (s)-[%s]->(%s)-[:%s]->(p)\n' % (rel, node,
+                    RELATION_S2P) + \
+                    'SET s.%s = "%s", ' % (PROPERTY_LEAF, "True") + \
+                    'p.%s = p.%s + 1\n' % (PROPERTY_REFS, PROPERTY_REFS) + \
+                    'RETURN id(c)'
         else:
-            seg_node = records.data[0][0]
-            query = 'START c=node(%s)\n' % seg_node._id + \
-                    'MATCH (c)\n' + \
-                    'SET c.%s = "%s"\n' % (PROPERTY_DATA, data) + \
-                    'RETURN c'
-            records = neo4j.CypherQuery(self.db_handler, query).execute()
+            # replace payload and metadata of the existing segment, and
+            # release the old payload, in the same statement, so that readers
+            # never see the segment without a payload
+            query = 'START c=node(%s)\n' % seg_id + \
+                    'OPTIONAL MATCH (c)-[q:%s]->(o)\n' % RELATION_S2P + \
+                    'WITH c, q, o\n' + \
+                    payload + \
+                    'CREATE (c)-[:%s]->(p)\n' % RELATION_S2P + \
+                    'SET c = {properties}, ' + \
+                    'p.%s = p.%s + 1\n' % (PROPERTY_REFS, PROPERTY_REFS) + \
+                    'FOREACH (x IN CASE WHEN o IS NULL ' + \
+                    'THEN [] ELSE [o] END |\n' + \
+                    '  SET x.%s = x.%s - 1)\n' % (PROPERTY_REFS,
+                    PROPERTY_REFS) + \
+                    'FOREACH (x IN CASE WHEN q IS NULL ' + \
+                    'THEN [] ELSE [q] END |\n' + \
+                    '  DELETE x)\n' + \
+                    'FOREACH (x IN CASE WHEN o IS NOT NULL AND ' + \
+                    'o.%s <= 0 THEN [o] ELSE [] END |\n' % PROPERTY_REFS + \
+                    '  DELETE x)\n' + \
+                    'RETURN id(c)'
+        self.execute_query(query, **params)
+
+    def upsert_statement(self, name, data, meta):
+        """
+        @param name - name of a given content object
+        @param data - data to store under name
+        @param meta - packet metadata to be kept on the segment node
+        @return (query, params) doing all of add_to_graphdb in a single
+        statement, so that statements for many cos can be sent in one
+        transaction without waiting for the result of any
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        properties = dict(meta or {})
+        properties[PROPERTY_WRAPPED] = str(True)
+        properties[PROPERTY_DIGEST] = digest
+        path = self.name_to_path(name)
+        leaf = path[-1].split(':')[0]
+
+        data, codec, dict_id = self.encode_payload(name, data)
+        params = {
+                'digest': digest,
+                'data': data,
+                'codec': codec,
+                'dict_id': dict_id,
+                'properties': properties,
+                'arrival': properties.get(PROPERTY_ARRIVAL),
+                'expiry': properties.get(PROPERTY_EXPIRY),
+                }
+        # c: the existing segment, if any. o: its payload
+        returns = 'WITH %s AS s\n' % leaf + \
+                'OPTIONAL MATCH (s)-[:%s]->(c)\n' % RELATION_C2S + \
+                'OPTIONAL MATCH (c)-[q:%s]->(o)\n' % RELATION_S2P + \
+                'WITH s, c, q, o, c IS NOT NULL AND ' + \
+                'coalesce(c.%s, "") <> {digest} AS changed\n' % (
+                PROPERTY_DIGEST) + \
+                'MERGE (p:%s {%s:{digest}})\n' % (LABEL_PAYLOAD,
+                PROPERTY_DIGEST) + \
+                'ON CREATE SET p.%s = {data}, p.%s = {codec}, ' % (
+                PROPERTY_DATA, PROPERTY_CODEC) + \
+                'p.%s = {dict_id}, p.%s = 0\n' % (PROPERTY_DICT_ID,
+                PROPERTY_REFS) + \
+                'FOREACH (x IN CASE WHEN c IS NULL ' + \
+                'THEN [s] ELSE [] END |\n' + \
+                '  CREATE (x)-[:%s]->(:%s {properties})' % (RELATION_C2S,
+                LABEL_SEGMENT) + \
+                '-[:%s]->(p)\n' % RELATION_S2P + \
+                '  SET x.%s = "True", ' % PROPERTY_LEAF + \
+                'p.%s = p.%s + 1)\n' % (PROPERTY_REFS, PROPERTY_REFS) + \
+                'FOREACH (x IN CASE WHEN changed ' + \
+                'THEN [c] ELSE [] END |\n' + \
+                '  CREATE (x)-[:%s]->(p)\n' % RELATION_S2P + \
+                '  SET x = {properties}, ' + \
+                'p.%s = p.%s + 1)\n' % (PROPERTY_REFS, PROPERTY_REFS) + \
+                'FOREACH (x IN CASE WHEN changed AND o IS NOT NULL ' + \
+                'THEN [o] ELSE [] END |\n' + \
+                '  SET x.%s = x.%s - 1)\n' % (PROPERTY_REFS,
+                PROPERTY_REFS) + \
+                'FOREACH (x IN CASE WHEN changed AND q IS NOT NULL ' + \
+                'THEN [q] ELSE [] END |\n' + \
+                '  DELETE x)\n' + \
+                'FOREACH (x IN CASE WHEN changed AND o IS NOT NULL AND ' + \
+                'o.%s <= 0 THEN [o] ELSE [] END |\n' % PROPERTY_REFS + \
+                '  DELETE x)\n' + \
+                'FOREACH (x IN CASE WHEN c IS NOT NULL AND NOT changed ' + \
+                'THEN [c] ELSE [] END |\n' + \
+                '  SET x.%s = {arrival}, ' % PROPERTY_ARRIVAL + \
+                'x.%s = {expiry})\n' % PROPERTY_EXPIRY + \
+                'RETURN id(s)'
+        query = self.create_path_query(path, 'CREATE UNIQUE',
+                returns=returns)
+        return query, params
 
     # insert a content object to repo under given name
     def add_content_object_to_repo(self, name, co, wired=True):
@@ -255,15 +788,60 @@ class Repo(object):
         @param wired - whether the co given is in wired format
         inserts a given co to the repo
         """
+        with self.metrics.request("insert"):
+            name, data, meta = self.prepare_content_object(name, co, wired)
+            try:
+                with self.metrics.timer("insert.write"), \
+                        self.locks.write(name):
+                    self.add_to_graphdb(name, data, wrapped=True, meta=meta)
+            except AddToRepoException as ex:
+                print "Error: add_content_object_to_repo: %s" % str(ex)
+
+    def prepare_content_object(self, name, co, wired=True):
+        """
+        @param name - name of the content object
+        @param co - content obejct to be inserted
+        @param wired - whether the co given is in wired format
+        @return (uri of the name, wired co, segment metadata)
+        """
         name = Name(name).toUri()
-        if not wired:
-            data = co.wireEncode().toRawStr()
-        else:
-            data = co
-        try:
-            self.add_to_graphdb(name, data, wrapped=True)
-        except AddToRepoException as ex:
-            print "Error: add_content_object_to_repo: %s" % str(ex)
+        with self.metrics.timer("insert.wire_decode"):
+            if not wired:
+                data = co.wireEncode().toRawStr()
+            else:
+                data = co
+                co = Data()
+                co.wireDecode(Blob.fromRawStr(data))
+            meta = self.extract_meta_info(co)
+        self.metrics.count(BYTES_IN, len(data))
+
+        # a co without freshness period is stale as soon as it arrives
+        arrival = int(time.time() * 1000)
+        meta[PROPERTY_ARRIVAL] = arrival
+        meta[PROPERTY_EXPIRY] = arrival + meta.get(PROPERTY_FRESHNESS, 0)
+        return name, data, meta
+
+    def add_content_objects_to_repo(self, items, wired=True):
+        """
+        @param items - list of (name, co)
+        @param wired - whether the cos given are in wired format
+        inserts the given cos in a single transaction, one statement each,
+        so that a batch costs one round trip to the database. either all
+        of them are inserted or, if the transaction fails, none
+        """
+        if not items:
+            return
+
+        with self.metrics.request("insert_batch"):
+            prepared = [self.prepare_content_object(name, co, wired)
+                    for name, co in items]
+            names = [name for name, data, meta in prepared]
+            with self.metrics.timer("insert_batch.write"), \
+                    self.locks.write_many(names):
+                statements = [self.upsert_statement(*item)
+                        for item in prepared]
+                self.executor.execute_transaction(statements)
+            self.metrics.observe("insert_batch.size", len(items))
 
 #    def add_to_repo(self, name, content, wrapped=True):
 #        """
@@ -293,7 +871,7 @@ class Repo(object):
         query = 'START s=node(%s)\n' % _id + \
                 'MATCH (s)-[:%s]->(m)\n' % (RELATION_C2C) + \
                 'RETURN (m)'
-        records = neo4j.CypherQuery(self.db_handler, query).execute()
+        records = self.execute_query(query)
         _nodes = [record.values[0] for record in records.data]
 
         if not exclude:
@@ -302,7 +880,7 @@ class Repo(object):
         nodes = []
         for node in _nodes:
             name = Name()
-            name.set(node.get_properties()[PROPERTY_COMPONENT])
+            name.set(self.get_properties(node)[PROPERTY_COMPONENT])
             comp = name.get(0)
             if not exclude.matches(comp):
                 nodes.append(node)
@@ -321,7 +899,7 @@ class Repo(object):
             return []
 
         nodes.sort(key=lambda x:Name('/' + \
-                str(x.get_properties()[PROPERTY_COMPONENT])))
+                str(self.get_properties(x)[PROPERTY_COMPONENT])))
         nodes = [nodes[0]] if child_selector == 0 else [nodes[-1]]
         return nodes
 
@@ -348,29 +926,32 @@ class Repo(object):
                 RELATION_C2C, min_suffix_components, 
                 max_suffix_components, LABEL_COMPONENT, PROPERTY_LEAF) + \
                 'RETURN (m)'
-        records = neo4j.CypherQuery(self.db_handler, query).execute()
+        records = self.execute_query(query)
         nodes = [record.values[0] for record in records.data]
 
         return nodes
 
     def extract_co_from_db(self, leaf_node, wired=True):
         try:
-            # by design, there is AT MOST one C2S relation for each node
+            # by design, there is AT MOST one C2S relation for each node.
+            # segments written before payloads were shared keep data inline
             query = 'START s=node(%s)\n' % leaf_node._id + \
                     'MATCH (s)-[r:%s]->(c)\n' % RELATION_C2S + \
-                    'RETURN c'
-            records = neo4j.CypherQuery(self.db_handler, query).execute()
-            nodes = [record.values[0] for record in records.data]
-            segment_node = nodes[0]
-
-            properties = segment_node.get_properties()
-            wrapped = eval(properties[PROPERTY_WRAPPED])
-            _data = properties[PROPERTY_DATA]
-            data = base64.b64decode(_data)
+                    'OPTIONAL MATCH (c)-[:%s]->(p)\n' % RELATION_S2P + \
+                    'RETURN coalesce(p.%s, c.%s), p.%s, p.%s' % (
+                    PROPERTY_DATA, PROPERTY_DATA, PROPERTY_CODEC,
+                    PROPERTY_DICT_ID)
+            records = self.execute_query(query)
+            if not records:
+                return None
+
+            # only the finally selected co is ever decompressed
+            data = self.decode_payload(*records.data[0].values)
             # decode wired co to ContentObject instance
 #            if not wired:
-            co = Data()
-            co.wireDecode(Blob.fromRawStr(data))
+            with self.metrics.timer("wire_decode"):
+                co = Data()
+                co.wireDecode(Blob.fromRawStr(data))
             return co
 #            else:
 #                return data
@@ -378,34 +959,87 @@ class Repo(object):
             return None
 
 
+    def apply_segment_selectors(self, nodes, key_locator=None,
+            must_be_fresh=False):
+        """
+        @param nodes - leaf nodes to be checked
+        @param key_locator - key locator given by the interest
+        @param must_be_fresh - whether the interest asks for fresh data only
+        @return the nodes whose co satisfies the given selectors. all nodes
+        are returned if neither selector is set
+        evaluates the selectors answered by segment metadata. this compares
+        against the properties kept on the segment node rather than fetching
+        and decoding each candidate. the query starts from the candidates,
+        which are few next to the segments a property index would return
+        """
+        if not nodes:
+            return nodes
+
+        conditions = []
+        params = {}
+        key_locator = self.key_locator_to_string(key_locator) \
+                if key_locator else None
+        if key_locator:
+            conditions.append('c.%s = {key_locator}' % PROPERTY_KEY_LOCATOR)
+            params['key_locator'] = key_locator
+        if must_be_fresh:
+            conditions.append('c.%s > {now}' % PROPERTY_EXPIRY)
+            params['now'] = int(time.time() * 1000)
+        if not conditions:
+            return nodes
+
+        ids = ','.join([str(node._id) for node in nodes])
+        query = 'START s=node(%s)\n' % ids + \
+                'MATCH (s)-[:%s]->(c:%s)\n' % (RELATION_C2S, LABEL_SEGMENT) + \
+                'WHERE %s\n' % ' AND '.join(conditions) + \
+                'RETURN s'
+        records = self.execute_query(query, **params)
+        nodes = [record.values[0] for record in records.data]
+
+        return nodes
+
     def apply_key_locator(self, nodes, key_locator):
         """
-        @param nodes - nodes to be checked
+        @param nodes - leaf nodes to be checked
         @param key_locator - key locator given by the interest
-        checks the given nodes for key locator
+        @return the nodes whose co is signed under the given key locator
         """
-        if not key_locator:
-            return None
+        return self.apply_segment_selectors(nodes, key_locator=key_locator)
 
-        _nodes = []
-        for node in nodes:
-            co = self.extract_co_from_db(node, wired=False)
-            kl = co.getKeyLocator()
+    def apply_must_be_fresh(self, nodes, must_be_fresh):
+        """
+        @param nodes - leaf nodes to be checked
+        @param must_be_fresh - whether the interest asks for fresh data only
+        @return the nodes whose co has not expired yet
+        """
+        return self.apply_segment_selectors(nodes,
+                must_be_fresh=must_be_fresh)
 
-    def locate_last_node(self, name):
+    def locate_last_node(self, name, cached=True):
         """
         @param interest - the interest that contains the name prefix
+        @param cached - whether the node may come from the name cache.
+                        deletes never take it from there
         @return the node found according to the prefix
         """
-        name = name.toUri()
-        path = self.name_to_path(name)
+        generation = None
+        if self.names:
+            if cached:
+                node_id = self.names.get(name)
+                if node_id is not None:
+                    self.metrics.cache_hit("names")
+                    return self.db_handler.node(node_id)
+                self.metrics.cache_miss("names")
+            generation = self.names.generation
+
+        path = self.name_to_path(name.toUri())
         # create a cypher query to match the path
         try:
             query = self.create_path_query(path, 'MATCH')
         except UnsupportedQueryException as ex:
             print 'Error: extract_from_repo: %s' % str(ex)
 
-        records = neo4j.CypherQuery(self.db_handler, query).execute()
+        records = self.execute_query(query)
         if not records:
             return None
         # in the name tree there should be AT MOST one match for a 
@@ -413,18 +1047,22 @@ class Repo(object):
         assert(len(records.data) == 1)
         assert(len(records.data[0].values) == 1)
         last_node = records.data[0].values[0]
+        if self.names:
+            self.names.put(name, last_node._id, generation)
 
         return last_node
 
-    def apply_selectors(self, last_node, interest):
+    def apply_selectors(self, last_node, interest, must_be_fresh=True):
         """
         @param last_node - starting node to apply the selectors
         @param interest - interest that contains the selectors
+        @param must_be_fresh - whether to apply the MustBeFresh of the
+                               interest. deletes remove stale data too
         @return all nodes that fulfill the selectors
         """
         exclude = interest.getExclude()
         child_selector = interest.getChildSelector()
-        if exclude or child_selector:
+        if exclude or child_selector is not None:
             # Exclude
             nodes = self.apply_exclude(last_node, exclude)
             # ChildSelector
@@ -442,6 +1080,13 @@ class Repo(object):
         if not nodes:
             return None
 
+        # PublisherPublicKeyLocator and MustBeFresh, in one query
+        nodes = self.apply_segment_selectors(nodes,
+                interest.getKeyLocator(),
+                must_be_fresh and interest.getMustBeFresh())
+        if not nodes:
+            return None
+
         # no need to have a specific order
 #        nodes.sort(
 #                key=lambda x:Name('/' + \
@@ -449,76 +1094,293 @@ class Repo(object):
 
         return nodes
 
-    def extract_from_repo(self, interest, wired=True):
+    @staticmethod
+    def get_implicit_digest(name):
         """
-        @param interest - the interest requesting a content object
-        @param wired - whether to return the wired format co
-        @return the requested content object in wired format. if does not 
-        exist return None
+        @param name - Name instance
+        @return the hex sha256 digest carried by the last component of the
+        name, or None if the name has no implicit digest component
         """
-        # find last node according to given name prefix
-        last_node = self.locate_last_node(interest.getName())
-        if not last_node:
+        if name.size() == 0:
+            return None
+        component = name.get(-1)
+        # newer PyNDN parses sha256digest= into a typed component holding
+        # the raw digest, older ones keep it as a generic text component
+        if hasattr(component, "isImplicitSha256Digest"):
+            if component.isImplicitSha256Digest():
+                return component.getValue().toHex().lower()
+        comp = component.getValue().toRawStr()
+        if not comp.startswith(IMPLICIT_DIGEST_PREFIX):
             return None
+        return comp[len(IMPLICIT_DIGEST_PREFIX):].lower()
 
-        # apply selectors here. AT MOST one node shall be left 
-        nodes = self.apply_selectors(last_node, interest)
-        if not nodes:
+    def extract_by_digest(self, name, digest, wired=True):
+        """
+        @param name - name ending with an implicit sha256 digest component
+        @param digest - the hex digest carried by the name
+        @param wired - whether to return the wired format co
+        @return the co with the given digest, if it is stored under the rest
+        of the name. otherwise None
+        looks the co up by a single probe of the payload digest index
+        """
+        query = 'MATCH (p:%s {%s:{digest}})\n' % (LABEL_PAYLOAD,
+                PROPERTY_DIGEST) + \
+                'RETURN p.%s, p.%s, p.%s' % (PROPERTY_DATA, PROPERTY_CODEC,
+                PROPERTY_DICT_ID)
+        records = self.execute_query(query,
+                digest=digest)
+        if not records:
             return None
 
-        # by default, return the first(by name) co
-        final_node = nodes[0]
+        data = self.decode_payload(*records.data[0].values)
+        with self.metrics.timer("wire_decode"):
+            co = Data()
+            co.wireDecode(Blob.fromRawStr(data))
+        if not co.getName().equals(name.getPrefix(-1)):
+            return None
 
-        co = self.extract_co_from_db(final_node, wired)
         return co
 
-#    @staticmethod
-#    def parse_co_name(cmd_interest_name):
-#        """
-#        @param cmd_interest_name - name contained in the command interest
-#        @return Name() instance of the co's name
-#        parses the command interest name for the name prefix of the co
-#        """
-#        _name = str(cmd_interest_name)
-#        assert('delete' in _name)
-#        try:
-#            _co_name = _name.split('delete')[2]
-#        except Exception as ex:
-#            print 'parse_co_name: %s' % str(ex)
-#        assert(_co_name)
-#        co_name = Name(_co_name)
-#        return co_name
+    def extract_from_repo(self, interest, wired=True):
+        """
+        @param interest - the interest requesting a content object
+        @param wired - whether to return the wired format co
+        @return the requested content object in wired format. if does not 
+        exist return None
+        """
+        with self.metrics.request("read"), \
+                self.locks.read(interest.getName()):
+            digest = self.get_implicit_digest(interest.getName())
+            if digest:
+                with self.metrics.timer("read.extract"):
+                    return self.extract_by_digest(interest.getName(), digest,
+                            wired)
+
+            # find last node according to given name prefix
+            with self.metrics.timer("read.locate"):
+                last_node = self.locate_last_node(interest.getName())
+            if not last_node:
+                return None
+
+            # apply selectors here. AT MOST one node shall be left 
+            with self.metrics.timer("read.selectors"):
+                nodes = self.apply_selectors(last_node, interest)
+            if not nodes:
+                return None
+
+            # by default, return the first(by name) co
+            final_node = nodes[0]
+
+            with self.metrics.timer("read.extract"):
+                co = self.extract_co_from_db(final_node, wired)
+            return co
+
+    def extract_segments(self, name, components):
+        """
+        @param name - Name instance of the object, e.g. a floor plan
+        @param components - Name.Component instances of the children to read,
+                            e.g. its next segments
+        @return list of (co, expiry in ms) of the children stored under the
+        name, read in a single query
+        """
+        with self.metrics.request("read_segments"), self.locks.read(name):
+            path = self.name_to_path(name.toUri())
+            start = path[-1].split(':')[0] if path else 'r'
+            returns = 'MATCH (%s)-[:%s]->(s:%s)-[:%s]->(c)\n' % (start,
+                    RELATION_C2C, LABEL_COMPONENT, RELATION_C2S) + \
+                    'WHERE s.%s IN {components}\n' % PROPERTY_COMPONENT + \
+                    'OPTIONAL MATCH (c)-[:%s]->(p)\n' % RELATION_S2P + \
+                    'RETURN coalesce(p.%s, c.%s), p.%s, p.%s, c.%s' % (
+                    PROPERTY_DATA, PROPERTY_DATA, PROPERTY_CODEC,
+                    PROPERTY_DICT_ID, PROPERTY_EXPIRY)
+            query = self.create_path_query(path, 'MATCH', returns=returns)
+            records = self.execute_query(query, components=[
+                    component.toEscapedString() for component in components])
+
+            segments = []
+            for record in records.data if records else []:
+                data, codec, dict_id, expiry = record.values
+                with self.metrics.timer("wire_decode"):
+                    co = Data()
+                    co.wireDecode(Blob.fromRawStr(
+                            self.decode_payload(data, codec, dict_id)))
+                segments.append((co, expiry))
+            return segments
+
+    @staticmethod
+    def parse_co_name(cmd_interest_name, prefix):
+        """
+        @param cmd_interest_name - name contained in the command interest,
+                                   <prefix>/<command>/<co name>[/...]
+        @param prefix - Name the command interests are under
+        @return Name() instance of the co's name
+        parses the command interest name for the name prefix of the co. the
+        co's name is carried as its uri in a single component, so that the
+        components of a signed interest may follow it
+        """
+        if cmd_interest_name.size() < prefix.size() + 2 or \
+                not prefix.match(cmd_interest_name):
+            raise UnsupportedQueryException("not a command: %s" %
+                    cmd_interest_name.toUri())
+        return Name(cmd_interest_name.get(
+                prefix.size() + 1).getValue().toRawStr())
+
+    def delete_subtree(self, node, batch_size=DELETE_BATCH_SIZE):
+        """
+        @param node - top node of the subtree to be removed
+        @param batch_size - max number of nodes removed per query
+        @return number of nodes removed
+        removes the given node together with all components and segments
+        under it. nodes are removed leaves first, in batches of at most
+        batch_size nodes, so that no node is ever orphaned in between. the
+        node is expected to be detached from the tree already, so readers
+        never see the subtree partly removed
+        """
+        # the subtree is walked once, and taken apart deepest level first
+        tree = '[:%s|%s*0..]' % (RELATION_C2C, RELATION_C2S)
+        query = 'START s=node(%s)\n' % node._id + \
+                'MATCH path=(s)-%s->(n)\n' % tree + \
+                'RETURN DISTINCT id(n), length(path), n:%s' % LABEL_SEGMENT
+        records = self.execute_query(query)
+        if not records:
+            return 0
+        nodes = sorted([record.values for record in records.data],
+                key=lambda x: x[1], reverse=True)
+
+        removed = 0
+        for i in range(0, len(nodes), batch_size):
+            batch = nodes[i:i + batch_size]
+            ids = [values[0] for values in batch]
+            self.release_payloads([values[0] for values in batch
+                    if values[2]])
+
+            _query = 'START n=node(%s)\n' % ','.join(map(str, ids)) + \
+                    'OPTIONAL MATCH (n)<-[r]-()\n' + \
+                    'DELETE r, n'
+            self.execute_query(_query)
+            removed += len(ids)
+
+        return removed
+
+    def prune_empty_components(self, nodes, prefix=None):
+        """
+        @param nodes - component nodes to start pruning from
+        @param prefix - the name prefix the caller holds the write lock of
+        @return number of nodes removed
+        removes the given components if they have neither children nor a
+        segment, then does the same for their parents, up to (but never
+        including) the root. the components shared by prefixes locked
+        separately are kept, unless prefix is short enough to lock them all
+        """
+        # a writer of another prefix may be running CREATE UNIQUE through
+        # the components above the lock depth meanwhile. these are the ones
+        # at most depth - 2 hops below the root (itself the "ndn" component)
+        shared = ''
+        hops = self.locks.depth - 2
+        if hops > 0 and (prefix is None or
+                Name(prefix).size() >= self.locks.depth):
+            shared = 'AND NOT (t)-[:%s*1..%d]->(s)\n' % (RELATION_C2C, hops)
+
+        ids = [str(node._id) for node in nodes]
+        removed = 0
+        while ids:
+            query = 'START s=node(%s), ' % ','.join(ids) + \
+                    't=node(%s)\n' % self.root._id + \
+                    'MATCH (p)-[r:%s]->(s)\n' % RELATION_C2C + \
+                    'WHERE NOT (s)-->() AND s <> t\n' + shared + \
+                    'WITH collect(DISTINCT id(p)) AS ps, ' + \
+                    'collect(r) AS rs, collect(DISTINCT s) AS ss\n' + \
+                    'FOREACH (x IN rs | DELETE x)\n' + \
+                    'FOREACH (x IN ss | DELETE x)\n' + \
+                    'RETURN ps, length(ss)'
+            records = self.execute_query(query)
+            if not records:
+                break
+            parents, pruned = records.data[0].values
+            # the parents are candidates for the next round
+            ids = [str(parent) for parent in parents]
+            removed += pruned
+
+        return removed
+
+    def delete_prefix(self, name, batch_size=DELETE_BATCH_SIZE):
+        """
+        @param name - name prefix to be removed
+        @param batch_size - max number of nodes removed per query
+        @return number of nodes removed
+        deletes everything stored under the given name prefix, including
+        the prefix itself, and prunes the ancestors left empty
+        """
+        name = Name(name)
+        if name.size() < 2:
+            # never remove the root
+            raise UnsupportedQueryException("cannot delete %s" % name.toUri())
+
+        with self.locks.write(name):
+            last_node = self.locate_last_node(name, cached=False)
+            if not last_node:
+                return 0
+            if self.names:
+                self.names.invalidate(name)
+
+            # detach the subtree first: from then on readers don't find
+            # anything under the prefix, however long removing it takes
+            query = 'START s=node(%s)\n' % last_node._id + \
+                    'MATCH (p)-[r:%s]->(s)\n' % RELATION_C2C + \
+                    'DELETE r\n' + \
+                    'RETURN p'
+            records = self.execute_query(query)
+            parents = [record.values[0] for record in records.data]
+
+            removed = self.delete_subtree(last_node, batch_size)
+            removed += self.prune_empty_components(parents, name)
+
+        return removed
 
     def delete_from_repo(self, interest):
         """
         @param interest - command interest that requests deletion
+        @return number of nodes removed
         deletes content objects either by precise name, or by prefix plus
         selectors
         """
-#        co_name = self.parse_co_name(interest.getName())
-
-        # by name prefix
-        # by interest
-        # find last node according to given name prefix
-        last_node = self.locate_last_node(interest.getName())
-        if not last_node:
-            return None
-
-        # apply selectors here. AT MOST one node shall be left 
-        nodes = self.apply_selectors(last_node, interest)
-        if not nodes:
-            return None
-
-        _ids = []
-        for node in nodes:
-            node.isolate()
-            node.delete()
-#            _ids.append(str(node._id))
-#        ids = ','.join(_ids)
-#
-#        query = 'START s=node(%s)\n' % ids + \
-#                'MATCH (s)-[r]->()\n' + \
-#                'DELETE r\n' + \
-#                'DELETE s'
-#        print query
-#        records = neo4j.CypherQuery(self.db_handler, query).execute()
+        with self.locks.write(interest.getName()):
+            # find last node according to given name prefix
+            last_node = self.locate_last_node(interest.getName(),
+                    cached=False)
+            if not last_node:
+                return 0
+
+            # apply selectors here, stale data included
+            nodes = self.apply_selectors(last_node, interest,
+                    must_be_fresh=False)
+            if not nodes:
+                return 0
+            if self.names:
+                self.names.invalidate(interest.getName())
+
+            # drop the segments of all selected nodes, together with the
+            # payload references they hold, in a single statement. then
+            # remove the components that are left empty
+            ids = ','.join([str(node._id) for node in nodes])
+            query = 'START s=node(%s)\n' % ids + \
+                    'MATCH (s)-[r:%s]->(c)\n' % RELATION_C2S + \
+                    'OPTIONAL MATCH (c)-[q:%s]->(p)\n' % RELATION_S2P + \
+                    'FOREACH (x IN CASE WHEN p IS NULL ' + \
+                    'THEN [] ELSE [p] END |\n' + \
+                    '  SET x.%s = x.%s - 1)\n' % (PROPERTY_REFS,
+                    PROPERTY_REFS) + \
+                    'DELETE q, r, c\n' + \
+                    'REMOVE s.%s\n' % PROPERTY_LEAF + \
+                    'WITH collect(DISTINCT s) AS ss, ' + \
+                    'collect(DISTINCT p) AS ps\n' + \
+                    'FOREACH (x IN filter(x IN ps WHERE x.%s <= 0) |\n' % (
+                    PROPERTY_REFS) + \
+                    '  DELETE x)\n' + \
+                    'RETURN length(ss)'
+            records = self.execute_query(query)
+            removed = records.data[0].values[0]
+            removed += self.prune_empty_components(nodes,
+                    interest.getName())
+
+        return removed
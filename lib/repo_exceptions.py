@@ -32,3 +32,21 @@ class UnsupportedQueryException(Exception):
         self.value = value
     def __str__(self):
         return repr(self.value)
+
+class CompressionException(Exception):
+    def __init__(self, value):
+        self.value = value
+    def __str__(self):
+        return repr(self.value)
+
+class PoolExhaustedException(Exception):
+    def __init__(self, value):
+        self.value = value
+    def __str__(self):
+        return repr(self.value)
+
+class SigningException(Exception):
+    def __init__(self, value):
+        self.value = value
+    def __str__(self):
+        return repr(self.value)
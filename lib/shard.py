@@ -0,0 +1,248 @@
+# Copyright (c) 2014 University of California, Los Angeles
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation;
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+#
+# Author: Zhe Wen <wenzhe@cs.ucla.edu>
+
+# REPO split over several backends by name prefix, e.g. one per building
+
+from pyndn import Name
+from pyndn import Interest
+
+from repo_exceptions import UnsupportedQueryException
+from metrics import NULL_METRICS
+
+# shard holding the names no rule matches
+DEFAULT_SHARD = "default"
+
+
+def parse_shard_rules(specs):
+    """
+    @param specs - list of "prefix=shard" strings
+    @return list of (prefix, shard)
+    """
+    rules = []
+    for spec in specs:
+        prefix, shard = spec.rsplit('=', 1)
+        rules.append((prefix, shard))
+    return rules
+
+
+def canonical_key(name, start=0):
+    """
+    @param name - Name instance
+    @param start - index of the first component compared
+    @return sort key ordering names canonically: component by component,
+    shorter components first, then byte-wise
+    """
+    key = []
+    for i in range(start, name.size()):
+        value = name.get(i).getValue().toRawStr()
+        key.append((len(value), value))
+    return key
+
+
+class ShardRouter(object):
+    """
+    drop-in for Repo dispatching each request to the shard owning the name,
+    i.e. the one whose rule has the longest prefix of the name. requests
+    for a name above some rule prefixes (e.g. the whole bms namespace, or
+    a building with a room sharded apart) are fanned out to every shard
+    that may hold names under it, and the answers merged in canonical
+    order, as a single Repo would have picked them
+    """
+    def __init__(self, shards, rules, metrics=None):
+        """
+        @param shards - dict of shard name to Repo. names no rule matches go
+                        to the DEFAULT_SHARD shard
+        @param rules - list of (name prefix, shard name)
+        """
+        if DEFAULT_SHARD not in shards:
+            raise UnsupportedQueryException("no %s shard" % DEFAULT_SHARD)
+        for prefix, shard in rules:
+            if shard not in shards:
+                raise UnsupportedQueryException("unknown shard %s for %s" % (
+                        shard, prefix))
+
+        self.shards = shards
+        # longest prefixes first, so the first match is the owner
+        self.rules = sorted([(Name(prefix), shard) for prefix, shard in rules],
+                key=lambda x: x[0].size(), reverse=True)
+        self.metrics = metrics or NULL_METRICS
+
+    def owner(self, name):
+        """
+        @param name - Name instance
+        @return name of the shard owning the name itself, i.e. the one of
+        the rule with the longest prefix of the name
+        """
+        for prefix, shard in self.rules:
+            if prefix.match(name):
+                return shard
+        return DEFAULT_SHARD
+
+    def shards_under(self, name):
+        """
+        @param name - Name instance
+        @return names of the shards that may hold names under the given
+        name, in a fixed order: the owner of the name, then the shards of
+        the rules whose prefix lies under the name (e.g. a room with a
+        shard of its own, under a building)
+        """
+        shards = [self.owner(name)]
+        for prefix, shard in self.rules:
+            if name.match(prefix) and shard not in shards:
+                shards.append(shard)
+        return shards
+
+    def route(self, name):
+        """
+        @param name - Name instance
+        @return name of the only shard holding names under the given name,
+        or None if several shards do
+        """
+        shards = self.shards_under(name)
+        if len(shards) > 1:
+            return None
+        return shards[0]
+
+    def covering(self, name):
+        """
+        @param name - Name instance
+        @return the shards that may hold names under the given name, in a
+        fixed order
+        """
+        return [self.shards[shard] for shard in self.shards_under(name)]
+
+    def wrap_content(self, *args, **kwargs):
+        return self.shards[DEFAULT_SHARD].wrap_content(*args, **kwargs)
+
+    def add_content_object_to_repo(self, name, co, wired=True):
+        """
+        @param name - name of the content object
+        @param co - content obejct to be inserted
+        @param wired - whether the co given is in wired format
+        inserts the co into the shard owning its name
+        """
+        shard = self.owner(Name(name))
+        self.metrics.count("shard.%s.insert" % shard)
+        self.shards[shard].add_content_object_to_repo(name, co, wired)
+
+    def add_content_objects_to_repo(self, items, wired=True):
+        """
+        @param items - list of (name, co)
+        @param wired - whether the cos given are in wired format
+        inserts the given cos, in one batch per shard owning some of them
+        """
+        batches = {}
+        for name, co in items:
+            shard = self.owner(Name(name))
+            batches.setdefault(shard, []).append((name, co))
+        for shard, batch in sorted(batches.items()):
+            self.metrics.count("shard.%s.insert" % shard, len(batch))
+            self.shards[shard].add_content_objects_to_repo(batch, wired)
+
+    def merge(self, interest, found):
+        """
+        @param interest - interest the shards answered
+        @param found - list of (shard, co) answers
+        @return the (shard, co) a single repo would have answered with
+        """
+        if not found:
+            return None, None
+        # compare by the components after the interest name, where the
+        # child selector picks
+        start = interest.getName().size()
+        key = lambda x: canonical_key(x[1].getName(), start)
+        if interest.getChildSelector() == 1:
+            return max(found, key=key)
+        return min(found, key=key)
+
+    def fan_out(self, interest, wired=True):
+        """
+        @return list of (shard, co) answering the interest, one per shard
+        """
+        found = []
+        for shard in self.covering(interest.getName()):
+            co = shard.extract_from_repo(interest, wired)
+            if co:
+                found.append((shard, co))
+        return found
+
+    def extract_from_repo(self, interest, wired=True):
+        """
+        @param interest - the interest requesting a content object
+        @param wired - whether to return the wired format co
+        @return the requested content object, from the owning shard or the
+        best answer of the covering shards. if does not exist return None
+        """
+        shards = self.covering(interest.getName())
+        if len(shards) == 1:
+            return shards[0].extract_from_repo(interest, wired)
+
+        with self.metrics.timer("shard.fan_out"):
+            found = self.fan_out(interest, wired)
+        return self.merge(interest, found)[1]
+
+    def extract_segments(self, name, components):
+        """
+        @param name - Name instance of the object
+        @param components - Name.Component instances of the children to read
+        @return list of (co, expiry in ms) of the children, from the shard
+        owning the name. nothing if no single shard does
+        """
+        shard = self.route(name)
+        if not shard:
+            return []
+        return self.shards[shard].extract_segments(name, components)
+
+    def delete_prefix(self, name, *args, **kwargs):
+        """
+        @param name - name prefix to be removed
+        @return number of nodes removed, over all shards
+        """
+        return sum([shard.delete_prefix(name, *args, **kwargs)
+                for shard in self.covering(Name(name))])
+
+    def delete_from_repo(self, interest):
+        """
+        @param interest - command interest that requests deletion
+        @return number of nodes removed
+        with a child selector only the shard holding the selected child
+        deletes, otherwise every covering shard does
+        """
+        shards = self.covering(interest.getName())
+        if len(shards) == 1 or interest.getChildSelector() is None:
+            return sum([shard.delete_from_repo(interest) for shard in shards])
+
+        # stale data is deleted too, so it is also picked from
+        target = Interest(interest)
+        target.setMustBeFresh(False)
+        shard, co = self.merge(interest, self.fan_out(target))
+        if not shard:
+            return 0
+        return shard.delete_from_repo(interest)
+
+    def verify_state(self):
+        for shard in self.shards.values():
+            if hasattr(shard, "verify_state"):
+                shard.verify_state()
+
+    def print_tree(self):
+        """
+        prints the content of every shard in tree style
+        """
+        for shard, repo in sorted(self.shards.items()):
+            print 'shard %s:' % shard
+            repo.print_tree()
@@ -0,0 +1,228 @@
+# Copyright (c) 2014 University of California, Los Angeles
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation;
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+#
+# Author: Zhe Wen <wenzhe@cs.ucla.edu>
+
+# signing of new content objects, with the signature picked per name prefix,
+# e.g. a cheap digest for high rate readings and rsa for everything else
+
+from pyndn import Name
+from pyndn import KeyLocatorType
+from pyndn.util import Blob
+
+# the signature types beyond Sha256WithRsaSignature only come with newer
+# pyndn releases, 2.0b1 can neither encode nor decode them
+try:
+    from pyndn import DigestSha256Signature
+except ImportError:
+    DigestSha256Signature = None
+try:
+    from pyndn import HmacWithSha256Signature
+except ImportError:
+    HmacWithSha256Signature = None
+try:
+    from pyndn import Sha256WithEcdsaSignature
+except ImportError:
+    Sha256WithEcdsaSignature = None
+
+from repo_exceptions import SigningException
+
+import threading
+import hashlib
+import hmac
+
+SIGN_RSA = "rsa"
+SIGN_DIGEST = "digest"
+SIGN_HMAC = "hmac"
+SIGN_ECDSA = "ecdsa"
+
+# key name put in the key locator of hmac signed cos
+DEFAULT_HMAC_KEY_NAME = "/ndn/bms/HMAC-default"
+# identity the ecdsa key and certificate are created for
+DEFAULT_ECDSA_IDENTITY = "/ndn/bms/ECDSA-default"
+
+
+def available_modes():
+    """
+    @return the signing modes usable in this installation
+    """
+    modes = [SIGN_RSA]
+    if DigestSha256Signature:
+        modes.append(SIGN_DIGEST)
+    if HmacWithSha256Signature:
+        modes.append(SIGN_HMAC)
+    if Sha256WithEcdsaSignature:
+        modes.append(SIGN_ECDSA)
+    return modes
+
+
+def parse_signing_rules(specs):
+    """
+    @param specs - list of "prefix=mode" strings
+    @return list of (prefix, mode)
+    """
+    rules = []
+    for spec in specs:
+        prefix, mode = spec.rsplit('=', 1)
+        rules.append((prefix, mode))
+    return rules
+
+
+def _signed_portion(co):
+    return co.wireEncode().toSignedBuffer()
+
+
+class RsaSigner(object):
+    """
+    Sha256WithRsaSignature with the default key
+    """
+    mode = SIGN_RSA
+
+    def __init__(self, key_chain):
+        """
+        @param key_chain - callable returning (keyChain, certificateName),
+                           see Repo.key_chain()
+        """
+        self.key_chain = key_chain
+
+    def sign(self, co):
+        keyChain, certificateName = self.key_chain()
+        keyChain.sign(co, certificateName)
+
+
+class DigestSigner(object):
+    """
+    DigestSha256Signature, i.e. integrity only, no key
+    """
+    mode = SIGN_DIGEST
+
+    def sign(self, co):
+        co.setSignature(DigestSha256Signature())
+        digest = hashlib.sha256(_signed_portion(co)).digest()
+        co.getSignature().setSignature(Blob(bytearray(digest), False))
+
+
+class HmacSigner(object):
+    """
+    HmacWithSha256Signature with a key shared with the consumers
+    """
+    mode = SIGN_HMAC
+
+    def __init__(self, key, key_name=DEFAULT_HMAC_KEY_NAME):
+        """
+        @param key - shared secret
+        @param key_name - name of the key, put in the key locator
+        """
+        self.key = key
+        self.key_name = Name(key_name)
+
+    def sign(self, co):
+        signature = HmacWithSha256Signature()
+        signature.getKeyLocator().setType(KeyLocatorType.KEYNAME)
+        signature.getKeyLocator().setKeyName(self.key_name)
+        co.setSignature(signature)
+        mac = hmac.new(self.key, _signed_portion(co), hashlib.sha256).digest()
+        co.getSignature().setSignature(Blob(bytearray(mac), False))
+
+
+class EcdsaSigner(object):
+    """
+    Sha256WithEcdsaSignature with a key generated on first use
+    """
+    mode = SIGN_ECDSA
+
+    def __init__(self, identity=DEFAULT_ECDSA_IDENTITY):
+        self.identity = Name(identity)
+        self._lock = threading.Lock()
+        self._key_chain = None
+
+    def key_chain(self):
+        """
+        @return (keyChain, certificateName) of the ecdsa key
+        """
+        with self._lock:
+            if self._key_chain:
+                return self._key_chain
+
+            from pyndn.security import KeyChain
+            from pyndn.security import EcdsaKeyParams
+            from pyndn.security.identity import IdentityManager
+            from pyndn.security.identity import MemoryIdentityStorage
+            from pyndn.security.identity import MemoryPrivateKeyStorage
+            from pyndn.security.policy import NoVerifyPolicyManager
+
+            keyChain = KeyChain(IdentityManager(MemoryIdentityStorage(),
+                    MemoryPrivateKeyStorage()), NoVerifyPolicyManager())
+            certificateName = keyChain.createIdentityAndCertificate(
+                    self.identity, EcdsaKeyParams())
+            self._key_chain = (keyChain, certificateName)
+            return self._key_chain
+
+    def sign(self, co):
+        keyChain, certificateName = self.key_chain()
+        keyChain.sign(co, certificateName)
+
+
+class SigningPolicy(object):
+    """
+    picks the signer of a co by its name: the mode of the rule with the
+    longest prefix of the name, or the default mode if no rule matches
+    """
+    def __init__(self, rules=None, default=SIGN_RSA, key_chain=None,
+            hmac_key=None, hmac_key_name=DEFAULT_HMAC_KEY_NAME):
+        """
+        @param rules - list of (name prefix, mode)
+        @param default - mode of the names no rule matches
+        @param key_chain - callable returning the rsa (keyChain,
+                           certificateName), see Repo.key_chain()
+        @param hmac_key - shared secret of the hmac mode
+        """
+        rules = rules or []
+        modes = set([default] + [mode for prefix, mode in rules])
+        for mode in modes:
+            if mode not in available_modes():
+                raise SigningException("unsupported signing mode %s" % mode)
+        if SIGN_RSA in modes and not key_chain:
+            raise SigningException("rsa signing requires a key chain")
+        if SIGN_HMAC in modes and not hmac_key:
+            raise SigningException("hmac signing requires a key")
+
+        signers = {
+                SIGN_RSA: lambda: RsaSigner(key_chain),
+                SIGN_DIGEST: DigestSigner,
+                SIGN_HMAC: lambda: HmacSigner(hmac_key, hmac_key_name),
+                SIGN_ECDSA: EcdsaSigner,
+                }
+        self.signers = dict([(mode, signers[mode]()) for mode in modes])
+        self.default = default
+        # longest prefixes first, so the first match is the rule to apply
+        self.rules = sorted([(Name(prefix), mode) for prefix, mode in rules],
+                key=lambda x: x[0].size(), reverse=True)
+
+    def mode(self, name):
+        """
+        @param name - Name instance
+        @return the signing mode of the name
+        """
+        for prefix, mode in self.rules:
+            if prefix.match(name):
+                return mode
+        return self.default
+
+    def sign(self, co):
+        """
+        @param co - Data to sign, its signature is replaced
+        """
+        self.signers[self.mode(co.getName())].sign(co)
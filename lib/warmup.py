@@ -0,0 +1,151 @@
+# Copyright (c) 2014 University of California, Los Angeles
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation;
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+#
+# Author: Zhe Wen <wenzhe@cs.ucla.edu>
+
+# record of the names asked for most, kept across restarts, so that a new
+# start can warm the caches with them in the background while serving
+
+from pyndn import Name
+from pyndn import Interest
+
+from metrics import NULL_METRICS
+
+import threading
+import json
+import time
+import os
+
+# number of hot names kept in the record
+HOT_NAMES = 1000
+# seconds between writes of the record
+SAVE_INTERVAL = 60.0
+
+
+class HotNames(object):
+    """
+    counts the names interests ask for, keeping the most asked for ones.
+    safe to use from several threads
+    """
+    def __init__(self, path, size=HOT_NAMES):
+        """
+        @param path - file the record is kept in
+        @param size - number of names kept
+        """
+        self.path = path
+        self.size = size
+        self._lock = threading.Lock()
+        # name -> count
+        self._counts = {}
+
+    def record(self, name):
+        """
+        @param name - uri of a name an interest asked for
+        """
+        with self._lock:
+            self._counts[name] = self._counts.get(name, 0) + 1
+            if len(self._counts) > 4 * self.size:
+                # keep the hottest half, with halved counts, so that names
+                # that cooled down make way for new ones
+                top = sorted(self._counts.items(), key=lambda x: x[1],
+                        reverse=True)[:2 * self.size]
+                self._counts = dict([(name, count / 2)
+                        for name, count in top])
+
+    def top(self):
+        """
+        @return the hottest names, hottest first
+        """
+        with self._lock:
+            top = sorted(self._counts.items(), key=lambda x: x[1],
+                    reverse=True)[:self.size]
+        return [name for name, count in top]
+
+    def load(self):
+        """
+        @return the names recorded by an earlier run, hottest first
+        """
+        if not os.path.exists(self.path):
+            return []
+        try:
+            with open(self.path) as f:
+                names = json.load(f)
+        except ValueError as ex:
+            print "Error: load: %s" % str(ex)
+            return []
+        return names
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(self.path + ".tmp", "w") as f:
+            json.dump(self.top(), f)
+        # readers never see a partially written file
+        os.rename(self.path + ".tmp", self.path)
+
+    def start_saving(self, interval=SAVE_INTERVAL):
+        """
+        @return the daemon thread writing the record every interval seconds
+        """
+        def save():
+            while True:
+                time.sleep(interval)
+                self.save()
+
+        thread = threading.Thread(target=save)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+
+def warm_up(repo, names, metrics=None, pause=0.0, cache=None):
+    """
+    @param repo - repo to warm up
+    @param names - uris of the names to read, hottest first
+    @param pause - seconds to wait between reads, to leave the backend to
+                   the interests being served
+    @param cache - ResponseCache of the server, the cos read are put in it
+    @return the daemon thread reading the names, after checking the state
+    the repo started from is still current
+    """
+    metrics = metrics or NULL_METRICS
+
+    def run():
+        start_time = time.time()
+        if hasattr(repo, "verify_state"):
+            repo.verify_state()
+        for name in names:
+            interest = Interest(Name(name))
+            interest.setMustBeFresh(False)
+            try:
+                co = repo.extract_from_repo(interest)
+            except Exception as ex:
+                print "Error: warm_up: %s" % str(ex)
+                return
+            if co and cache:
+                # its expiry is not known, as for the replies the server
+                # caches
+                cache.put(co.getName(), co.wireEncode().toBuffer())
+            metrics.count("warm_up.names")
+            if pause:
+                time.sleep(pause)
+        print "warmed up %d names in %.1f s" % (len(names),
+                time.time() - start_time)
+
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+    return thread
@@ -0,0 +1,120 @@
+# Copyright (c) 2014 University of California, Los Angeles
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation;
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+#
+# Author: Zhe Wen <wenzhe@cs.ucla.edu>
+
+# synthetic BMS namespaces for benchmarks and load tests
+
+import random
+import bisect
+import math
+
+BMS_PREFIX = "/ndn/ucla.edu/bms"
+BUILDINGS = ["melnitz", "strathmore", "boelter", "engr-iv", "royce",
+        "powell", "ackerman", "kerckhoff"]
+SENSORS = ["temp", "humidity", "co2", "occupancy", "power", "airflow"]
+# unix time of the first reading, and seconds between readings
+START_TIME = 1395000000
+INTERVAL = 60
+
+
+def percentile(values, p):
+    """
+    @param values - sorted list of values
+    @param p - percentile, between 0 and 100
+    @return the nearest-rank percentile of the values
+    """
+    if not values:
+        return 0.0
+    rank = int(math.ceil(p / 100.0 * len(values))) - 1
+    return values[min(max(rank, 0), len(values) - 1)]
+
+
+class ZipfSampler(object):
+    """
+    draws indexes 0..n-1, index k with probability proportional to
+    1 / (k + 1)^s. a few hot items get most of the draws
+    """
+    def __init__(self, n, s=1.0, rng=None):
+        self.random = rng or random.Random()
+        self.cumulative = []
+        total = 0.0
+        for k in range(n):
+            total += 1.0 / (k + 1) ** s
+            self.cumulative.append(total)
+
+    def sample(self):
+        pick = self.random.random() * self.cumulative[-1]
+        return bisect.bisect_left(self.cumulative, pick)
+
+
+class BmsNamespace(object):
+    """
+    a building/room/sensor/timestamp name tree, e.g.
+    /ndn/ucla.edu/bms/building:melnitz/room:1451/temp/1395000060
+    """
+    def __init__(self, buildings=2, rooms=10, sensors=4, readings=10,
+            prefix=BMS_PREFIX, seed=None):
+        self.prefix = prefix
+        self.readings = readings
+        self.random = random.Random(seed)
+
+        self.buildings = []
+        for i in range(buildings):
+            building = BUILDINGS[i % len(BUILDINGS)]
+            if i >= len(BUILDINGS):
+                building += "-%d" % (i / len(BUILDINGS))
+            self.buildings.append("%s/building:%s" % (prefix, building))
+
+        self.rooms = ["%s/room:%d" % (building, 1000 + j)
+                for building in self.buildings for j in range(rooms)]
+
+        sensor_types = [SENSORS[k % len(SENSORS)] + (
+                "-%d" % (k / len(SENSORS)) if k >= len(SENSORS) else "")
+                for k in range(sensors)]
+        self.sensors = ["%s/%s" % (room, sensor)
+                for room in self.rooms for sensor in sensor_types]
+
+    def size(self):
+        return len(self.sensors) * self.readings
+
+    @staticmethod
+    def reading_name(sensor, index):
+        """
+        @param sensor - name prefix of the sensor
+        @param index - index of the reading
+        @return name of the index-th reading of the sensor
+        """
+        return "%s/%d" % (sensor, START_TIME + index * INTERVAL)
+
+    def reading_value(self, sensor, index):
+        """
+        @return a plausible reading, as the sensor's gateway would publish
+        """
+        return "%.2f" % (20 + self.random.random() * 5)
+
+    def names(self):
+        """
+        yields the names of all readings, oldest first for each sensor
+        """
+        for sensor in self.sensors:
+            for index in range(self.readings):
+                yield self.reading_name(sensor, index)
+
+    def random_sensor(self):
+        return self.random.choice(self.sensors)
+
+    def random_room(self):
+        return self.random.choice(self.rooms)
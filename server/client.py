@@ -9,6 +9,7 @@ import time
 from sys import argv
 from pyndn import Name
 from pyndn import Face
+from pyndn import Interest
 
 def dump(*list):
     result = ""
@@ -36,11 +37,13 @@ def main():
     
     counter = Counter()
 
-    ignored, name = argv
-    name = "/ndn/ucla.edu/bms/" + name
+    name = "/ndn/ucla.edu/bms/" + argv[1]
     name1 = Name(name)
+    interest = Interest(name1)
+    # stale readings are served too, unless asked for fresh data only
+    interest.setMustBeFresh(argv[2:] == ["fresh"])
     dump("Express name ", name1.toUri())
-    face.expressInterest(name1, counter.onData, counter.onTimeout)
+    face.expressInterest(interest, counter.onData, counter.onTimeout)
 
     while counter._callbackCount < 1:
         face.processEvents()
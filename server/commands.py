@@ -0,0 +1,257 @@
+# Copyright (c) 2014 University of California, Los Angeles
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation;
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+#
+# Author: Zhe Wen <wenzhe@cs.ucla.edu>
+
+# command interests of the repo. producers push data in by naming it in an
+# insert command, the repo then fetches it from them:
+#   <command prefix>/insert/<name>         fetch and store the data
+#   <command prefix>/delete/<name>         delete what the interest matches
+#   <command prefix>/insert-status/<id>    progress of an insert
+# where <name> is the uri of the name, in a single component. the reply
+# carries a json status, with http like codes
+#
+# WARNING: command interests are not authenticated. whoever can get an
+# interest to the repo can insert data into it and delete data from it, so
+# the server refuses commands unless they are enabled explicitly
+
+from pyndn import Name
+from pyndn import Interest
+
+from prefetch import parse_segment, segment_component
+from metrics import NULL_METRICS
+
+import time
+
+COMMAND_PREFIX = "/ndn/ucla.edu/bms/repo"
+INSERT = "insert"
+DELETE = "delete"
+INSERT_STATUS = "insert-status"
+
+STATUS_IN_PROGRESS = 100
+STATUS_OK = 200
+STATUS_MALFORMED = 400
+STATUS_FORBIDDEN = 403
+STATUS_NOT_FOUND = 404
+STATUS_FAILED = 500
+
+# interests kept outstanding per insert
+FETCH_WINDOW = 8
+# times a lost interest is sent again before the insert fails
+FETCH_RETRIES = 3
+FETCH_LIFETIME = 4000
+# cos written to the repo per batch
+INSERT_BATCH_SIZE = 100
+# number of finished inserts whose status is kept
+FINISHED_INSERTS = 100
+
+
+def command_name(command, argument, prefix=COMMAND_PREFIX):
+    """
+    @param command - one of INSERT, DELETE and INSERT_STATUS
+    @param argument - the name, or the process id of INSERT_STATUS
+    @return Name of the command interest
+    """
+    if isinstance(argument, Name):
+        argument = argument.toUri()
+    return Name(prefix).append(command).append(
+            Name.Component(str(argument)))
+
+
+def parse_command(name, prefix):
+    """
+    @param name - Name of the command interest
+    @param prefix - Name the commands are under
+    @return the command, or None if the name holds none
+    """
+    if name.size() < prefix.size() + 2 or not prefix.match(name):
+        return None
+    return name.get(prefix.size()).getValue().toRawStr()
+
+
+class InsertProcess(object):
+    """
+    fetches the data under a name. if the data turns out to be a segment of
+    a larger object (its FinalBlockID names its last segment), the other
+    segments are fetched too, keeping up to window interests outstanding.
+    a lost interest is sent again up to retries times. what arrives is
+    written to the repo in batches, through add_content_objects_to_repo
+    """
+    def __init__(self, process_id, face, repo, name, window=FETCH_WINDOW,
+            retries=FETCH_RETRIES, lifetime=FETCH_LIFETIME,
+            batch_size=INSERT_BATCH_SIZE, metrics=None, on_done=None):
+        """
+        @param face - face the interests are expressed on
+        @param name - Name of the data to insert
+        @param lifetime - interest lifetime in ms
+        @param on_done - called with the process once it has finished
+        """
+        self.process_id = process_id
+        self.face = face
+        self.repo = repo
+        self.name = name
+        self.window = window
+        self.retries = retries
+        self.lifetime = lifetime
+        self.batch_size = batch_size
+        self.metrics = metrics or NULL_METRICS
+        self.on_done = on_done
+
+        self.status = STATUS_IN_PROGRESS
+        self.error = None
+        self.started = time.time()
+        self.finished = None
+        # set once the data turns out to be segmented
+        self.prefix = None
+        self.textual = False
+        self.final = None
+        self.next_segment = 0
+        # segment (None before the data is known to be segmented) -> tries
+        self.outstanding = {}
+        self.received = set()
+        # (uri, wired co) not written yet
+        self.pending = []
+        self.fetched = 0
+        self.inserted = 0
+        self.bytes = 0
+        self.retransmissions = 0
+
+    def start(self):
+        self.express(None)
+
+    def express(self, segment):
+        """
+        @param segment - number of the segment to ask for, None asks for the
+                         name itself
+        """
+        if segment is None:
+            name = self.name
+        else:
+            name = Name(self.prefix).append(
+                    segment_component(segment, self.textual))
+        interest = Interest(name)
+        interest.setMustBeFresh(False)
+        interest.setInterestLifetimeMilliseconds(self.lifetime)
+        self.outstanding[segment] = self.outstanding.get(segment, 0) + 1
+        self.face.expressInterest(interest,
+                lambda interest, data: self.onData(segment, data),
+                lambda interest: self.onTimeout(segment))
+
+    def onData(self, segment, data):
+        if self.status != STATUS_IN_PROGRESS or \
+                segment not in self.outstanding:
+            return
+        del self.outstanding[segment]
+
+        wired = data.wireEncode().toRawStr()
+        self.pending.append((data.getName().toUri(), wired))
+        self.fetched += 1
+        self.bytes += len(wired)
+        self.metrics.count("insert.fetched")
+
+        number = parse_segment(data.getName().get(-1)) \
+                if data.getName().size() else None
+        final = data.getMetaInfo().getFinalBlockID()
+        final = parse_segment(final) if final.getValue().size() else None
+        if segment is None and number and final:
+            # the rest of the object is fetched segment by segment
+            self.prefix = data.getName().getPrefix(-1)
+            self.textual = number[1]
+            segment = number[0]
+        if segment is not None:
+            self.received.add(segment)
+            if final:
+                self.final = final[0]
+
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+        self.fill_window()
+
+    def onTimeout(self, segment):
+        if self.status != STATUS_IN_PROGRESS or \
+                segment not in self.outstanding:
+            return
+        if self.outstanding[segment] > self.retries:
+            self.finish(STATUS_NOT_FOUND, "no data for %s" % (
+                    self.name.toUri() if segment is None else
+                    "segment %d" % segment))
+            return
+        self.retransmissions += 1
+        self.metrics.count("insert.retransmissions")
+        self.express(segment)
+
+    def fill_window(self):
+        if self.status != STATUS_IN_PROGRESS:
+            return
+        if self.final is not None:
+            while len(self.outstanding) < self.window and \
+                    self.next_segment <= self.final:
+                if self.next_segment not in self.received and \
+                        self.next_segment not in self.outstanding:
+                    self.express(self.next_segment)
+                self.next_segment += 1
+        if not self.outstanding:
+            self.flush()
+            self.finish(STATUS_OK)
+
+    def flush(self):
+        """
+        writes the cos fetched so far to the repo, in one batch
+        """
+        if not self.pending or self.status != STATUS_IN_PROGRESS:
+            return
+        try:
+            with self.metrics.timer("insert.write"):
+                self.repo.add_content_objects_to_repo(self.pending)
+        except Exception as ex:
+            print "Error: insert: %s" % str(ex)
+            self.finish(STATUS_FAILED, str(ex))
+            return
+        self.inserted += len(self.pending)
+        self.pending = []
+
+    def finish(self, status, error=None):
+        if self.status != STATUS_IN_PROGRESS:
+            return
+        self.status = status
+        self.error = error
+        self.finished = time.time()
+        self.outstanding = {}
+        if self.on_done:
+            self.on_done(self)
+
+    def progress(self):
+        """
+        @return dict with the status of the insert, the number of cos
+        fetched and inserted so far, and the throughput (cos and bytes per
+        second)
+        """
+        elapsed = (self.finished or time.time()) - self.started
+        progress = {
+                "status": self.status,
+                "process_id": self.process_id,
+                "name": self.name.toUri(),
+                "fetched": self.fetched,
+                "inserted": self.inserted,
+                "segments": self.final + 1 if self.final is not None
+                        else None,
+                "retransmissions": self.retransmissions,
+                "elapsed": elapsed,
+                "throughput": self.inserted / elapsed if elapsed else 0.0,
+                "bytes_per_second": self.bytes / elapsed if elapsed else 0.0,
+                }
+        if self.error:
+            progress["error"] = self.error
+        return progress
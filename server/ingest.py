@@ -0,0 +1,401 @@
+# Copyright (c) 2014 University of California, Los Angeles
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation;
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+#
+# Author: Zhe Wen <wenzhe@cs.ucla.edu>
+
+# streaming ingest daemon
+#
+# accepts sensor readings, one "<name> <value>" per line, on a local socket
+# and/or by tailing files, and stores them in the repo through a pipeline
+# of batching, signing and inserting stages. the stages are connected by
+# bounded queues, so a slow repo slows down the sources instead of piling
+# readings up in memory, e.g.
+#   python ingest.py --listen 7475 --tail /var/log/bms/readings.log
+
+import time
+import argparse
+import threading
+import SocketServer
+import Queue
+import json
+import sys
+import os
+from timeit import default_timer
+
+from repo import Repo
+from memory_repo import MemoryRepo
+from metrics import Metrics, serve_metrics
+from workload import percentile
+from pool import DEFAULT_POOL_SIZE
+from signing import parse_signing_rules, available_modes, SIGN_RSA
+
+BATCH_SIZE = 100
+# seconds a batch waits for more readings before it is sent anyway
+BATCH_TIMEOUT = 0.05
+QUEUE_SIZE = 1000
+# number of rates and lags the reported rate and lag are computed over
+REPORT_WINDOW = 1000
+
+# marks the end of the stream in the queues
+_STOP = None
+
+
+class IngestPipeline(object):
+    """
+    readings -> batcher -> batches -> signers -> signed -> inserter -> repo
+
+    the readings of a name always go to the same signer, by a hash of the
+    name, so that they reach the inserter in the order they came in
+    """
+    def __init__(self, repo, batch_size=BATCH_SIZE,
+            batch_timeout=BATCH_TIMEOUT, queue_size=QUEUE_SIZE, signers=1,
+            metrics=None, freshness_period=5000):
+        self.repo = repo
+        self.batch_size = batch_size
+        self.batch_timeout = batch_timeout
+        self.signers = signers
+        self.metrics = metrics or Metrics()
+        self.freshness_period = freshness_period
+
+        # (name, value, arrival time)
+        self.readings = Queue.Queue(queue_size)
+        # lists of readings, one queue per signer
+        self.batches = [Queue.Queue(max(queue_size / batch_size, 1))
+                for i in range(signers)]
+        # lists of (name, wired co, arrival time)
+        self.signed = Queue.Queue(max(queue_size / batch_size, 1))
+
+        self._lock = threading.Lock()
+        self.started = None
+        self.received = 0
+        self.inserted = 0
+        self.failed = 0
+        # (time, number of readings inserted until then), most recent last
+        self._progress = []
+        # lag of the most recently inserted readings, in s
+        self._lags = []
+        self._threads = []
+
+    def submit(self, name, value):
+        """
+        queues a reading, waiting while the pipeline is full
+        """
+        self.readings.put((name, value, time.time()))
+        with self._lock:
+            self.received += 1
+
+    def start(self):
+        self.started = time.time()
+        stages = [(self.batch, ())] + \
+                [(self.sign, (i,)) for i in range(self.signers)] + \
+                [(self.insert, ())]
+        for stage, args in stages:
+            thread = threading.Thread(target=stage, args=args)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        """
+        waits until every reading submitted so far is inserted
+        """
+        self.readings.put(_STOP)
+        for thread in self._threads:
+            thread.join()
+
+    def batch(self):
+        while True:
+            reading = self.readings.get()
+            if reading is _STOP:
+                break
+            batch = [reading]
+            deadline = default_timer() + self.batch_timeout
+            while len(batch) < self.batch_size:
+                timeout = deadline - default_timer()
+                if timeout <= 0:
+                    break
+                try:
+                    reading = self.readings.get(timeout=timeout)
+                except Queue.Empty:
+                    break
+                if reading is _STOP:
+                    self.readings.put(_STOP)
+                    break
+                batch.append(reading)
+
+            partitions = [[] for i in range(self.signers)]
+            for reading in batch:
+                partitions[hash(reading[0]) % self.signers].append(reading)
+            for batches, partition in zip(self.batches, partitions):
+                if partition:
+                    batches.put(partition)
+
+        # every signer stops, then the inserter
+        for batches in self.batches:
+            batches.put(_STOP)
+
+    def sign(self, index):
+        """
+        @param index - number of the signer, i.e. of its queue of batches
+        """
+        while True:
+            batch = self.batches[index].get()
+            if batch is _STOP:
+                break
+            with self.metrics.timer("ingest.sign"):
+                signed = [(name, self.repo.wrap_content(name, value,
+                        freshness_period=self.freshness_period), arrival)
+                        for name, value, arrival in batch]
+            self.signed.put(signed)
+        self.signed.put(_STOP)
+
+    def insert(self):
+        running = self.signers
+        while running:
+            batch = self.signed.get()
+            if batch is _STOP:
+                running -= 1
+                continue
+            try:
+                with self.metrics.timer("ingest.insert"):
+                    self.repo.add_content_objects_to_repo(
+                            [(name, data) for name, data, arrival in batch])
+            except Exception as ex:
+                print "Error: insert: %s" % str(ex)
+                self.metrics.count("ingest.failed", len(batch))
+                with self._lock:
+                    self.failed += len(batch)
+                continue
+
+            now = time.time()
+            self.metrics.count("ingest.readings", len(batch))
+            with self._lock:
+                self.inserted += len(batch)
+                self._progress.append((now, self.inserted))
+                self._progress = self._progress[-REPORT_WINDOW:]
+                for name, data, arrival in batch:
+                    self._lags.append(now - arrival)
+                    self.metrics.observe("ingest.lag", (now - arrival) * 1e6)
+                self._lags = self._lags[-REPORT_WINDOW:]
+
+    def stats(self):
+        """
+        @return dict with the numbers of readings received, inserted and
+        failed, the depth of each queue, the sustained insert rate and the
+        lag between receiving and inserting a reading (in ms)
+        """
+        with self._lock:
+            progress = list(self._progress)
+            lags = sorted(self._lags)
+            stats = {
+                    "received": self.received,
+                    "inserted": self.inserted,
+                    "failed": self.failed,
+                    }
+        stats["queues"] = {
+                "readings": self.readings.qsize(),
+                "batches": sum([batches.qsize() for batches in self.batches]),
+                "signed": self.signed.qsize(),
+                }
+        # rate over the recent inserts, so that it follows changes in load
+        rate = 0.0
+        if len(progress) > 1 and progress[-1][0] > progress[0][0]:
+            rate = (progress[-1][1] - progress[0][1]) / \
+                    (progress[-1][0] - progress[0][0])
+        elif progress and progress[-1][0] > self.started:
+            rate = progress[-1][1] / (progress[-1][0] - self.started)
+        stats["rate"] = rate
+        stats["lag"] = {
+                "p50": percentile(lags, 50) * 1000,
+                "p99": percentile(lags, 99) * 1000,
+                "max": lags[-1] * 1000 if lags else 0.0,
+                }
+        return stats
+
+    def report(self, interval):
+        """
+        @return the daemon thread printing the stats every interval seconds
+        """
+        def report():
+            while True:
+                time.sleep(interval)
+                print json.dumps(self.stats(), sort_keys=True)
+                sys.stdout.flush()
+
+        thread = threading.Thread(target=report)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+
+def parse_reading(line):
+    """
+    @param line - "<name> <value>"
+    @return (name, value), or None if the line is not a reading
+    """
+    fields = line.strip().split(None, 1)
+    if len(fields) != 2 or not fields[0].startswith('/'):
+        return None
+    return fields[0], fields[1]
+
+
+class _ReadingHandler(SocketServer.StreamRequestHandler):
+    def handle(self):
+        pipeline = self.server.pipeline
+        for line in self.rfile:
+            reading = parse_reading(line)
+            if reading:
+                # blocks while the pipeline is full, so the sender is slowed
+                # down by tcp flow control
+                pipeline.submit(*reading)
+
+
+class _ThreadingTCPServer(SocketServer.ThreadingMixIn,
+        SocketServer.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def serve_readings(pipeline, port, host="localhost"):
+    """
+    @return the server accepting readings on the local port, from a daemon
+    thread
+    """
+    server = _ThreadingTCPServer((host, port), _ReadingHandler)
+    server.pipeline = pipeline
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def tail_readings(pipeline, path, from_start=False, poll=0.1):
+    """
+    @param path - file readings are appended to
+    @param from_start - whether to ingest the readings already in the file
+    @return the daemon thread following the file
+    """
+    def tail():
+        while not os.path.exists(path):
+            time.sleep(poll)
+        f = open(path)
+        if not from_start:
+            f.seek(0, os.SEEK_END)
+        inode = os.fstat(f.fileno()).st_ino
+        partial = ""
+        while True:
+            line = f.readline()
+            if line:
+                partial += line
+                if not partial.endswith("\n"):
+                    continue
+                reading = parse_reading(partial)
+                partial = ""
+                if reading:
+                    pipeline.submit(*reading)
+                continue
+
+            # the file may have been rotated, either moved away or copied
+            # and truncated in place
+            try:
+                if os.stat(path).st_ino != inode:
+                    f.close()
+                    f = open(path)
+                    inode = os.fstat(f.fileno()).st_ino
+                    partial = ""
+                    continue
+                if os.fstat(f.fileno()).st_size < f.tell():
+                    f.seek(0)
+                    partial = ""
+                    continue
+            except OSError:
+                pass
+            time.sleep(poll)
+
+    thread = threading.Thread(target=tail)
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="ingests sensor readings")
+    parser.add_argument("--listen", type=int,
+            help="accept readings on this local port")
+    parser.add_argument("--tail", action="append", default=[],
+            help="follow this file for readings. may be given several times")
+    parser.add_argument("--from-start", action="store_true",
+            help="also ingest the readings already in the tailed files")
+    parser.add_argument("--backend", choices=["neo4j", "memory"],
+            default="neo4j")
+    parser.add_argument("--pool-size", type=int, default=DEFAULT_POOL_SIZE)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--batch-timeout", type=float, default=BATCH_TIMEOUT,
+            help="seconds a batch waits for more readings")
+    parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE,
+            help="readings held before the sources are slowed down")
+    parser.add_argument("--signers", type=int, default=1,
+            help="number of signing threads")
+    parser.add_argument("--freshness", type=int, default=5000,
+            help="freshness period of the readings in ms")
+    parser.add_argument("--sign", action="append", default=[],
+            metavar="PREFIX=MODE",
+            help="sign the readings under PREFIX with MODE, one of %s. may "
+            "be given several times" % ", ".join(available_modes()))
+    parser.add_argument("--sign-default", default=SIGN_RSA,
+            help="signing mode of the readings no --sign prefix matches")
+    parser.add_argument("--hmac-key-file",
+            help="file holding the shared key of the hmac mode")
+    parser.add_argument("--report-interval", type=float, default=5.0)
+    parser.add_argument("--metrics-port", type=int,
+            help="serve /metrics and /metrics.json on this local port")
+    args = parser.parse_args(argv)
+    if not args.listen and not args.tail:
+        parser.error("nothing to ingest, give --listen and/or --tail")
+
+    hmac_key = None
+    if args.hmac_key_file:
+        with open(args.hmac_key_file) as f:
+            hmac_key = f.read().strip()
+    signing = dict(signing_rules=parse_signing_rules(args.sign),
+            signing_default=args.sign_default, hmac_key=hmac_key)
+
+    metrics = Metrics()
+    if args.backend == "memory":
+        repo = MemoryRepo(metrics=metrics, **signing)
+    else:
+        repo = Repo(metrics=metrics, pool_size=args.pool_size, **signing)
+    pipeline = IngestPipeline(repo, args.batch_size, args.batch_timeout,
+            args.queue_size, args.signers, metrics, args.freshness)
+    pipeline.start()
+    pipeline.report(args.report_interval)
+    if args.metrics_port:
+        serve_metrics(metrics, args.metrics_port)
+
+    if args.listen:
+        serve_readings(pipeline, args.listen)
+    for path in args.tail:
+        tail_readings(pipeline, path, args.from_start)
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pipeline.stop()
+        print json.dumps(pipeline.stats(), sort_keys=True)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,294 @@
+# Copyright (c) 2014 University of California, Los Angeles
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation;
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+#
+# Author: Zhe Wen <wenzhe@cs.ucla.edu>
+
+# load generator for the repo server
+#
+# keeps a window of interests outstanding and reports per interest round
+# trip times, timeouts and throughput as json. names come from a workload
+# file or a synthetic bms namespace, where a few hot sensors get most of
+# the interests, e.g.
+#   python loadgen.py --local --window 32 --count 10000 --zipf 1.2
+# runs against an in-process server instead of the local forwarder
+
+import time
+import argparse
+import collections
+import json
+import sys
+from timeit import default_timer
+from pyndn import Name
+from pyndn import Data
+from pyndn import Face
+from pyndn import Interest
+
+from workload import BmsNamespace, ZipfSampler, percentile
+
+NO_MATCH = "No match found"
+
+
+class LocalTransport(object):
+    """
+    collects what the server sends in reply to one interest
+    """
+    def __init__(self):
+        self.sent = []
+
+    def send(self, data):
+        self.sent.append(data)
+
+
+class LocalFace(object):
+    """
+    stands in for Face, handing expressed interests straight to an
+    in-process RepoServer. replies are delivered by processEvents, in the
+    order the interests were expressed
+    """
+    def __init__(self, server, prefix="/ndn/ucla.edu/bms"):
+        self._server = server
+        self._prefix = Name(prefix)
+        self._pending = collections.deque()
+
+    def expressInterest(self, interest, onData, onTimeout):
+        self._pending.append((interest, onData, onTimeout))
+
+    def processEvents(self):
+        while self._pending:
+            interest, onData, onTimeout = self._pending.popleft()
+            transport = LocalTransport()
+            self._server.onInterest(self._prefix, interest, transport, 0)
+            if not transport.sent:
+                onTimeout(interest)
+                continue
+            data = Data()
+            data.wireDecode(bytearray(transport.sent[0]))
+            onData(interest, data)
+
+    def shutdown(self):
+        pass
+
+
+def read_workload(path):
+    """
+    @param path - file with one interest per line, as a name optionally
+                  followed by "latest" to ask for the rightmost child
+    @return list of (name, latest)
+    """
+    interests = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            fields = line.split()
+            interests.append((fields[0], fields[1:] == ["latest"]))
+    return interests
+
+
+class SyntheticWorkload(object):
+    """
+    interests for a bms namespace: sensors are picked from a zipf
+    distribution, and a share of the interests ask for the latest reading
+    of the sensor instead of a given one
+    """
+    def __init__(self, namespace, zipf=1.0, latest_ratio=0.3):
+        self.namespace = namespace
+        self.random = namespace.random
+        self.latest_ratio = latest_ratio
+        # hot sensors are spread over buildings and rooms
+        self.sensors = list(namespace.sensors)
+        self.random.shuffle(self.sensors)
+        self.sampler = ZipfSampler(len(self.sensors), zipf, self.random)
+
+    def next(self):
+        """
+        @return (name, latest) of the next interest
+        """
+        sensor = self.sensors[self.sampler.sample()]
+        if self.random.random() < self.latest_ratio:
+            return sensor, True
+        index = self.random.randrange(self.namespace.readings)
+        return self.namespace.reading_name(sensor, index), False
+
+
+class FileWorkload(object):
+    """
+    replays the interests of a workload file, from the start again once
+    all are sent
+    """
+    def __init__(self, path):
+        self.interests = read_workload(path)
+        self._next = 0
+
+    def next(self):
+        interest = self.interests[self._next % len(self.interests)]
+        self._next += 1
+        return interest
+
+
+class LoadGenerator(object):
+
+    def __init__(self, face, workload, window=16, lifetime=4000,
+            must_be_fresh=False):
+        self.face = face
+        self.workload = workload
+        self.window = window
+        self.lifetime = lifetime
+        self.must_be_fresh = must_be_fresh
+
+        self.outstanding = 0
+        self.rtts = []
+        self.timeouts = 0
+        self.no_match = 0
+        self.bytes = 0
+
+    def interest(self, name, latest):
+        interest = Interest(Name(name))
+        interest.setMustBeFresh(self.must_be_fresh)
+        interest.setInterestLifetimeMilliseconds(self.lifetime)
+        if latest:
+            interest.setChildSelector(1)
+        return interest
+
+    def express(self):
+        interest = self.interest(*self.workload.next())
+        start_time = default_timer()
+
+        def onData(interest, data):
+            self.rtts.append(default_timer() - start_time)
+            self.outstanding -= 1
+            content = data.getContent()
+            self.bytes += content.size()
+            if content.toRawStr() == NO_MATCH:
+                self.no_match += 1
+
+        def onTimeout(interest):
+            self.timeouts += 1
+            self.outstanding -= 1
+
+        self.outstanding += 1
+        self.face.expressInterest(interest, onData, onTimeout)
+
+    def run(self, count):
+        """
+        @param count - number of interests to send
+        @return dict with throughput, timeouts and rtt percentiles (in ms)
+        """
+        sent = 0
+        start_time = default_timer()
+        while sent < count or self.outstanding:
+            while self.outstanding < self.window and sent < count:
+                self.express()
+                sent += 1
+            done = len(self.rtts) + self.timeouts
+            self.face.processEvents()
+            if len(self.rtts) + self.timeouts == done:
+                # nothing came back yet, don't spin at 100% of the CPU
+                time.sleep(0.0005)
+        duration = default_timer() - start_time
+
+        rtts = sorted(self.rtts)
+        return {
+                "sent": sent,
+                "received": len(rtts),
+                "timeouts": self.timeouts,
+                "no_match": self.no_match,
+                "duration": duration,
+                "throughput": len(rtts) / duration if duration else 0.0,
+                "bytes": self.bytes,
+                "rtt": {
+                        "mean": sum(rtts) * 1000 / len(rtts) if rtts else 0.0,
+                        "p50": percentile(rtts, 50) * 1000,
+                        "p99": percentile(rtts, 99) * 1000,
+                        "p999": percentile(rtts, 99.9) * 1000,
+                        "max": rtts[-1] * 1000 if rtts else 0.0,
+                        },
+                }
+
+
+def local_face(namespace):
+    """
+    @param namespace - BmsNamespace to populate the server with
+    @return LocalFace of an in-process server on a populated MemoryRepo
+    """
+    from server import RepoServer, create_key_chain
+    from memory_repo import MemoryRepo
+
+    repo = MemoryRepo()
+    for sensor in namespace.sensors:
+        for index in range(namespace.readings):
+            name = namespace.reading_name(sensor, index)
+            repo.add_content_object_to_repo(name, repo.wrap_content(name,
+                    namespace.reading_value(sensor, index)))
+
+    keyChain, certificateName = create_key_chain()
+    return LocalFace(RepoServer(keyChain, certificateName, repo=repo,
+            verbose=False))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="load tests the repo server")
+    parser.add_argument("--local", action="store_true",
+            help="run against an in-process server instead of the forwarder")
+    parser.add_argument("--window", type=int, default=16,
+            help="interests kept outstanding")
+    parser.add_argument("--count", type=int, default=1000,
+            help="number of interests to send")
+    parser.add_argument("--lifetime", type=int, default=4000,
+            help="interest lifetime in ms")
+    parser.add_argument("--fresh", action="store_true",
+            help="ask for fresh data only")
+    parser.add_argument("--workload",
+            help="file with one name per line, optionally followed by "
+            "\"latest\", instead of the synthetic namespace")
+    parser.add_argument("--buildings", type=int, default=2)
+    parser.add_argument("--rooms", type=int, default=10,
+            help="rooms per building")
+    parser.add_argument("--sensors", type=int, default=4,
+            help="sensors per room")
+    parser.add_argument("--readings", type=int, default=10,
+            help="readings per sensor")
+    parser.add_argument("--zipf", type=float, default=1.0,
+            help="skew of the sensor popularity, 0 for uniform")
+    parser.add_argument("--latest-ratio", type=float, default=0.3,
+            help="share of interests asking for the latest reading")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="file to write the json result to")
+    args = parser.parse_args(argv)
+
+    namespace = BmsNamespace(args.buildings, args.rooms, args.sensors,
+            args.readings, seed=args.seed)
+    if args.workload:
+        workload = FileWorkload(args.workload)
+    else:
+        workload = SyntheticWorkload(namespace, args.zipf, args.latest_ratio)
+
+    face = local_face(namespace) if args.local else Face("localhost")
+    generator = LoadGenerator(face, workload, args.window, args.lifetime,
+            args.fresh)
+    result = generator.run(args.count)
+    result["config"] = dict(vars(args))
+    face.shutdown()
+
+    output = json.dumps(result, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    print output
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -16,21 +16,30 @@
 # Author: Zhe Wen <wenzhe@cs.ucla.edu>
 
 
+import os
 import time
+import json
+import argparse
 from pyndn import Name
 from pyndn import Data
+from pyndn import Interest
 from pyndn import Face
-from pyndn.security import KeyType
-from pyndn.security import KeyChain
-from pyndn.security.identity import IdentityManager
-from pyndn.security.identity import MemoryIdentityStorage
-from pyndn.security.identity import MemoryPrivateKeyStorage
 from pyndn.util import Blob
 
-from default_key import DEFAULT_PUBLIC_KEY_DER
-from default_key import DEFAULT_PRIVATE_KEY_DER
-
 from repo import Repo
+from pool import DEFAULT_POOL_SIZE
+from name_tree import NAME_CACHE_SIZE
+from shard import ShardRouter, DEFAULT_SHARD, parse_shard_rules
+from warmup import HotNames, warm_up
+from prefetch import ResponseCache, SegmentPrefetcher, is_plain
+from prefetch import CACHE_SIZE, CACHE_MAX_AGE, PREFETCH_DEPTH
+from commands import InsertProcess, parse_command, COMMAND_PREFIX
+from commands import INSERT, DELETE, INSERT_STATUS, FINISHED_INSERTS
+from commands import FETCH_WINDOW, FETCH_RETRIES, FETCH_LIFETIME
+from commands import STATUS_OK, STATUS_MALFORMED, STATUS_NOT_FOUND, \
+        STATUS_FAILED, STATUS_FORBIDDEN
+from metrics import Metrics, NULL_METRICS, BYTES_OUT
+from metrics import serve_metrics, dump_metrics
 from pyndn import ContentType
 from pyndn import KeyLocatorType
 from pyndn import Sha256WithRsaSignature
@@ -81,40 +90,225 @@ def dump(*list):
     print(result)
 
 class RepoServer(object):
-    def __init__(self, keyChain, certificateName):
+    def __init__(self, keyChain, certificateName, metrics=None,
+            trace_path=None, repo=None, verbose=True, hot_names=None,
+            cache_size=CACHE_SIZE, cache_max_age=CACHE_MAX_AGE,
+            prefetch_depth=PREFETCH_DEPTH, face=None,
+            command_prefix=COMMAND_PREFIX, fetch_window=FETCH_WINDOW,
+            fetch_retries=FETCH_RETRIES, fetch_lifetime=FETCH_LIFETIME,
+            allow_commands=False):
+        """
+        @param keyChain - key chain signing the replies the repo has no
+                          data for and the command replies. None builds one
+                          on first use
+        @param hot_names - HotNames recording the names asked for
+        @param cache_size - number of responses cached, 0 caches none
+        @param prefetch_depth - number of segments read ahead of the one
+                                asked for while an object is read in order,
+                                0 reads none ahead
+        @param face - face inserted data is fetched on. without one, insert
+                      commands are refused
+        @param command_prefix - name prefix of the command interests
+        @param fetch_window - interests kept outstanding per insert
+        @param fetch_retries - times a lost interest of an insert is sent
+                               again before the insert fails
+        @param fetch_lifetime - lifetime of the interests of an insert in ms
+        @param allow_commands - whether to carry out command interests.
+                                they are not authenticated, anyone reaching
+                                the command prefix can insert and delete
+        """
         self._keyChain = keyChain
         self._certificateName = certificateName
-        self.repo = Repo()
+        self.metrics = metrics or NULL_METRICS
+        self.repo = repo or Repo(metrics=self.metrics, trace_path=trace_path)
+        self.verbose = verbose
+        self.hot_names = hot_names
+        self.cache = ResponseCache(cache_size, cache_max_age, self.metrics) \
+                if cache_size else None
+        self.prefetcher = SegmentPrefetcher(self.repo, self.cache,
+                prefetch_depth, self.metrics) \
+                if self.cache and prefetch_depth else None
+
+        self.face = face
+        self.command_prefix = Name(command_prefix)
+        self.fetch_window = fetch_window
+        self.fetch_retries = fetch_retries
+        self.fetch_lifetime = fetch_lifetime
+        self.allow_commands = allow_commands
+        # process id -> InsertProcess, and ids of the finished ones, oldest
+        # first
+        self.inserts = {}
+        self._finished_inserts = []
+        self._next_process_id = 1
+
+    def sign(self, data):
+        if not self._keyChain:
+            self._keyChain, self._certificateName = create_key_chain()
+        with self.metrics.timer("interest.sign"):
+            self._keyChain.sign(data, self._certificateName)
 
     def onInterest(self, prefix, interest, transport, registeredPrefixId):
-        print 'Interest received: %s' % interest.getName().toUri()
+        if self.verbose:
+            print 'Interest received: %s' % interest.getName().toUri()
+        command = parse_command(interest.getName(), self.command_prefix)
+        if command:
+            self.onCommand(command, interest, transport)
+            return
+        if self.hot_names:
+            self.hot_names.record(interest.getName().toUri())
+
+        with self.metrics.request("interest"):
+            # a cached reply needs neither the repo nor encoding
+            encoded_data = self.cache.get(interest) if self.cache else None
+            co = None
+            if not encoded_data:
+                co = self.repo.extract_from_repo(interest)
+            found = encoded_data or co
+            if not found:
+                # Make and sign a Data packet.
+                self.metrics.count("interest.no_match")
+                data = Data(interest.getName())
+                content = "No match found"
+                data.setContent(content)
+                self.sign(data)
+                with self.metrics.timer("interest.wire_encode"):
+                    encoded_data = data.wireEncode().toBuffer()
+            elif co:
+                if self.verbose:
+                    dumpData(co)
+                with self.metrics.timer("interest.wire_encode"):
+                    encoded_data = co.wireEncode().toBuffer()
+                if self.cache and is_plain(interest):
+                    # its expiry is not known, so it is only reused for
+                    # interests that take stale data
+                    self.cache.put(co.getName(), encoded_data)
+
+            self.metrics.count(BYTES_OUT, len(encoded_data))
+            transport.send(encoded_data)
+        if self.verbose:
+            print 'sent'
+
+        # the reply is out, read ahead of the next interests of the object
+        if self.prefetcher and found and is_plain(interest):
+            self.prefetcher.on_served(interest.getName(), co)
+
+    def onCommand(self, command, interest, transport):
+        """
+        @param command - INSERT, DELETE or INSERT_STATUS
+        @param interest - the command interest, its name carries the name
+                          (or process id) the command is about
+        replies with the json status of the command
+        """
+        with self.metrics.request("command.%s" % command):
+            if not self.allow_commands:
+                status = {"status": STATUS_FORBIDDEN,
+                        "error": "commands are disabled"}
+            elif command == INSERT:
+                status = self.insert(interest)
+            elif command == DELETE:
+                status = self.delete(interest)
+            elif command == INSERT_STATUS:
+                status = self.insert_status(interest)
+            else:
+                status = {"status": STATUS_MALFORMED,
+                        "error": "unknown command %s" % command}
+            if self.verbose:
+                print 'Command %s: %s' % (command, json.dumps(status))
 
-        # Make and sign a Data packet.
-        encoded_data = self.repo.extract_from_repo(interest)
-        if not encoded_data:
             data = Data(interest.getName())
-            content = "No match found"
-            data.setContent(content)
-            self._keyChain.sign(data, self._certificateName)
+            data.setContent(json.dumps(status, sort_keys=True))
+            self.sign(data)
             encoded_data = data.wireEncode().toBuffer()
-        else:
-            dumpData(encoded_data)
-            encoded_data = encoded_data.wireEncode().toBuffer()
+            self.metrics.count(BYTES_OUT, len(encoded_data))
+            transport.send(encoded_data)
+
+    def insert(self, interest):
+        """
+        @return status of the insert started for the name in the command
+        """
+        name = Repo.parse_co_name(interest.getName(),
+                self.command_prefix)
+        if name.size() < 2:
+            return {"status": STATUS_MALFORMED,
+                    "error": "cannot insert %s" % name.toUri()}
+        if not self.face:
+            return {"status": STATUS_FAILED, "error": "no face to fetch on"}
 
-        transport.send(encoded_data)
-        print 'sent'
+        process_id = self._next_process_id
+        self._next_process_id += 1
+        process = InsertProcess(process_id, self.face, self.repo, name,
+                self.fetch_window, self.fetch_retries, self.fetch_lifetime,
+                metrics=self.metrics, on_done=self.onInsertDone)
+        self.inserts[process_id] = process
+        process.start()
+        return process.progress()
+
+    def onInsertDone(self, process):
+        if self.cache:
+            self.cache.invalidate(process.prefix or process.name)
+        self._finished_inserts.append(process.process_id)
+        while len(self._finished_inserts) > FINISHED_INSERTS:
+            del self.inserts[self._finished_inserts.pop(0)]
+
+    def insert_status(self, interest):
+        """
+        @return progress of the insert whose process id is in the command
+        """
+        process_id = interest.getName().get(
+                self.command_prefix.size() + 1).getValue().toRawStr()
+        try:
+            process = self.inserts.get(int(process_id))
+        except ValueError:
+            process = None
+        if not process:
+            return {"status": STATUS_NOT_FOUND,
+                    "error": "no insert %s" % process_id}
+        return process.progress()
+
+    def delete(self, interest):
+        """
+        @return status of the deletion of what the name in the command, with
+        the selectors of the command interest, matches
+        """
+        name = Repo.parse_co_name(interest.getName(),
+                self.command_prefix)
+        if name.size() < 2:
+            return {"status": STATUS_MALFORMED,
+                    "error": "cannot delete %s" % name.toUri()}
+
+        # the selectors of the command select what is deleted
+        target = Interest(interest)
+        target.setName(name)
+        deleted = self.repo.delete_from_repo(target)
+        if self.cache:
+            self.cache.invalidate(name)
+        return {"status": STATUS_OK, "name": name.toUri(),
+                "deleted": deleted}
 
     def onRegisterFailed(self, prefix):
         dump("Register failed for prefix", prefix.toUri())
 
-def main():
-    face = Face("localhost")
+def create_key_chain(face=None):
+    """
+    @param face - face the key chain is used with, if any
+    @return (keyChain, certificateName) signing with the default key
+    """
+    # the security stack is imported on first use, it is not needed to
+    # start serving
+    from pyndn.security import KeyType
+    from pyndn.security import KeyChain
+    from pyndn.security.identity import IdentityManager
+    from pyndn.security.identity import MemoryIdentityStorage
+    from pyndn.security.identity import MemoryPrivateKeyStorage
+    from default_key import DEFAULT_PUBLIC_KEY_DER
+    from default_key import DEFAULT_PRIVATE_KEY_DER
 
     identityStorage = MemoryIdentityStorage()
     privateKeyStorage = MemoryPrivateKeyStorage()
     keyChain = KeyChain(
       IdentityManager(identityStorage, privateKeyStorage), None)
-    keyChain.setFace(face)
+    if face:
+        keyChain.setFace(face)
 
     # Initialize the storage.
     keyName = Name("/testname/DSK-reposerver")
@@ -123,11 +317,95 @@ def main():
     identityStorage.addKey(keyName, KeyType.RSA, Blob(DEFAULT_PUBLIC_KEY_DER))
     privateKeyStorage.setKeyPairForKeyName(
       keyName, DEFAULT_PUBLIC_KEY_DER, DEFAULT_PRIVATE_KEY_DER)
+    return keyChain, certificateName
+
+def main():
+    parser = argparse.ArgumentParser(description="serves the repo")
+    parser.add_argument("--metrics-port", type=int,
+            help="serve /metrics, /metrics.json and /queries.json on this "
+            "local port")
+    parser.add_argument("--metrics-dump",
+            help="periodically write metrics as json to this file")
+    parser.add_argument("--metrics-interval", type=float, default=10.0,
+            help="seconds between metrics dumps")
+    parser.add_argument("--query-trace",
+            help="append a sample of the backend queries to this file")
+    parser.add_argument("--pool-size", type=int, default=DEFAULT_POOL_SIZE,
+            help="number of backend connections kept open")
+    parser.add_argument("--shard", action="append", default=[],
+            metavar="PREFIX=HOST:PORT",
+            help="keep the names under PREFIX in the repo at HOST:PORT, "
+            "e.g. one per building. may be given several times")
+    parser.add_argument("--state-dir", default="~/.bms-repo",
+            help="directory keeping what earlier starts set up and the "
+            "names asked for most, which are read again in the background "
+            "after a start")
+    parser.add_argument("--name-cache", type=int, default=NAME_CACHE_SIZE,
+            help="number of names kept located in memory, 0 keeps none. "
+            "names deleted by other processes are used for up to a minute")
+    parser.add_argument("--cache-size", type=int, default=CACHE_SIZE,
+            help="number of replies cached, 0 caches none")
+    parser.add_argument("--cache-max-age", type=float, default=CACHE_MAX_AGE,
+            help="seconds a reply is cached")
+    parser.add_argument("--prefetch", type=int, default=PREFETCH_DEPTH,
+            help="number of segments read ahead while an object is fetched "
+            "in order, 0 reads none ahead")
+    parser.add_argument("--command-prefix", default=COMMAND_PREFIX,
+            help="name prefix of the insert, delete and insert-status "
+            "command interests")
+    parser.add_argument("--fetch-window", type=int, default=FETCH_WINDOW,
+            help="interests kept outstanding while fetching inserted data")
+    parser.add_argument("--fetch-retries", type=int, default=FETCH_RETRIES,
+            help="times a lost interest for inserted data is sent again")
+    parser.add_argument("--fetch-lifetime", type=int, default=FETCH_LIFETIME,
+            help="lifetime of the interests for inserted data in ms")
+    parser.add_argument("--allow-commands", action="store_true",
+            help="carry out insert and delete command interests. WARNING: "
+            "they are not authenticated, anyone who can send interests to "
+            "the repo can then insert and delete data")
+    args = parser.parse_args()
+    state_dir = os.path.expanduser(args.state_dir)
+
+    metrics = None
+    if args.metrics_port or args.metrics_dump:
+        metrics = Metrics()
+
+    face = Face("localhost")
+
+    repo = Repo(metrics=metrics, trace_path=args.query_trace,
+            pool_size=args.pool_size, state_dir=state_dir,
+            name_cache_size=args.name_cache)
+    shards = {DEFAULT_SHARD: repo}
+    rules = parse_shard_rules(args.shard)
+    for prefix, target in rules:
+        if target not in shards:
+            host, port = target.split(':')
+            shards[target] = Repo(server=host, port=int(port),
+                    metrics=metrics, pool_size=args.pool_size,
+                    state_dir=state_dir, name_cache_size=args.name_cache)
+    router = ShardRouter(shards, rules, metrics) if rules else repo
 
-    echo = RepoServer(keyChain, certificateName)
+    hot_names = HotNames(os.path.join(state_dir, "hot_names.json"))
+    echo = RepoServer(None, None, metrics, repo=router, hot_names=hot_names,
+            cache_size=args.cache_size, cache_max_age=args.cache_max_age,
+            prefetch_depth=args.prefetch, face=face,
+            command_prefix=args.command_prefix,
+            fetch_window=args.fetch_window, fetch_retries=args.fetch_retries,
+            fetch_lifetime=args.fetch_lifetime,
+            allow_commands=args.allow_commands)
+    warm_up(router, hot_names.load(), metrics, cache=echo.cache)
+    hot_names.start_saving()
+    if args.metrics_port:
+        serve_metrics(metrics, args.metrics_port, profiler=repo.executor)
+    if args.metrics_dump:
+        dump_metrics(metrics, args.metrics_dump, args.metrics_interval)
     prefix = Name("/ndn/ucla.edu/bms")
     dump("Register prefix", prefix.toUri())
     face.registerPrefix(prefix, echo.onInterest, echo.onRegisterFailed)
+    if args.allow_commands and not prefix.match(echo.command_prefix):
+        dump("Register prefix", echo.command_prefix.toUri())
+        face.registerPrefix(echo.command_prefix, echo.onInterest,
+                echo.onRegisterFailed)
 
     while True: 
         face.processEvents()
@@ -15,107 +15,320 @@
 #
 # Author: Zhe Wen <wenzhe@cs.ucla.edu>
 
-# REPO prototype on Neo4J unit tests
+# REPO prototype benchmarks
+#
+# populates a repo with a synthetic bms namespace, runs a mixed workload
+# against it and reports throughput and latency percentiles as json, e.g.
+#   python benchmark.py --backend memory --rooms 50 --operations 10000 \
+#       --output result.json --baseline baseline.json
 
 from repo import Repo
+from memory_repo import MemoryRepo
+from workload import BmsNamespace, percentile
+from metrics import Metrics
 from pyndn import Name
 from pyndn import Interest
 from pyndn import Exclude
-from pyndn import Data
-from pyndn import ContentType
-from pyndn import KeyLocatorType
-from pyndn import Sha256WithRsaSignature
-
-from datetime import datetime
-from sys import getsizeof
-
-#def dump(*list):
-#    result = ""
-#    for element in list:
-#        result += (element if type(element) is str else repr(element)) + " "
-#    print(result)
-#
-#def dumpData(data):
-#    dump("name:", data.getName().toUri())
-#    if data.getContent().size() > 0:
-#        # Use join to convert each byte to chr.
-#        dump("content (raw):", "".join(map(chr, data.getContent().buf())))
-#        dump("content (hex):", data.getContent().toHex())
-#    else:
-#        dump("content: <empty>")
-#    if not data.getMetaInfo().getType() == ContentType.BLOB:
-#        dump("metaInfo.type:",
-#             "LINK" if data.getMetaInfo().getType() == ContentType.LINK
-#             else "KEY" if data.getMetaInfo().getType() == ContentType.KEY
-#             else "uknown")
-#    dump("metaInfo.freshnessPeriod (milliseconds):",
-#         data.getMetaInfo().getFreshnessPeriod()
-#         if data.getMetaInfo().getFreshnessPeriod() >= 0 else "<none>")
-#    dump("metaInfo.finalBlockID:",
-#         data.getMetaInfo().getFinalBlockID().toEscapedString()
-#         if data.getMetaInfo().getFinalBlockID().getValue().size() >= 0 
-#         else "<none>")
-#    signature = data.getSignature()
-#    if type(signature) is Sha256WithRsaSignature:
-#        dump("signature.signature:", 
-#             "<none>" if signature.getSignature().size() == 0
-#                      else signature.getSignature().toHex())
-#        if signature.getKeyLocator().getType() != None:
-#            if (signature.getKeyLocator().getType() == 
-#                KeyLocatorType.KEY_LOCATOR_DIGEST):
-#                dump("signature.keyLocator: KeyLocatorDigest:",
-#                     signature.getKeyLocator().getKeyData().toHex())
-#            elif signature.getKeyLocator().getType() == KeyLocatorType.KEYNAME:
-#                dump("signature.keyLocator: KeyName:",
-#                     signature.getKeyLocator().getKeyName().toUri())
-#            else:
-#                dump("signature.keyLocator: <unrecognized KeyLocatorType")
-#        else:
-#            dump("signature.keyLocator: <none>")
+
+from timeit import default_timer
+import argparse
+import time
+import json
+import sys
+
+import compression
+import signing
+
+BACKENDS = {
+        "neo4j": Repo,
+        "memory": MemoryRepo,
+        }
+
+OPERATIONS = ["read", "latest", "exclude", "insert", "delete"]
+DEFAULT_MIX = "read=60,latest=20,exclude=5,insert=10,delete=5"
+
+# relative slowdown tolerated before a result counts as a regression
+DEFAULT_TOLERANCE = 0.1
+
+
+def parse_mix(mix):
+    """
+    @param mix - comma separated list of operation=weight
+    @return dict of operation to weight
+    """
+    weights = {}
+    for item in mix.split(','):
+        operation, weight = item.split('=')
+        if operation not in OPERATIONS:
+            raise ValueError("unknown operation %s" % operation)
+        weights[operation] = float(weight)
+    return weights
+
+
+def compare_to_baseline(result, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    @param result - result of run_workload
+    @param baseline - a previously stored result
+    @param tolerance - relative slowdown tolerated
+    @return list of regressions, as human readable strings
+    """
+    regressions = []
+    for operation, stats in result["operations"].items():
+        base = baseline["operations"].get(operation)
+        if not base:
+            continue
+        for key in ["p50", "p99"]:
+            if stats[key] > base[key] * (1 + tolerance):
+                regressions.append("%s %s %.3f ms (baseline %.3f ms)" % (
+                        operation, key, stats[key], base[key]))
+        if stats["throughput"] < base["throughput"] * (1 - tolerance):
+            regressions.append("%s throughput %.1f/s (baseline %.1f/s)" % (
+                    operation, stats["throughput"], base["throughput"]))
+    return regressions
 
 
 class BenchmarkRepo(object):
 
-    def __init__(self, clear=False):
-        self.repo = Repo(clear=clear)
-
-    def benchmark_write(self):
-        name = "/ndn/ucla.edu/bms/building:melnitz/room:1451/seg0"
-        content = "melnitz.1451.seg0"
-        data = self.repo.wrap_content(name, content)
-        data_size = getsizeof(data)
-
-        volume = 0
-        start_time = datetime.now()
-        for i in range(100):
-            self.repo.add_content_object_to_repo(name, data)
-            volume += data_size
-        finish_time = datetime.now()
-        duration = finish_time - start_time
-        print duration, volume
-
-    def benchmark_read(self):
-        # the graph db is queried 2 times per read if does not 
-        # apply selectors. otherwise 4 times queries are needed
-        name = "/ndn/ucla.edu/bms/building:melnitz/room:1451/seg0"
-        content = "melnitz.1451.seg0"
+    def __init__(self, repo, namespace):
+        self.repo = repo
+        self.namespace = namespace
+        self.random = namespace.random
+        # sensor -> indexes of the readings currently stored, oldest first
+        self.stored = {}
+
+    def populate(self):
+        start_time = default_timer()
+        for sensor in self.namespace.sensors:
+            self.stored[sensor] = []
+            for index in range(self.namespace.readings):
+                self.insert(sensor, index)
+        duration = default_timer() - start_time
+        print 'populated %d names in %.2f s' % (self.namespace.size(),
+                duration)
+
+    def insert(self, sensor, index):
+        name = self.namespace.reading_name(sensor, index)
+        data = self.repo.wrap_content(name,
+                self.namespace.reading_value(sensor, index))
+        self.repo.add_content_object_to_repo(name, data)
+        self.stored[sensor].append(index)
+
+    @staticmethod
+    def interest(name):
         interest = Interest(Name(name))
-        data = self.repo.wrap_content(name, content)
-        data_size = getsizeof(data)
-
-        volume = 0
-        start_time = datetime.now()
-        for i in range(1):
-            self.repo.extract_from_repo(interest)
-            volume += data_size
-        finish_time = datetime.now()
-        duration = finish_time - start_time
-        print duration, volume
-
-    def run_benchmark(self):
-#        self.benchmark_write()
-        self.benchmark_read()
+        interest.setMustBeFresh(False)
+        return interest
+
+    def prepare(self, operation):
+        """
+        @return a callable running one operation of the given kind. anything
+        that is not part of the operation (e.g. signing) happens here
+        """
+        sensor = self.namespace.random_sensor()
+        if operation == "read":
+            if not self.stored[sensor]:
+                return None
+            index = self.random.choice(self.stored[sensor])
+            interest = self.interest(
+                    self.namespace.reading_name(sensor, index))
+            return lambda: self.repo.extract_from_repo(interest)
+        elif operation == "latest":
+            interest = self.interest(sensor)
+            interest.setChildSelector(1)
+            return lambda: self.repo.extract_from_repo(interest)
+        elif operation == "exclude":
+            room, excluded = sensor.rsplit('/', 1)
+            interest = self.interest(room)
+            exclude = Exclude()
+            exclude.appendComponent(excluded)
+            interest.setExclude(exclude)
+            interest.setChildSelector(0)
+            return lambda: self.repo.extract_from_repo(interest)
+        elif operation == "insert":
+            stored = self.stored[sensor]
+            index = stored[-1] + 1 if stored else 0
+            name = self.namespace.reading_name(sensor, index)
+            data = self.repo.wrap_content(name,
+                    self.namespace.reading_value(sensor, index))
+            stored.append(index)
+            return lambda: self.repo.add_content_object_to_repo(name, data)
+        elif operation == "delete":
+            # expire the oldest reading of the sensor
+            if not self.stored[sensor]:
+                return None
+            index = self.stored[sensor].pop(0)
+            name = self.namespace.reading_name(sensor, index)
+            return lambda: self.repo.delete_prefix(name)
+
+    def run_workload(self, weights, count):
+        """
+        @param weights - dict of operation to weight
+        @param count - number of operations to run
+        @return dict with throughput and latency percentiles (in ms) per
+        operation and overall
+        """
+        operations = [operation for operation in OPERATIONS
+                if weights.get(operation)]
+        total_weight = sum([weights[operation] for operation in operations])
+
+        latencies = dict([(operation, []) for operation in operations])
+        for i in range(count):
+            pick = self.random.random() * total_weight
+            for operation in operations:
+                pick -= weights[operation]
+                if pick < 0:
+                    break
+            run = self.prepare(operation)
+            if not run:
+                continue
+
+            start_time = default_timer()
+            run()
+            latencies[operation].append(default_timer() - start_time)
+
+        result = {"operations": {}}
+        for operation, _latencies in latencies.items() + [
+                ("total", sum(latencies.values(), []))]:
+            _latencies.sort()
+            duration = sum(_latencies)
+            stats = {
+                    "count": len(_latencies),
+                    "throughput": len(_latencies) / duration
+                            if duration else 0.0,
+                    "p50": percentile(_latencies, 50) * 1000,
+                    "p99": percentile(_latencies, 99) * 1000,
+                    "p999": percentile(_latencies, 99.9) * 1000,
+                    }
+            if operation == "total":
+                result["total"] = stats
+            else:
+                result["operations"][operation] = stats
+
+        return result
+
+    def benchmark_compression(self, count=1000):
+        # compression ratio and per-read decompression cost of each codec,
+        # on cos shaped like bms readings
+        names = ["/ndn/ucla.edu/bms/building:melnitz/room:%d/temp/%d" % (
+                1400 + i % 50, 1395000000 + i) for i in range(count)]
+        packets = [self.repo.wrap_content(name, "%.2f" % (20 + i % 13 * 0.1))
+                for i, name in enumerate(names)]
+        raw_size = sum([len(packet) for packet in packets])
+
+        configs = [(codec, None) for codec in compression.available_codecs()]
+        if compression.CODEC_ZSTD in compression.available_codecs():
+            dictionary = compression.train_dictionary("/ndn/ucla.edu/bms",
+                    packets)
+            configs.append((compression.CODEC_ZSTD, dictionary))
+
+        for codec, dictionary in configs:
+            stored = [compression.compress(packet, codec, dictionary)
+                    for packet in packets]
+            stored_size = sum([len(data) for _, data in stored])
+
+            start_time = default_timer()
+            for _codec, data in stored:
+                compression.decompress(data, _codec, dictionary)
+            duration = default_timer() - start_time
+
+            print '%s%s ratio %.2f read cost %.1f us' % (codec,
+                    '+dict' if dictionary else '',
+                    float(raw_size) / stored_size, duration * 1e6 / count)
+
+    def benchmark_signing(self, count=1000):
+        # packets wrapped per second of cpu time, i.e. per core, in each
+        # signing mode, on cos shaped like bms readings
+        names = ["/ndn/ucla.edu/bms/building:melnitz/room:%d/temp/%d" % (
+                1400 + i % 50, 1395000000 + i) for i in range(count)]
+        policy = self.repo.signing_policy
+        try:
+            for mode in [signing.SIGN_RSA, signing.SIGN_DIGEST,
+                    signing.SIGN_HMAC, signing.SIGN_ECDSA]:
+                if mode not in signing.available_modes():
+                    print '%s not supported by the installed pyndn' % mode
+                    continue
+                self.repo.signing_policy = signing.SigningPolicy(
+                        default=mode, key_chain=self.repo.key_chain,
+                        hmac_key="benchmark")
+                # key set up is not part of the measurement
+                self.repo.wrap_content(names[0], "20.00")
+
+                start_time = time.clock()
+                for i, name in enumerate(names):
+                    self.repo.wrap_content(name, "%.2f" % (20 + i % 13 * 0.1))
+                duration = time.clock() - start_time
+
+                print '%s %.0f packets/s/core' % (mode, count / duration)
+        finally:
+            self.repo.signing_policy = policy
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="benchmarks the repo")
+    parser.add_argument("--backend", choices=sorted(BACKENDS.keys()),
+            default="memory")
+    parser.add_argument("--clear", action="store_true",
+            help="clear the backend before populating it")
+    parser.add_argument("--buildings", type=int, default=2)
+    parser.add_argument("--rooms", type=int, default=10,
+            help="rooms per building")
+    parser.add_argument("--sensors", type=int, default=4,
+            help="sensors per room")
+    parser.add_argument("--readings", type=int, default=10,
+            help="readings per sensor stored before the workload runs")
+    parser.add_argument("--operations", type=int, default=1000)
+    parser.add_argument("--mix", default=DEFAULT_MIX,
+            help="operation weights, e.g. %s" % DEFAULT_MIX)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="file to write the json result to")
+    parser.add_argument("--baseline", help="json result to compare against")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--compression", action="store_true",
+            help="only benchmark the compression codecs")
+    parser.add_argument("--signing", action="store_true",
+            help="only benchmark the signing modes")
+    parser.add_argument("--metrics", action="store_true",
+            help="include per stage metrics of the workload in the result")
+    args = parser.parse_args(argv)
+
+    metrics = Metrics() if args.metrics else None
+    repo = BACKENDS[args.backend](clear=args.clear, metrics=metrics)
+    namespace = BmsNamespace(args.buildings, args.rooms, args.sensors,
+            args.readings, seed=args.seed)
+    benchmarker = BenchmarkRepo(repo, namespace)
+    if args.compression:
+        benchmarker.benchmark_compression()
+        return 0
+    if args.signing:
+        benchmarker.benchmark_signing()
+        return 0
+
+    benchmarker.populate()
+    if metrics:
+        metrics.reset()
+    result = benchmarker.run_workload(parse_mix(args.mix), args.operations)
+    result["config"] = dict(vars(args))
+    if metrics:
+        result["metrics"] = metrics.snapshot()
+    if hasattr(repo, "memory_usage"):
+        result["memory"] = repo.memory_usage()
+
+    output = json.dumps(result, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    print output
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(result, baseline, args.tolerance)
+        for regression in regressions:
+            print 'REGRESSION: %s' % regression
+        if regressions:
+            return 1
+
+    return 0
 
 if __name__ == '__main__':
-    benchmarker = BenchmarkRepo(clear=False)
-    benchmarker.run_benchmark()
+    sys.exit(main(sys.argv[1:]))
@@ -18,6 +18,7 @@
 # REPO prototype on Neo4J unit tests
 
 from repo import Repo
+from memory_repo import MemoryRepo
 from pyndn import Name
 from pyndn import Interest
 from pyndn import Exclude
@@ -26,6 +27,34 @@ from pyndn import ContentType
 from pyndn import KeyLocatorType
 from pyndn import Sha256WithRsaSignature
 
+import hashlib
+import threading
+import time
+import collections
+import json
+import tempfile
+import shutil
+import os
+import sys
+
+import compression
+from metrics import Metrics, NULL_METRICS
+from pool import ConnectionPool
+from query import QueryExecutor
+from name_tree import NameCache
+from shard import ShardRouter, DEFAULT_SHARD
+from warmup import HotNames, warm_up
+from workload import percentile
+from prefetch import ResponseCache, SegmentPrefetcher
+import signing
+from signing import SigningPolicy
+from repo_exceptions import SigningException, UnsupportedQueryException
+from server import RepoServer, create_key_chain
+from loadgen import LocalFace, LocalTransport
+from commands import command_name, INSERT, DELETE, INSERT_STATUS
+from commands import STATUS_IN_PROGRESS, STATUS_OK, STATUS_MALFORMED, \
+        STATUS_NOT_FOUND, STATUS_FORBIDDEN
+
 def dump(*list):
     result = ""
     for element in list:
@@ -71,10 +100,57 @@ def dumpData(data):
             dump("signature.keyLocator: <none>")
 
 
+class ProducerFace(object):
+    """
+    stands in for the face of a producer, answering the interests of an
+    insert with the first co under the interest name, from an OrderedDict
+    of wired cos by uri. interests for a name in drops get no answer, as
+    many times as drops says
+    """
+    def __init__(self, store, drops=None):
+        self.store = store
+        self.drops = drops or {}
+        self.pending = collections.deque()
+        self.sent = 0
+        self.max_outstanding = 0
+
+    def expressInterest(self, interest, onData, onTimeout):
+        self.pending.append((Interest(interest), onData, onTimeout))
+        self.sent += 1
+        self.max_outstanding = max(self.max_outstanding, len(self.pending))
+
+    def processEvents(self):
+        while self.pending:
+            interest, onData, onTimeout = self.pending.popleft()
+            uri = interest.getName().toUri()
+            names = [name for name in self.store
+                    if interest.getName().match(Name(name))]
+            if self.drops.get(uri):
+                self.drops[uri] -= 1
+                onTimeout(interest)
+            elif names:
+                data = Data()
+                data.wireDecode(bytearray(self.store[names[0]]))
+                onData(interest, data)
+            else:
+                onTimeout(interest)
+
+
+def send_command(server, name):
+    """
+    @return the json status the server replies to the command with
+    """
+    transport = LocalTransport()
+    server.onInterest(None, Interest(name), transport, 0)
+    data = Data()
+    data.wireDecode(bytearray(transport.sent[0]))
+    return json.loads(data.getContent().toRawStr())
+
+
 class TestRepo(object):
 
-    def __init__(self, clear=False):
-        self.repo = Repo(clear=clear)
+    def __init__(self, clear=False, backend=Repo):
+        self.repo = backend(clear=clear)
         print 'Original Data:'
         self.repo.print_tree()
 
@@ -147,13 +223,827 @@ class TestRepo(object):
             print 'Deleted Name: %s' % name
         self.repo.print_tree()
 
+    def test_delete_prefix(self):
+        print 'Testing Prefix Deletion ...'
+        self.test_add_content_object_to_repo()
+        name = "/ndn/ucla.edu/bms/building:melnitz"
+        removed = self.repo.delete_prefix(name)
+        print 'Deleted Prefix: %s Nodes: %d' % (name, removed)
+        interest = Interest(Name(name + "/room:1453/seg0"))
+        assert(not self.repo.extract_from_repo(interest))
+        interest = Interest(Name("/ndn/ucla.edu/bms/building:strathmore"))
+        assert(self.repo.extract_from_repo(interest))
+        self.repo.print_tree()
+
+    def test_delete_stale(self):
+        print 'Testing Deletion of Stale Data ...'
+        prefix = "/ndn/ucla.edu/bms/building:melnitz/room:1451/temp"
+        names = ["%s/%d" % (prefix, 1395000000 + i) for i in range(2)]
+        for name in names:
+            # stale as soon as it arrives
+            self.repo.add_content_object_to_repo(name,
+                    self.repo.wrap_content(name, "21.50", freshness_period=0))
+        time.sleep(0.01)
+        # interests ask for fresh data by default, deletes ignore that
+        interest = Interest(Name(names[0]))
+        assert(interest.getMustBeFresh())
+        assert(self.repo.delete_from_repo(interest) > 0)
+        interest = Interest(Name(prefix))
+        interest.setChildSelector(1)
+        assert(self.repo.delete_from_repo(interest) > 0)
+        for name in names:
+            interest = Interest(Name(name))
+            interest.setMustBeFresh(False)
+            assert(not self.repo.extract_from_repo(interest))
+
+    def test_prune_depth(self):
+        print 'Testing Pruning Depth ...'
+        prefix = "/ndn/ucla.edu/prune/building:boelter"
+        name = prefix + "/room:4805/seg0"
+        self.repo.add_content_object_to_repo(name,
+                self.repo.wrap_content(name, "boelter.4805.seg0"))
+        removed = self.repo.delete_from_repo(Interest(Name(name)))
+        print 'Deleted: %s Nodes: %d' % (name, removed)
+        # the components under the locked prefix are pruned
+        assert(not self.repo.locate_last_node(Name(prefix)))
+        if isinstance(self.repo, MemoryRepo):
+            # prunes shared components under its structural lock instead
+            return
+        # the ones shared with other prefixes are kept for their writers
+        assert(self.repo.locate_last_node(Name("/ndn/ucla.edu/prune")))
+        self.repo.delete_prefix("/ndn/ucla.edu/prune")
+
+    def test_key_locator(self):
+        print 'Testing PublisherPublicKeyLocator ...'
+        name = "/ndn/ucla.edu/bms/building:melnitz/room:1451/seg0"
+        data = self.repo.wrap_content(name, "melnitz.1451.seg0")
+        self.repo.add_content_object_to_repo(name, data)
+        key_names = [
+                "/ndn/bms/KEY/DSK-default/ID-CERT",
+                "/ndn/bms/KEY/DSK-other/ID-CERT",
+                ]
+        expected = [True, False]
+        for key_name, found in zip(key_names, expected):
+            interest = Interest(Name(name))
+            interest.getKeyLocator().setType(KeyLocatorType.KEYNAME)
+            interest.getKeyLocator().setKeyName(Name(key_name))
+            data = self.repo.extract_from_repo(interest)
+            print 'KeyLocator: %s Found: %s' % (key_name, bool(data))
+            assert(bool(data) == found)
+
+    def test_must_be_fresh(self):
+        print 'Testing MustBeFresh ...'
+        names = [
+                "/ndn/ucla.edu/bms/building:melnitz/room:1451/seg0",
+                "/ndn/ucla.edu/bms/building:melnitz/room:1453/seg0",
+                ]
+        freshness_periods = [60000, 0]
+        for name, freshness_period in zip(names, freshness_periods):
+            data = self.repo.wrap_content(name, name,
+                    freshness_period=freshness_period)
+            self.repo.add_content_object_to_repo(name, data)
+        expected = [True, False]
+        for name, found in zip(names, expected):
+            interest = Interest(Name(name))
+            interest.setMustBeFresh(True)
+            data = self.repo.extract_from_repo(interest)
+            print 'Fresh Name: %s Found: %s' % (name, bool(data))
+            assert(bool(data) == found)
+            interest.setMustBeFresh(False)
+            assert(self.repo.extract_from_repo(interest))
+
+    def test_implicit_digest(self):
+        print 'Testing Implicit Digest ...'
+        name = "/ndn/ucla.edu/bms/building:melnitz/room:1451/seg0"
+        data = self.repo.wrap_content(name, "melnitz.1451.seg0")
+        # writing the same co again must not create a second payload
+        self.repo.add_content_object_to_repo(name, data)
+        self.repo.add_content_object_to_repo(name, data)
+        digests = [
+                hashlib.sha256(data).digest(),
+                hashlib.sha256(name).digest(),
+                ]
+        expected = [True, False]
+        typed = hasattr(Name.Component, "fromImplicitSha256Digest")
+        if not typed:
+            print 'typed digest components not supported by PyNDN, skipped'
+        for digest, found in zip(digests, expected):
+            digest_hex = digest.encode("hex")
+            names = [
+                    # generic text component
+                    Name(name).append("sha256digest=" + digest_hex),
+                    # parsed from the uri, typed with newer PyNDN
+                    Name(name + "/sha256digest=" + digest_hex),
+                    ]
+            if typed:
+                names.append(Name(name).append(
+                        Name.Component.fromImplicitSha256Digest(digest)))
+            for digest_name in names:
+                result = self.repo.extract_from_repo(Interest(digest_name))
+                print 'Digest: %s Found: %s' % (digest_hex, bool(result))
+                assert(bool(result) == found)
+
+    def test_compression(self):
+        print 'Testing Compression ...'
+        if compression.CODEC_ZSTD not in compression.available_codecs():
+            print 'zstandard not installed, skipped'
+            return
+        if isinstance(self.repo, MemoryRepo):
+            print 'not supported by MemoryRepo, skipped'
+            return
+        repo = Repo(codec=compression.CODEC_ZSTD)
+        prefix = "/ndn/ucla.edu/bms/building:melnitz/room:1451/temp"
+        names = ["%s/%d" % (prefix, 1395000000 + i) for i in range(200)]
+        for name in names[:100]:
+            repo.add_content_object_to_repo(name,
+                    repo.wrap_content(name, name[-4:]))
+        dictionary = repo.train_dictionary(prefix)
+        print 'Trained Dictionary: %s Size: %d' % (dictionary.dict_id,
+                len(dictionary.data))
+        for name in names[100:]:
+            repo.add_content_object_to_repo(name,
+                    repo.wrap_content(name, name[-4:]))
+        for name in names:
+            data = repo.extract_from_repo(Interest(Name(name)))
+            assert(data.getContent().toRawStr() == name[-4:])
+
+    def test_metrics(self):
+        print 'Testing Metrics ...'
+        metrics = self.repo.metrics = Metrics()
+        name = "/ndn/ucla.edu/bms/building:melnitz/room:1451/seg0"
+        self.repo.add_content_object_to_repo(name,
+                self.repo.wrap_content(name, "melnitz.1451.seg0"))
+        self.repo.extract_from_repo(Interest(Name(name)))
+        self.repo.metrics = NULL_METRICS
+        print metrics.to_text()
+        snapshot = metrics.snapshot()
+        for stage in ["insert", "read", "read.locate", "read.selectors",
+                "read.extract", "wire_decode"]:
+            assert(snapshot["stages"][stage]["count"] == 1)
+
+    def test_query_profile(self):
+        print 'Testing Query Profile ...'
+        if isinstance(self.repo, MemoryRepo):
+            print 'not supported by MemoryRepo, skipped'
+            return
+        self.repo.executor.reset()
+        name = "/ndn/ucla.edu/bms/building:melnitz/room:1451/seg0"
+        self.repo.add_content_object_to_repo(name,
+                self.repo.wrap_content(name, "melnitz.1451.seg0"))
+        self.repo.extract_from_repo(Interest(Name(name)))
+        profile = self.repo.executor.profile()
+        for stats in profile:
+            print '%(count)d %(total_ms).2f ms %(template)s' % stats
+        assert(profile)
+        assert(self.repo.executor.slow_queries())
+
+    def test_connection_pool(self):
+        print 'Testing Connection Pool ...'
+        healthy = set()
+        def connect():
+            connection = object()
+            healthy.add(connection)
+            return connection
+        pool = ConnectionPool(connect, size=2,
+                health_check=lambda connection: connection in healthy,
+                check_interval=0)
+        # idle connections are reused
+        with pool.connection() as connection:
+            pass
+        with pool.connection() as _connection:
+            assert(_connection is connection)
+        # connections failing the health check are replaced
+        healthy.clear()
+        with pool.connection() as _connection:
+            assert(_connection is not connection)
+        # no more than size connections are open, whatever the threads
+        in_use = []
+        def work():
+            for i in range(100):
+                with pool.connection() as connection:
+                    in_use.append(pool.snapshot()["in_use"])
+        threads = [threading.Thread(target=work) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        print 'Pool: %s' % pool.snapshot()
+        assert(max(in_use) <= 2)
+        assert(pool.snapshot()["open"] <= 2)
+
+    def test_transaction_sessions(self):
+        print 'Testing Transaction Sessions ...'
+        rollbacks = []
+
+        class Transaction(object):
+            def __init__(self):
+                self.statements = []
+
+            def append(self, query, params=None):
+                self.statements.append(query)
+
+            def commit(self):
+                if "FAIL" in self.statements:
+                    raise Exception("statement failed")
+                return [[query] for query in self.statements]
+
+            def rollback(self):
+                rollbacks.append(self)
+
+        class Session(object):
+            def create_transaction(self):
+                return Transaction()
+
+        sessions = ConnectionPool(Session, size=2)
+        executor = QueryExecutor(None, sessions=sessions)
+        results = executor.execute_transaction([("A", {}), ("B", {})])
+        assert(results == [["A"], ["B"]])
+        # the session is given back, and reused
+        assert(sessions.snapshot()["idle"] == 1)
+        try:
+            executor.execute_transaction([("A", {}), ("FAIL", {})])
+            assert(False)
+        except Exception as ex:
+            assert(str(ex) == "statement failed")
+        # a failed transaction is rolled back and its session discarded
+        print 'Sessions: %s' % sessions.snapshot()
+        assert(len(rollbacks) == 1)
+        assert(sessions.snapshot()["discarded"] == 1)
+        assert(sessions.snapshot()["open"] == 0)
+
+    def test_sharding(self):
+        print 'Testing Sharding ...'
+        shards = {DEFAULT_SHARD: MemoryRepo(), "melnitz": MemoryRepo(),
+                "strathmore": MemoryRepo()}
+        router = ShardRouter(shards, [
+                ("/ndn/ucla.edu/bms/building:melnitz", "melnitz"),
+                ("/ndn/ucla.edu/bms/building:strathmore", "strathmore"),
+                ])
+        names = [
+                "/ndn/ucla.edu/bms/building:melnitz/room:1451/seg0",
+                "/ndn/ucla.edu/bms/building:strathmore/room:1221/seg0",
+                "/ndn/ucla.edu/bms/building:boelter/room:4760/seg0",
+                ]
+        owners = ["melnitz", "strathmore", DEFAULT_SHARD]
+        for name, owner in zip(names, owners):
+            router.add_content_object_to_repo(name,
+                    router.wrap_content(name, name))
+            assert(shards[owner].extract_from_repo(Interest(Name(name))))
+        router.print_tree()
+        # names above the shard prefixes are answered by all shards, in
+        # canonical order
+        interest = Interest(Name("/ndn/ucla.edu/bms"))
+        for child_selector, expected in zip([0, 1], [names[2], names[1]]):
+            interest.setChildSelector(child_selector)
+            data = router.extract_from_repo(interest)
+            print 'ChildSelector: %d Name: %s' % (child_selector,
+                    data.getName().toUri())
+            assert(data.getName().equals(Name(expected)))
+        router.delete_from_repo(interest)
+        assert(not router.extract_from_repo(Interest(Name(names[1]))))
+        assert(router.delete_prefix("/ndn/ucla.edu/bms") > 0)
+        for name in names:
+            assert(not router.extract_from_repo(Interest(Name(name))))
+
+    def test_nested_sharding(self):
+        print 'Testing Nested Shard Rules ...'
+        shards = {DEFAULT_SHARD: MemoryRepo(), "melnitz": MemoryRepo(),
+                "melnitz-1451": MemoryRepo()}
+        building = "/ndn/ucla.edu/bms/building:melnitz"
+        router = ShardRouter(shards, [
+                (building, "melnitz"),
+                (building + "/room:1451", "melnitz-1451"),
+                ])
+        names = [building + "/room:1451/seg0", building + "/room:1453/seg0"]
+        for name in names:
+            router.add_content_object_to_repo(name,
+                    router.wrap_content(name, name))
+        assert(shards["melnitz-1451"].extract_from_repo(
+                Interest(Name(names[0]))))
+        assert(shards["melnitz"].extract_from_repo(Interest(Name(names[1]))))
+        # the building is held by both shards
+        assert(router.route(Name(building)) is None)
+        assert(router.route(Name(names[1])) == "melnitz")
+        interest = Interest(Name(building))
+        interest.setChildSelector(0)
+        data = router.extract_from_repo(interest)
+        print 'Name: %s' % data.getName().toUri()
+        assert(data.getName().equals(Name(names[0])))
+        assert(router.delete_prefix(building) > 0)
+        for name in names:
+            assert(not router.extract_from_repo(Interest(Name(name))))
+
+    def test_memory_usage(self):
+        print 'Testing Memory Usage ...'
+        if not isinstance(self.repo, MemoryRepo):
+            print 'only supported by MemoryRepo, skipped'
+            return
+        repo = MemoryRepo()
+        names = ["/ndn/ucla.edu/bms/building:melnitz/room:%d/temp/%d" % (
+                1451 + i % 2, 1395000000 + i / 2) for i in range(100)]
+        for name in names:
+            repo.add_content_object_to_repo(name, repo.wrap_content(name,
+                    "21.50"))
+        usage = repo.memory_usage()
+        print 'Memory: %s' % usage
+        assert(usage["names"] == 100)
+        # timestamps are shared by both rooms
+        assert(usage["components"] < usage["nodes"])
+        repo.delete_prefix("/ndn/ucla.edu/bms/building:melnitz/room:1451")
+        assert(repo.memory_usage()["names"] == 50)
+
+    def test_name_cache(self):
+        print 'Testing Name Cache ...'
+        cache = NameCache(size=3)
+        building = Name("/ndn/ucla.edu/bms/building:melnitz")
+        rooms = [Name(building).append("room:%d" % (1451 + i))
+                for i in range(3)]
+        generation = cache.generation
+        cache.put(building, 10, generation)
+        for i, room in enumerate(rooms[:2]):
+            cache.put(room, 11 + i, generation)
+        assert(cache.get(building) == 10 and cache.get(rooms[1]) == 12)
+        # components above a located name are not located themselves
+        assert(cache.get(Name("/ndn/ucla.edu/bms")) is None)
+        assert(cache.get(rooms[2]) is None)
+
+        # a delete drops the names under the prefix and its ancestors
+        cache.invalidate(rooms[0])
+        assert(cache.get(rooms[0]) is None and cache.get(building) is None)
+        assert(cache.get(rooms[1]) == 12)
+        # names located while something was deleted are not taken
+        cache.put(rooms[0], 11, generation)
+        assert(cache.get(rooms[0]) is None)
+        generation = cache.generation
+        cache.put(rooms[0], 11, generation)
+        cache.put(building, 10, generation)
+        # full, it starts over
+        cache.put(rooms[2], 13, generation)
+        assert(cache.get(rooms[2]) == 13 and cache.get(rooms[1]) is None)
+
+        cache = NameCache(max_age=0.05)
+        cache.put(building, 10, cache.generation)
+        time.sleep(0.1)
+        assert(cache.get(building) is None)
+
+    def test_warm_up(self):
+        print 'Testing Warm Up ...'
+        names = [
+                "/ndn/ucla.edu/bms/building:melnitz/room:1451/seg0",
+                "/ndn/ucla.edu/bms/building:melnitz/room:1453/seg0",
+                ]
+        for name in names:
+            self.repo.add_content_object_to_repo(name,
+                    self.repo.wrap_content(name, name))
+        directory = tempfile.mkdtemp()
+        try:
+            hot_names = HotNames(os.path.join(directory, "hot_names.json"))
+            for i in range(3):
+                hot_names.record(names[1])
+            hot_names.record(names[0])
+            hot_names.save()
+            # a new start reads the hottest names first
+            loaded = HotNames(hot_names.path).load()
+            print 'Hot Names: %s' % loaded
+            assert(loaded == [names[1], names[0]])
+            metrics = Metrics()
+            cache = ResponseCache()
+            warm_up(self.repo, loaded, metrics, cache=cache).join()
+            assert(metrics.snapshot()["counters"]["warm_up.names"] == 2)
+            # the server answers the hot names from its cache right away
+            for name in names:
+                assert(cache.contains(Name(name)))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_concurrency(self):
+        print 'Testing Concurrent Readers and Writers ...'
+        prefix = "/ndn/ucla.edu/bms/building:melnitz/room:1451/temp"
+        names = ["%s/%d" % (prefix, 1395000000 + i) for i in range(20)]
+        packets = [[self.repo.wrap_content(name, "%s.v%d" % (name, version))
+                for version in range(2)] for name in names]
+        errors = []
+
+        def write():
+            try:
+                for version in range(2):
+                    for name, versions in zip(names, packets):
+                        self.repo.add_content_object_to_repo(name,
+                                versions[version])
+                self.repo.delete_prefix(prefix)
+            except Exception as ex:
+                errors.append(ex)
+
+        def read():
+            try:
+                for i in range(3):
+                    for name in names:
+                        data = self.repo.extract_from_repo(
+                                Interest(Name(name)))
+                        # either no co or a whole one, never a half written
+                        # or half deleted one
+                        if data:
+                            assert(data.getName().equals(Name(name)))
+                            assert(data.getContent().toRawStr().startswith(
+                                    name))
+            except Exception as ex:
+                errors.append(ex)
+
+        threads = [threading.Thread(target=write)] + \
+                [threading.Thread(target=read) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        print 'Errors: %s' % errors
+        assert(not errors)
+        assert(not self.repo.extract_from_repo(Interest(Name(names[0]))))
+
+    def test_concurrent_prefixes(self):
+        print 'Testing Concurrent Writers of Different Prefixes ...'
+        prefixes = ["/ndn/ucla.edu/bms/building:b%d/room:1/temp" % i
+                for i in range(8)]
+        errors = []
+
+        def write(prefix):
+            try:
+                names = ["%s/%d" % (prefix, 1395000000 + i)
+                        for i in range(30)]
+                for round in range(3):
+                    for name in names:
+                        # the same content in every building, so that the
+                        # payloads are shared across prefixes
+                        self.repo.add_content_object_to_repo(name,
+                                self.repo.wrap_content(name,
+                                "reading %d" % (round % 2)))
+                    for name in names:
+                        data = self.repo.extract_from_repo(
+                                Interest(Name(name)))
+                        assert(data.getName().equals(Name(name)))
+                    if round < 2:
+                        self.repo.delete_prefix(prefix)
+            except Exception as ex:
+                errors.append(ex)
+
+        threads = [threading.Thread(target=write, args=(prefix,))
+                for prefix in prefixes]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        print 'Errors: %s' % errors
+        assert(not errors)
+        for prefix in prefixes:
+            interest = Interest(Name(prefix))
+            interest.setChildSelector(1)
+            data = self.repo.extract_from_repo(interest)
+            assert(data.getContent().toRawStr() == "reading 0")
+            assert(self.repo.delete_prefix(prefix))
+
+    def test_concurrent_digests(self):
+        print 'Testing Concurrent Digest Reads ...'
+        names = ["/ndn/ucla.edu/bms/building:b%d/room:1/temp/1395000000" % i
+                for i in range(2)]
+        data = self.repo.wrap_content(names[0], "21.50")
+        digest = hashlib.sha256(data).hexdigest()
+        errors = []
+
+        def write():
+            try:
+                for i in range(200):
+                    self.repo.add_content_object_to_repo(names[0], data)
+                    self.repo.delete_prefix(names[0])
+            except Exception as ex:
+                errors.append(ex)
+
+        def read():
+            # the payload is looked up by digest alone, whatever prefix
+            # holds it
+            interest = Interest(Name(names[1]).append(
+                    "sha256digest=" + digest))
+            try:
+                for i in range(500):
+                    assert(not self.repo.extract_from_repo(interest))
+            except Exception as ex:
+                errors.append(ex)
+
+        threads = [threading.Thread(target=write)] + \
+                [threading.Thread(target=read) for i in range(2)]
+        # switch threads as often as possible, to hit the window between
+        # finding the digest and reading its payload
+        interval = sys.getcheckinterval()
+        sys.setcheckinterval(1)
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            sys.setcheckinterval(interval)
+        print 'Errors: %s' % errors
+        assert(not errors)
+
+    def test_batch_insert(self):
+        print 'Testing Batch Insertion ...'
+        prefix = "/ndn/ucla.edu/bms/building:melnitz/room:1451/temp"
+        names = ["%s/%d" % (prefix, 1395000000 + i) for i in range(10)]
+        # the first co is written again with another value, replacing it
+        items = [(name, self.repo.wrap_content(name, name[-4:]))
+                for name in names] + \
+                [(names[0], self.repo.wrap_content(names[0], "new"))]
+        self.repo.add_content_objects_to_repo(items)
+        for name in names:
+            data = self.repo.extract_from_repo(Interest(Name(name)))
+            value = data.getContent().toRawStr()
+            print 'Batch Name: %s Value: %s' % (name, value)
+            assert(value == ("new" if name == names[0] else name[-4:]))
+        self.repo.delete_prefix(prefix)
+
+    def test_signing_policy(self):
+        print 'Testing Signing Policy ...'
+        policy = SigningPolicy([("/ndn/ucla.edu/bms", signing.SIGN_RSA)],
+                key_chain=self.repo.key_chain)
+        assert(policy.mode(Name("/ndn/ucla.edu/bms/building:melnitz")) ==
+                signing.SIGN_RSA)
+        try:
+            SigningPolicy([("/ndn/ucla.edu/bms", "none")],
+                    key_chain=self.repo.key_chain)
+            assert(False)
+        except SigningException:
+            pass
+
+        # the other modes need a newer pyndn, check what this one supports
+        modes = signing.available_modes()
+        prefix = "/ndn/ucla.edu/bms/building:melnitz/room:1451"
+        rules = [(prefix, signing.SIGN_RSA)] + \
+                [("%s/%s" % (prefix, mode), mode) for mode in modes]
+        policy = self.repo.signing_policy
+        self.repo.signing_policy = SigningPolicy(rules,
+                key_chain=self.repo.key_chain, hmac_key="secret")
+        try:
+            for mode in modes:
+                name = "%s/%s/1395000000" % (prefix, mode)
+                self.repo.add_content_object_to_repo(name,
+                        self.repo.wrap_content(name, mode))
+                data = self.repo.extract_from_repo(Interest(Name(name)))
+                print 'Signing Mode: %s Signature: %s' % (mode,
+                        type(data.getSignature()).__name__)
+                assert(data.getContent().toRawStr() == mode)
+        finally:
+            self.repo.signing_policy = policy
+            self.repo.delete_prefix(prefix)
+
+    def test_extract_segments(self):
+        print 'Testing Segment Extraction ...'
+        prefix = Name("/ndn/ucla.edu/bms/building:melnitz/floorplan")
+        for segment in range(6):
+            name = Name(prefix).appendSegment(segment).toUri()
+            self.repo.add_content_object_to_repo(name,
+                    self.repo.wrap_content(name, "segment %d" % segment))
+
+        # segments past the end of the object are left out
+        components = [Name().appendSegment(segment)[0]
+                for segment in range(2, 8)]
+        segments = self.repo.extract_segments(prefix, components)
+        names = sorted([co.getName().get(-1).toSegment()
+                for co, expiry in segments])
+        print 'Extracted Segments: %s' % names
+        assert(names == [2, 3, 4, 5])
+        for co, expiry in segments:
+            assert(co.getContent().toRawStr() == "segment %d" %
+                    co.getName().get(-1).toSegment())
+            assert(expiry > 0)
+        self.repo.delete_prefix(prefix)
+
+    def test_parse_co_name(self):
+        print 'Testing Command Name Parsing ...'
+        prefix = Name("/ndn/ucla.edu/bms/repo")
+        name = Name("/ndn/ucla.edu/bms/building:melnitz/floorplan")
+        # the components of a signed command interest follow the co's name
+        cmd_interest_name = Name(prefix).append("insert").append(
+                Name.Component(name.toUri())).append("signature")
+        co_name = self.repo.parse_co_name(cmd_interest_name, prefix)
+        print 'Command: %s Name: %s' % (cmd_interest_name.toUri(),
+                co_name.toUri())
+        assert(co_name.equals(name))
+        try:
+            self.repo.parse_co_name(name, prefix)
+            assert(False)
+        except UnsupportedQueryException:
+            pass
+
+    def test_insert_command(self):
+        print 'Testing Insert Commands ...'
+        producer = MemoryRepo()
+        floorplan = Name("/ndn/ucla.edu/bms/building:melnitz/floorplan")
+        store = collections.OrderedDict()
+        for segment in range(30):
+            co = Data(Name(floorplan).appendSegment(segment))
+            co.setContent("floorplan part %d" % segment)
+            co.getMetaInfo().setFinalBlockID(Name().appendSegment(29)[0])
+            producer.signing_policy.sign(co)
+            store[co.getName().toUri()] = co.wireEncode().toRawStr()
+        reading = Name(
+                "/ndn/ucla.edu/bms/building:melnitz/room:1451/temp/1395000000")
+        store[reading.toUri()] = producer.wrap_content(reading, "21.50")
+
+        # segment 3 is lost twice, segment 17 once
+        face = ProducerFace(store, {
+                Name(floorplan).appendSegment(3).toUri(): 2,
+                Name(floorplan).appendSegment(17).toUri(): 1,
+                })
+        keyChain, certificateName = create_key_chain()
+        server = RepoServer(keyChain, certificateName, repo=self.repo,
+                verbose=False, face=face, fetch_window=4, fetch_retries=2)
+        # commands are refused unless enabled
+        status = send_command(server, command_name(INSERT, floorplan))
+        assert(status["status"] == STATUS_FORBIDDEN)
+        server.allow_commands = True
+
+        status = send_command(server, command_name(INSERT, floorplan))
+        assert(status["status"] == STATUS_IN_PROGRESS)
+        process_id = status["process_id"]
+        face.processEvents()
+        status = send_command(server, command_name(INSERT_STATUS,
+                process_id))
+        print 'Insert: %s' % json.dumps(status, sort_keys=True)
+        assert(status["status"] == STATUS_OK)
+        assert(status["inserted"] == 30 and status["segments"] == 30)
+        assert(status["retransmissions"] == 3)
+        # never more interests outstanding than the window
+        assert(face.max_outstanding == 4)
+        interest = Interest(Name(floorplan).appendSegment(17))
+        interest.setMustBeFresh(False)
+        data = self.repo.extract_from_repo(interest)
+        assert(data.getContent().toRawStr() == "floorplan part 17")
+
+        status = send_command(server, command_name(INSERT, reading))
+        face.processEvents()
+        status = send_command(server, command_name(INSERT_STATUS,
+                status["process_id"]))
+        assert(status["status"] == STATUS_OK and status["inserted"] == 1)
+        assert(self.repo.extract_from_repo(Interest(reading)))
+
+        # data nobody answers for fails once the retries are used up
+        missing = Name("/ndn/ucla.edu/bms/building:melnitz/nothing")
+        status = send_command(server, command_name(INSERT, missing))
+        face.processEvents()
+        status = send_command(server, command_name(INSERT_STATUS,
+                status["process_id"]))
+        print 'Insert: %s' % json.dumps(status, sort_keys=True)
+        assert(status["status"] == STATUS_NOT_FOUND)
+        assert(status["retransmissions"] == 2)
+        status = send_command(server, command_name(INSERT_STATUS, 1000))
+        assert(status["status"] == STATUS_NOT_FOUND)
+        status = send_command(server, command_name(INSERT, Name("/ndn")))
+        assert(status["status"] == STATUS_MALFORMED)
+
+        status = send_command(server, command_name(DELETE, floorplan))
+        assert(status["status"] == STATUS_OK and status["deleted"] > 0)
+        self.repo.delete_prefix(reading)
+
+    def test_percentile(self):
+        print 'Testing Percentiles ...'
+        assert(percentile(range(1, 101), 50) == 50)
+        assert(percentile(range(1, 101), 99) == 99)
+        assert(percentile(range(1, 101), 100) == 100)
+        assert(percentile([1, 2, 3, 4], 50) == 2)
+        assert(percentile([1, 2, 3, 4], 0) == 1)
+        assert(percentile([], 50) == 0.0)
+
+    def test_response_cache(self):
+        print 'Testing Response Cache ...'
+        names = [Name("/ndn/ucla.edu/bms/building:melnitz/room:%d/seg0" % (
+                1451 + i)) for i in range(3)]
+        cache = ResponseCache(size=2)
+        for name in names:
+            cache.put(name, name.toUri())
+        # the least recently used co makes way
+        assert(not cache.contains(names[0]))
+        assert(cache.contains(names[1]) and cache.contains(names[2]))
+
+        cache = ResponseCache()
+        now = time.time() * 1000
+        cache.put(names[0], "stale", now - 1000)
+        cache.put(names[1], "fresh", now + 60000)
+        cache.put(names[2], "unknown")
+        interest = Interest(names[0])
+        interest.setMustBeFresh(True)
+        assert(cache.get(interest) is None)
+        interest.setMustBeFresh(False)
+        assert(cache.get(interest) == "stale")
+        interest = Interest(names[1])
+        interest.setMustBeFresh(True)
+        assert(cache.get(interest) == "fresh")
+        # a co of unknown expiry is never fresh
+        interest = Interest(names[2])
+        interest.setMustBeFresh(True)
+        assert(cache.get(interest) is None)
+        # only exactly named cos are answered
+        interest = Interest(names[1])
+        interest.setMustBeFresh(False)
+        interest.setChildSelector(1)
+        assert(cache.get(interest) is None)
+
+        cache = ResponseCache(max_age=0.05)
+        cache.put(names[0], "old")
+        interest = Interest(names[0])
+        interest.setMustBeFresh(False)
+        assert(cache.get(interest) == "old")
+        time.sleep(0.1)
+        assert(cache.get(interest) is None)
+        print 'Cache: %s' % cache.snapshot()
+
+    def test_prefetch(self):
+        print 'Testing Segment Prefetching ...'
+        prefix = Name("/ndn/ucla.edu/bms/building:melnitz/floorplan")
+        for segment in range(20):
+            co = Data(Name(prefix).appendSegment(segment))
+            co.setContent("floorplan part %d" % segment)
+            co.getMetaInfo().setFreshnessPeriod(60000)
+            co.getMetaInfo().setFinalBlockID(Name().appendSegment(19)[0])
+            self.repo.signing_policy.sign(co)
+            self.repo.add_content_object_to_repo(co.getName().toUri(),
+                    co.wireEncode().toRawStr())
+
+        metrics = Metrics()
+        keyChain, certificateName = create_key_chain()
+        server = RepoServer(keyChain, certificateName, metrics,
+                repo=self.repo, verbose=False, prefetch_depth=4)
+        face = LocalFace(server)
+        received = []
+        for segment in range(20):
+            face.expressInterest(Interest(Name(prefix).appendSegment(segment)),
+                    lambda interest, data: received.append(
+                    data.getContent().toRawStr()),
+                    lambda interest: received.append(None))
+            face.processEvents()
+        print 'Cache: %s' % server.cache.snapshot()
+        assert(received == ["floorplan part %d" % segment
+                for segment in range(20)])
+        # only the first segment is read from the repo, the others were read
+        # ahead, depth at a time
+        assert(server.cache.snapshot()["hits"] == 19)
+        assert(metrics.snapshot()["counters"]["prefetch.segments"] == 19)
+        # reported with the other caches
+        response = metrics.snapshot()["caches"]["response"]
+        assert(response["hits"] == 19 and response["misses"] == 1)
+
+        # reads ahead never go past the final block
+        prefetcher = SegmentPrefetcher(self.repo, ResponseCache(), 8)
+        assert(prefetcher.track(Name(prefix).appendSegment(0), 19) == (1, 8))
+        assert(prefetcher.track(Name(prefix).appendSegment(1)) is None)
+        for segment in range(2, 4):
+            assert(prefetcher.track(Name(prefix).appendSegment(segment))
+                    is None)
+        # once half of what was read ahead is used up
+        assert(prefetcher.track(Name(prefix).appendSegment(4)) == (9, 12))
+        prefetcher = SegmentPrefetcher(self.repo, ResponseCache(), 8)
+        assert(prefetcher.track(Name(prefix).appendSegment(0), 3) == (1, 3))
+        assert(prefetcher.track(Name(prefix).appendSegment(1)) is None)
+        assert(prefetcher.track(Name(prefix).appendSegment(2)) is None)
+        assert(prefetcher.track(Name(prefix).appendSegment(3)) is None)
+        # an out of order read does not read ahead
+        assert(prefetcher.track(Name(prefix).appendSegment(7)) is None)
+
+        self.repo.delete_prefix(prefix)
+
     def run_tests(self):
         self.test_add_content_object_to_repo()
         self.test_extract_from_repo()
         self.test_delete_from_repo()
+        self.test_delete_prefix()
+        self.test_delete_stale()
+        self.test_prune_depth()
+        self.test_key_locator()
+        self.test_must_be_fresh()
+        self.test_implicit_digest()
+        self.test_compression()
+        self.test_metrics()
+        self.test_query_profile()
+        self.test_connection_pool()
+        self.test_transaction_sessions()
+        self.test_sharding()
+        self.test_nested_sharding()
+        self.test_memory_usage()
+        self.test_name_cache()
+        self.test_warm_up()
+        self.test_concurrency()
+        self.test_concurrent_prefixes()
+        self.test_concurrent_digests()
+        self.test_batch_insert()
+        self.test_signing_policy()
+        self.test_extract_segments()
+        self.test_parse_co_name()
+        self.test_insert_command()
+        self.test_percentile()
+        self.test_response_cache()
+        self.test_prefetch()
 
 if __name__ == '__main__':
-    tests = TestRepo(clear=True)
+    # "python test_repo.py memory" runs the tests against MemoryRepo
+    backend = MemoryRepo if sys.argv[1:] == ["memory"] else Repo
+    tests = TestRepo(clear=True, backend=backend)
 #    tests.run_tests()
 #    tests = TestRepo(clear=False)
     tests.run_tests()